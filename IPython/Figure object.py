@@ -3,30 +3,469 @@
 
 # <codecell>
 
+import os
+import re
+import time
 import base64
+import hashlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import matplotlib
 from IPython.core.pylabtools import print_figure
 
+# <markdowncell>
+
+# Rendering a large figure to PNG is slow, and `_repr_html_` is called every time the figure is displayed. The rendered images are
+# therefore kept in a `RenderCache`, under a fingerprint of everything that affects how the figure looks: the data and the main
+# properties of each of its artists, the size and resolution of the figure, and the `rcParams`. Computing the fingerprint is much
+# cheaper than rendering, so an unchanged figure comes straight back from the cache, and only figures that have changed are rendered again.
+#
+# The cache holds at most `max_bytes` of images, dropping the least recently used ones. If a `directory` is given, the images are also
+# stored there, each in a file named by the hash of its contents, so that they survive a restart of the kernel.
+
+# <codecell>
+
+_artist_getters = ['get_text', 'get_position', 'get_xlim', 'get_ylim', 'get_xscale', 'get_yscale', 'get_visible', 'get_alpha', 
+                   'get_zorder', 'get_color', 'get_facecolor', 'get_edgecolor', 'get_linewidth', 'get_linestyle', 'get_marker', 
+                   'get_markersize', 'get_fontsize', 'get_xydata', 'get_offsets', 'get_array', 'get_clim', 'get_cmap', 'get_extent', 
+                   'get_size_inches', 'get_dpi', 
+                   # text:
+                   'get_fontproperties', 'get_rotation', 'get_rotation_mode', 'get_horizontalalignment', 'get_verticalalignment', 
+                   'get_multialignment', 'get_linespacing', 'get_wrap', 'get_usetex', 
+                   # lines and markers:
+                   'get_markevery', 'get_markerfacecolor', 'get_markerfacecoloralt', 'get_markeredgecolor', 'get_markeredgewidth', 
+                   'get_fillstyle', 'get_drawstyle', 'get_dash_capstyle', 'get_solid_capstyle', 'get_dash_joinstyle', 
+                   'get_solid_joinstyle', 
+                   # collections, patches and images:
+                   'get_sizes', 'get_hatch', 'get_capstyle', 'get_joinstyle', 'get_fill', 'get_antialiased', 'get_interpolation', 
+                   'get_filternorm', 'get_resample', 
+                   # axes, figures and any artist:
+                   'get_aspect', 'get_frame_on', 'get_frameon', 'get_axisbelow', 'get_clip_on', 'get_rasterized', 'get_snap', 
+                   'get_sketch_params']
+
+
+def _font_key(font):
+    """Everything about a FontProperties that affects how the text is drawn (its repr is just its address)"""
+    
+    return (font.get_family(), font.get_style(), font.get_variant(), font.get_weight(), font.get_stretch(), 
+            font.get_size_in_points(), font.get_file())
+
+
+_address = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def _drawn_rcparams():
+    """The rcParams, without those that only choose the backend or the interactive behaviour (which do not change the drawing)"""
+    
+    return sorted((key, value) for key, value in matplotlib.rcParams.items()
+                  if key not in ('backend', 'backend_fallback', 'interactive', 'toolbar') 
+                  and not key.startswith(('keymap.', 'webagg.')))
+
+
+def _colormap_key(cmap):
+    """The name of a colormap and its table of colors (its repr is just its address)"""
+    
+    return cmap.name, cmap(np.linspace(0, 1, cmap.N))
+
+
+def _update_digest(digest, value):
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(np.ma.getdata(value)).tobytes())
+        if np.ma.is_masked(value):
+            digest.update(np.ascontiguousarray(np.ma.getmaskarray(value)).tobytes())
+    else:
+        # the addresses in the reprs of other objects change from one session to the next, so only their types are used:
+        digest.update(_address.sub("", repr(value.tolist() if isinstance(value, np.ndarray) else value)).encode())
+
+
+def figure_fingerprint(figure, *args, **kwargs):
+    """Hash of the state of a matplotlib figure (and of the rcParams), which changes whenever the way it is drawn changes
+    Any further arguments (e.g. the format and options for print_figure) are included too."""
+    
+    digest = hashlib.sha1()
+    
+    _update_digest(digest, (args, sorted(kwargs.items())))
+    _update_digest(digest, _drawn_rcparams())
+    
+    for artist in figure.findobj():
+        _update_digest(digest, type(artist).__name__)
+        
+        for getter in _artist_getters:
+            method = getattr(artist, getter, None)
+            if method is None:
+                continue
+            try:
+                value = method()
+            except Exception:  # some getters need the artist to be drawn first, or take arguments
+                continue
+            if getter == 'get_fontproperties':
+                value = _font_key(value)
+            elif getter == 'get_cmap' and value is not None:
+                name, value = _colormap_key(value)
+                _update_digest(digest, name)
+            elif not isinstance(value, np.ndarray):
+                try:
+                    value = np.asarray(value) if np.ndim(value) else value
+                except ValueError:  # a tuple of values of different shapes, such as the sketch parameters
+                    pass
+            _update_digest(digest, value)
+            
+        if hasattr(artist, 'get_paths'):
+            for path in artist.get_paths():
+                _update_digest(digest, path.vertices)
+        elif hasattr(artist, 'get_path'):
+            _update_digest(digest, artist.get_path().vertices)
+            if hasattr(artist, 'get_patch_transform'):
+                _update_digest(digest, artist.get_patch_transform().get_matrix())
+                
+    return digest.hexdigest()
+
+# <codecell>
+
+def store_by_content(data, directory, extension):
+    """Write data to a file in directory named by the hash of its contents, unless it is there already; returns the file name"""
+    
+    name = hashlib.sha1(data).hexdigest() + "." + extension
+    path = os.path.join(directory, name)
+    
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.rename(path + ".tmp", path)  # so that a file with this name is always complete
+        
+    return name
+
+
+class RenderCache(object):
+    """Cache of rendered figures, keyed by figure_fingerprint, holding at most max_bytes in memory
+    With a directory, each image is also written there to a file named by the hash of its contents, 
+    with a small file <fingerprint>.ref giving the name of that file."""
+    
+    def __init__(self, max_bytes=2**27, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        
+        self.entries = OrderedDict()  # from least to most recently used
+        self.nbytes = 0
+        self._references = {}  # the number of fingerprints under which each image (by id) is kept, so that it is counted once
+        
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+            
+    def __len__(self):
+        return len(self.entries)
+    
+    def __repr__(self):
+        return "RenderCache with %d images (%d bytes)" % (len(self), self.nbytes)
+    
+    def get(self, fingerprint):
+        if fingerprint in self.entries:
+            self.entries[fingerprint] = self.entries.pop(fingerprint)  # now the most recently used
+            return self.entries[fingerprint]
+        
+        if self.directory is None:
+            return None
+        
+        reference = os.path.join(self.directory, fingerprint + ".ref")
+        if not os.path.exists(reference):
+            return None
+        
+        try:
+            with open(reference) as f:
+                name = f.read().strip()
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+        except (IOError, OSError):  # the image has been deleted since
+            return None
+            
+        self._keep(fingerprint, data)
+        return data
+    
+    def put(self, fingerprint, data, extension="png"):
+        self._keep(fingerprint, data)
+        
+        if self.directory is not None:
+            name = store_by_content(data, self.directory, extension)
+            with open(os.path.join(self.directory, fingerprint + ".ref"), "w") as f:
+                f.write(name)
+                
+    def _keep(self, fingerprint, data):
+        if fingerprint in self.entries:
+            self._drop(self.entries.pop(fingerprint))
+            
+        self.entries[fingerprint] = data
+        self._references[id(data)] = self._references.get(id(data), 0) + 1
+        if self._references[id(data)] == 1:
+            self.nbytes += len(data)
+        
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self._drop(self.entries.popitem(last=False)[1])
+            
+    def _drop(self, data):
+        self._references[id(data)] -= 1
+        if self._references[id(data)] == 0:
+            del self._references[id(data)]
+            self.nbytes -= len(data)
+            
+    def clear(self):
+        self.entries.clear()
+        self._references.clear()
+        self.nbytes = 0
+        
+    def render(self, figure, fmt='png', **kwargs):
+        """The figure rendered by print_figure(figure, fmt, **kwargs), from the cache if it has not changed"""
+        
+        fingerprint = figure_fingerprint(figure, fmt, **kwargs)
+        
+        data = self.get(fingerprint)
+        if data is None:
+            data = print_figure(figure, fmt, **kwargs)
+            if not isinstance(data, bytes):  # SVG comes back as text
+                data = data.encode("utf-8")
+            self.put(fingerprint, data, fmt)
+            
+            # drawing a figure for the first time fills in some of its state (such as the tick labels), 
+            # so the image is also kept under the fingerprint of the figure as drawn:
+            drawn = figure_fingerprint(figure, fmt, **kwargs)
+            if drawn != fingerprint:
+                self.put(drawn, data, fmt)
+            
+        return data
+    
+
+render_cache = RenderCache()
+
+# <codecell>
+
+def test_figure_fingerprint():
+    
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    line, = ax.plot(np.arange(1000), np.arange(1000), marker='o')
+    points = ax.scatter([0, 1], [0, 1])
+    title = ax.set_title("title")
+    
+    changes = [lambda: title.set_fontweight('bold'), lambda: title.set_fontfamily('serif'), lambda: title.set_fontstyle('italic'), 
+               lambda: title.set_fontsize(20), lambda: title.set_rotation(10), lambda: line.set_markevery(500), 
+               lambda: line.set_markerfacecolor('red'), lambda: line.set_drawstyle('steps'), lambda: points.set_sizes([5, 50]), 
+               lambda: points.set_hatch('//'), lambda: ax.set_aspect('equal')]
+    
+    fingerprints = set([figure_fingerprint(figure)])
+    for change in changes:
+        change()
+        fingerprints.add(figure_fingerprint(figure))
+        
+    assert len(fingerprints) == len(changes) + 1
+    
+    # an unchanged figure keeps its fingerprint:
+    assert figure_fingerprint(figure) == figure_fingerprint(figure)
+    
+    
+def _fingerprint_of_example():
+    """The fingerprint of a figure with a scatter plot and an image, built afresh with the default rcParams"""
+    
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    # (not those of the session, which e.g. the inline backend changes)
+    with matplotlib.rc_context():
+        matplotlib.rcdefaults()
+        
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot(121)
+        ax.scatter([0, 1, 2], [2, 0, 1], c=[0, 1, 2], cmap='viridis')
+        figure.add_subplot(122).imshow(np.arange(12.).reshape(3, 4), cmap='copper')
+        
+        return figure_fingerprint(figure, 'png')
+
+
+def test_fingerprint_across_sessions():
+    
+    import sys
+    import subprocess
+    
+    # the same figure built again (with new colormap objects, at other addresses) has the same fingerprint:
+    assert _fingerprint_of_example() == _fingerprint_of_example()
+    
+    # and so does the same figure built in another process, e.g. after restarting the kernel:
+    # (this notebook's code up to the examples, run in a new Python process)
+    script = ("import matplotlib\n"
+              "source = open('Figure object.py').read()\n"
+              "exec(source[:source.index('\\n%matplotlib inline')])\n"
+              "print(_fingerprint_of_example())\n")
+    
+    if os.path.exists('Figure object.py'):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        assert output.decode().strip() == _fingerprint_of_example()
+    
+    
+def test_render_cache():
+    
+    import shutil
+    import tempfile
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    figure = Figure(figsize=(2, 2))
+    FigureCanvasAgg(figure)
+    figure.add_subplot(111).plot([0, 1], [0, 1])
+    
+    directory = tempfile.mkdtemp()
+    cache = RenderCache(directory=directory)
+    
+    data = cache.render(figure)
+    assert cache.render(figure) is data
+    
+    # the image kept under the fingerprints from before and after the first drawing is counted once:
+    assert cache.nbytes == len(data)
+    
+    # an image file deleted from the directory is just a miss:
+    new_cache = RenderCache(directory=directory)
+    for name in os.listdir(directory):
+        if name.endswith(".png"):
+            os.remove(os.path.join(directory, name))
+    assert new_cache.get(figure_fingerprint(figure, 'png')) is None
+    
+    shutil.rmtree(directory)
+
+# <markdowncell>
+
+# By default the image is embedded in the HTML as base64, which makes the notebook about a third larger than the image itself,
+# and has to be parsed again every time the notebook is saved or loaded. With `mode="file"` the image (PNG or SVG) is instead
+# written once to a file in `directory`, named by the hash of its contents, and the HTML just refers to it by its relative path.
+# The defaults can be changed for all figures at once, e.g. `Figure.mode = "file"`.
+
+# <markdowncell>
+
+# `export` writes the same figure in all the formats that are needed at once (e.g. PNG for the notebook and the web, SVG, and PDF for LaTeX),
+# drawing it only once for all the PNGs and encoding them in parallel.
+
 # <codecell>
 
 class Figure(object):
     
-    def __init__(self, figure, caption, label):
+    mode = "inline"  # or "file"
+    format = "png"  # or "svg"
+    directory = "figures"  # for mode="file", relative to the notebook
+    
+    _mime_types = {"png": "image/png", "svg": "image/svg+xml"}
+    
+    def __init__(self, figure, caption, label, cache=render_cache, mode=None, format=None, directory=None):
         self.figure = figure
         self.caption = caption
         self.label = label
+        self.cache = cache
+        
+        if mode is not None:
+            self.mode = mode
+        if format is not None:
+            self.format = format
+        if directory is not None:
+            self.directory = directory
+            
+        if self.mode not in ("inline", "file") or self.format not in self._mime_types:
+            raise ValueError("mode must be 'inline' or 'file', and format 'png' or 'svg'")
+        
+    def image_source(self):
+        """The src of the <img> tag: a data URI (mode="inline") or the relative path of the image file (mode="file")"""
+        
+        # rendered again only if the figure has changed:
+        data = self.cache.render(self.figure, self.format)
+        
+        if self.mode == "file":
+            return "/".join([self.directory, store_by_content(data, self.directory, self.format)])
+        
+        return "data:%s;base64,%s" % (self._mime_types[self.format], base64.b64encode(data).decode('ascii'))
         
     def _repr_html_(self):
         lines = ['<div class="myfigure">']
-        #get figure as PNG:
-        pngdata = print_figure(self.figure, 'png')
-        b64png = base64.b64encode(pngdata)
-        lines.append('<img src=data:png;base64,%s>' % b64png)
+        lines.append('<img src="%s">' % self.image_source())
         
         lines.append("<p>%s</p>" % self.caption)
-        lines.append("<b>%s</b>" % self.name)
+        lines.append("<b>%s</b>" % self.label)
         lines.append("</div>")
         
         return "\n".join(lines)
+    
+    def export(self, basename, formats=(('png', 100), ('png', 300), 'svg', 'pdf'), threads=4):
+        """Save the figure in several formats and resolutions at once, as basename.svg, basename.pdf, basename-300dpi.png, ...
+        
+        formats are names of formats, or (format, dpi) pairs. The figure is drawn only once for all the PNGs, with Agg 
+        at the highest resolution asked for; the other resolutions are resampled from that image, and all of them are encoded 
+        in a pool of threads, while the vector formats (which need their own drawing) are written in this one.
+        
+        Returns an ordered dictionary of the time taken for each step, in seconds.
+        """
+        
+        from PIL import Image
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        formats = [(fmt, None) if isinstance(fmt, str) else tuple(fmt) for fmt in formats]
+        rasters = sorted(set(dpi or self.figure.dpi for fmt, dpi in formats if fmt == 'png'), reverse=True)
+        vectors = [(fmt, dpi) for fmt, dpi in formats if fmt != 'png']
+        
+        timings = OrderedDict()
+        
+        def timed(name, function, *args, **kwargs):
+            start = time.time()
+            function(*args, **kwargs)
+            timings[name] = time.time() - start
+        
+        def png_name(dpi):
+            return "%s-%ddpi.png" % (basename, dpi) if len(rasters) > 1 else basename + ".png"
+        
+        pool = None
+        results = []
+        
+        try:
+            if rasters:
+                figure, canvas, dpi = self.figure, self.figure.canvas, self.figure.dpi
+                
+                def draw():
+                    figure.set_dpi(rasters[0])
+                    agg = FigureCanvasAgg(figure)
+                    agg.draw()
+                    draw.image = Image.fromarray(np.array(agg.buffer_rgba()))
+                    
+                try:
+                    timed("draw at %d dpi" % rasters[0], draw)
+                finally:
+                    figure.set_dpi(dpi)
+                    figure.set_canvas(canvas)
+                    
+                width, height = draw.image.size
+                
+                def encode(dpi):
+                    image = draw.image
+                    if dpi != rasters[0]:
+                        image = image.resize((int(round(width * dpi / rasters[0])), int(round(height * dpi / rasters[0]))), Image.LANCZOS)
+                    image.save(png_name(dpi), dpi=(dpi, dpi))
+                    
+                pool = ThreadPool(min(threads, len(rasters)))
+                results = [pool.apply_async(timed, (png_name(dpi), encode, dpi)) for dpi in rasters]
+                
+            for fmt, dpi in vectors:
+                timed("%s.%s" % (basename, fmt), self.figure.savefig, "%s.%s" % (basename, fmt), format=fmt, dpi=dpi or self.figure.dpi)
+                
+            for result in results:
+                result.get()
+                
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+                
+        return timings
         
     
 
@@ -71,11 +510,12 @@ display(p)
 
 # <codecell>
 
-f = Figure(png_data, "Hello", "name")
+f = Figure(f, "Hello", "name")
 
 # <codecell>
 
-
+%timeit render_cache.clear(); f._repr_html_()
+%timeit f._repr_html_()
 
 # <codecell>
 
@@ -83,4 +523,12 @@ f._repr_html_()
 
 # <codecell>
 
+Figure(f.figure, "Hello", "name", mode="file", format="svg")
+
+# <codecell>
+
+f.export("parabola")
+
+# <codecell>
+
 
@@ -1,60 +1,494 @@
 #!/usr/bin/env python
 
 '''
-Syntax: run_ipynb notebook.ipynb
+Syntax: run_ipynb [-j N] notebook.ipynb|directory|glob ...
 
-Runs the Python code contained in an IPython notebook.
+Runs the Python code contained in IPython notebooks.
+
+The notebooks are read directly (nbformat 3 or 4), and their code cells
+are run one after another inside this process, each notebook in a fresh
+namespace, with its own directory as the working directory. IPython magics
+are removed in memory: %time and %timeit just run their statement (once),
+%%time and %%timeit cells just run their body, and other magics, cell magics
+such as %%bash and shell commands (!) are skipped. Lines inside strings are
+left as they are.
+
+Directories are searched for notebooks, and quoted glob patterns such as
+"dynamical_systems/*.ipynb" are expanded.
+
+With -j N the notebooks are run in parallel by N worker processes (with -j 0,
+one per CPU), each notebook in a process of its own, forked from one in which
+numpy, matplotlib (with the Agg backend) and sympy have already been imported.
+Each notebook's output is captured, and the wall time, peak memory (the rise
+in the peak resident set size above that of the warm worker it started in)
+and traceback of each one are reported at the end.
+
+The exit status is 1 if any notebook failed, and 0 otherwise.
 '''
 
+from __future__ import print_function
 
+import __future__
+import argparse
+import collections
+import glob
+import io
+import json
+import multiprocessing
 import os
+import re
 import sys
-import subprocess
+import time
+import tokenize
+import traceback
 
 try:
-	notebook_file = sys.argv[1]
+	from StringIO import StringIO
+except ImportError:  # Python 3
+	from io import StringIO
+
+try:
+	import resource
+except ImportError:  # Windows
+	resource = None
+
+# figures are drawn off screen; the notebooks call plt.show() for the inline backend
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+# compiler flags set by "from __future__ import ..." in a cell, which IPython keeps for the later cells
+FUTURE_FLAGS = 0
+for feature in __future__.all_feature_names:
+	FUTURE_FLAGS |= getattr(__future__, feature).compiler_flag
+
+# magics whose arguments (or cell body) are run as ordinary Python code
+TIMING_MAGICS = ("time", "timeit")
+
+# the options of %timeit before the statement: -n N, -r N, -p N (with or without a space), -o, -q, and -t and -c of Python 2
+TIMEIT_OPTIONS = re.compile(r"^(\s*-([nrp]\s*\d+|[oqtc])(\s+|$))+")
+
+# the exceptions counted as the failure of a notebook: a notebook calling sys.exit() must not stop the others,
+# but Ctrl-C still does
+NOTEBOOK_ERRORS = (Exception, SystemExit)
+
+
+def read_cells(notebook_file):
+	"""The source of each Python code cell of the notebook, as a list of strings"""
+
+	with io.open(notebook_file, encoding="utf-8") as f:
+		notebook = json.load(f)
+
+	if notebook.get("nbformat", 4) >= 4:
+		cells = [(cell, "source") for cell in notebook["cells"]]
+	else:
+		cells = [(cell, "input") for worksheet in notebook.get("worksheets", [])
+		         for cell in worksheet["cells"]]
+
+	sources = []
+	for cell, key in cells:
+		if cell["cell_type"] != "code" or cell.get("language", "python") != "python":
+			continue
+
+		source = cell.get(key, "")
+		if isinstance(source, list):
+			source = "".join(source)
+		sources.append(source)
+
+	return sources
+
+
+def _string_lines(source):
+	"""The numbers (from 1) of the lines of the source that start inside a string, such as the later lines of a triple-quoted one"""
+
+	lines = set()
+	try:
+		for token in tokenize.generate_tokens(StringIO(source).readline):
+			start, end = token[2][0], token[3][0]
+			lines.update(range(start + 1, end + 1))  # only strings span several lines
+	except (tokenize.TokenError, SyntaxError):  # e.g. a shell command with an unmatched quote: the lines so far are still right
+		pass
+
+	return lines
+
+
+def _timed_statement(magic, arguments):
+	"""The statement timed by %time or %timeit, given the arguments of the magic"""
+
+	return TIMEIT_OPTIONS.sub("", arguments) if magic == "timeit" else arguments
+
+
+def strip_magics(source):
+	"""Python version of the source of a cell, or None if it is a cell magic that is not Python"""
+
+	lines = source.splitlines()
+
+	first = lines[0].strip() if lines else ""
+	if first.startswith("%%"):
+		words = first[2:].split(None, 1)
+		if not words or words[0] not in TIMING_MAGICS:
+			return None
+		# the rest of the first line of %%timeit is its setup statement
+		setup = _timed_statement(words[0], words[1]) if len(words) > 1 else ""
+		lines = ([setup] if setup else []) + lines[1:]
+		source = "\n".join(lines)
+
+	strings = _string_lines(source)
+
+	python = []
+	for number, line in enumerate(lines, 1):
+		stripped = line.lstrip()
+		indent = line[:len(line) - len(stripped)]
+
+		if number in strings:  # e.g. a line of a docstring starting with %
+			pass
+
+		elif stripped.startswith("%"):
+			words = stripped[1:].split(None, 1)
+			statement = _timed_statement(*words) if words and words[0] in TIMING_MAGICS and len(words) > 1 else ""
+			line = indent + (statement or "pass")  # pass keeps an indented block valid
+
+		elif stripped.startswith("!"):
+			line = indent + "pass"
+
+		python.append(line)
+
+	return "\n".join(python) + "\n"
+
+
+def run_notebook(notebook_file):
+	"""Run the code cells of the notebook in a fresh namespace, which is returned
+
+	The notebook's directory is the working directory, and is first on sys.path, while it runs;
+	modules imported from that directory are forgotten afterwards, so that another notebook
+	with a module of the same name gets its own. Exceptions raised by the cells are passed on.
+	"""
+
+	notebook_file = os.path.abspath(notebook_file)
+	directory = os.path.dirname(notebook_file)
+
+	namespace = {"__name__": "__main__", "__file__": notebook_file, "__builtins__": __builtins__}
+
+	cwd = os.getcwd()
+	modules = set(sys.modules)
+	os.chdir(directory)
+	sys.path.insert(0, directory)
+
+	try:
+		flags = 0
+		for k, source in enumerate(read_cells(notebook_file)):
+			source = strip_magics(source)
+			if source is None:
+				continue
+
+			code = compile(source, "%s [cell %d]" % (notebook_file, k + 1), "exec", flags, True)
+			flags |= code.co_flags & FUTURE_FLAGS
+
+			exec(code, namespace)
+
+	finally:
+		os.chdir(cwd)
+		sys.path.remove(directory)
+
+		for name in set(sys.modules) - modules:
+			module_file = getattr(sys.modules[name], "__file__", None) or ""
+			if os.path.dirname(os.path.abspath(module_file)) == directory:
+				del sys.modules[name]
+
+		if "matplotlib.pyplot" in sys.modules:
+			sys.modules["matplotlib.pyplot"].close("all")
+
+	return namespace
+
+
+def find_notebooks(paths):
+	"""The notebooks given by a list of notebook files, directories (searched recursively) and glob patterns"""
+
+	notebook_files = []
+
+	for path in paths:
+		if os.path.isdir(path):
+			for directory, subdirectories, files in os.walk(path):
+				subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))  # e.g. .ipynb_checkpoints
+				notebook_files.extend(os.path.join(directory, f) for f in sorted(files) if f.endswith(".ipynb"))
+
+		elif glob.has_magic(path):
+			notebook_files.extend(sorted(glob.glob(path)))
+
+		else:
+			notebook_files.append(path)
+
+	return notebook_files
+
+
+# Batch mode
+
+# the modules imported before the worker processes are started, so that the notebooks do not each pay for importing them
+WARM_MODULES = ["numpy", "matplotlib", "matplotlib.pyplot", "sympy"]
+
+
+# peak_rss is the rise in the peak resident set size of the process while the notebook ran, in bytes
+NotebookResult = collections.namedtuple("NotebookResult", "notebook passed wall_time peak_rss output traceback")
+
+
+def warm_up():
+	"""Import the modules that most notebooks use, with matplotlib drawing with Agg"""
+
+	for name in WARM_MODULES:
+		try:
+			__import__(name)
+		except ImportError:
+			pass
+
+	if "matplotlib" in sys.modules:
+		sys.modules["matplotlib"].use("Agg")
+
+
+def peak_rss():
+	"""The largest resident set size of this process so far, in bytes (None if it cannot be found)"""
+
+	if resource is None:
+		return None
+
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxrss if sys.platform == "darwin" else maxrss * 1024  # kilobytes on Linux
+
+
+def run_captured(notebook_file):
+	"""Run the notebook, capturing its output and any exception, and return a NotebookResult"""
+
+	stdout, stderr = sys.stdout, sys.stderr
+	sys.stdout = sys.stderr = output = StringIO()
+
+	baseline = peak_rss()  # the modules already imported by warm_up are not the notebook's
+	start = time.time()
+	try:
+		run_notebook(notebook_file)
+		error = None
+	except NOTEBOOK_ERRORS:
+		error = traceback.format_exc()
+	finally:
+		wall_time = time.time() - start
+		sys.stdout, sys.stderr = stdout, stderr
+
+	rss = peak_rss()
+	return NotebookResult(notebook_file, error is None, wall_time, None if rss is None else rss - baseline, output.getvalue(), error)
+
+
+def run_batch(notebook_files, workers=None):
+	"""Run the notebooks in a pool of worker processes, yielding a NotebookResult for each one as it finishes
+
+	Each notebook has a new process (maxtasksperchild=1), so that one cannot change the modules seen by another, and so that
+	its peak memory is its own. The modules in WARM_MODULES are imported here first, and the workers are forked from this
+	process wherever that is possible (even where the default is to spawn them, as on macOS), so that they start with them
+	already imported; elsewhere (on Windows) each worker imports them when it starts.
+	"""
+
+	warm_up()
+
+	try:
+		context = multiprocessing.get_context("fork")
+	except AttributeError:  # Python 2, which forks wherever it can
+		context = multiprocessing
+	except ValueError:  # no fork on this system
+		context = multiprocessing.get_context()
+
+	pool = context.Pool(workers, initializer=warm_up, maxtasksperchild=1)
+	try:
+		for result in pool.imap_unordered(run_captured, notebook_files, chunksize=1):
+			yield result
+	finally:
+		pool.close()
+		pool.join()
+
+
+def report(results):
+	"""Print the result of each notebook, with the tracebacks of those that failed"""
+
+	for result in results:
+		if not result.passed:
+			print("=" * 72)
+			print("FAILED:", result.notebook)
+			print(result.output + result.traceback)
+
+	print("=" * 72)
+	print("%-6s %9s %9s  %s" % ("", "time (s)", "+RSS (MB)", "notebook"))
+
+	for result in results:
+		rss = "%9.1f" % (result.peak_rss / 2.**20) if result.peak_rss is not None else "%9s" % "?"
+		print("%-6s %9.2f %s  %s" % ("ok" if result.passed else "FAILED", result.wall_time, rss, result.notebook))
+
+	print("%d of %d notebooks failed, %.1f s in total" %
+	      (sum(not result.passed for result in results), len(results), sum(result.wall_time for result in results)))
+
+
+def main(notebook_files, jobs=None):
+	"""Run the notebooks one after another in this process or, with jobs, in that many worker processes (all the CPUs for 0)"""
+
+	if jobs is not None:
+		order = dict((notebook_file, k) for k, notebook_file in enumerate(notebook_files))
+		results = []
+
+		start = time.time()
+		for result in run_batch(notebook_files, jobs or None):
+			print("%-6s %s" % ("ok" if result.passed else "FAILED", result.notebook))
+			results.append(result)
+
+		report(sorted(results, key=lambda result: order[result.notebook]))
+		print("Wall time with %d workers: %.1f s" % (jobs or multiprocessing.cpu_count(), time.time() - start))
+
+		return sum(not result.passed for result in results)
+
+	failed = 0
+
+	for notebook_file in notebook_files:
+		print("Running", notebook_file)
+
+		try:
+			run_notebook(notebook_file)
+		except NOTEBOOK_ERRORS:
+			traceback.print_exc()
+			print("FAILED:", notebook_file)
+			failed += 1
+
+	if len(notebook_files) > 1:
+		print("%d of %d notebooks failed" % (failed, len(notebook_files)))
+
+	return failed
+
+
+# Tests
+
+def _write_notebook(notebook_file, sources, nbformat=4):
+	"""Write a notebook with a code cell for each source, and a markdown cell first"""
+
+	if nbformat >= 4:
+		cells = [{"cell_type": "markdown", "metadata": {}, "source": ["# %x\n"]}]
+		cells += [{"cell_type": "code", "metadata": {}, "source": source.splitlines(True), "outputs": [],
+		           "execution_count": None} for source in sources]
+		notebook = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 0}
+	else:
+		cells = [{"cell_type": "markdown", "metadata": {}, "source": ["%x"]}]
+		cells += [{"cell_type": "code", "input": source, "language": "python", "metadata": {}, "outputs": []}
+		          for source in sources]
+		notebook = {"metadata": {"name": ""}, "nbformat": 3, "nbformat_minor": 0, "worksheets": [{"cells": cells, "metadata": {}}]}
+
+	with io.open(notebook_file, "w", encoding="utf-8") as f:
+		f.write(json.dumps(notebook, ensure_ascii=False))
+
+
+def test_strip_magics():
+
+	assert strip_magics("%matplotlib inline\nx = 1") == "pass\nx = 1\n"
+	assert strip_magics("!ls\n%config InlineBackend.figure_format = 'svg'") == "pass\npass\n"
+	assert strip_magics("%%bash\nls") is None
+	assert strip_magics("") == "\n"
+
+	# %time and %timeit run their statement, without the options of %timeit:
+	assert strip_magics("%time x = 1") == "x = 1\n"
+	assert strip_magics("%timeit -n 1 x.sum()") == "x.sum()\n"
+	assert strip_magics("%timeit -n1 -r 3 -o -q x.sum()") == "x.sum()\n"
+	assert strip_magics("%timeit") == "pass\n"
+	assert strip_magics("%time -x") == "-x\n"
+
+	# %%timeit runs its setup statement and its body:
+	assert strip_magics("%%timeit -n 10 y = 2\nx = y") == "y = 2\nx = y\n"
+	assert strip_magics("%%time\nx = 1") == "x = 1\n"
+
+	# indented magics keep the block valid:
+	assert strip_magics("for i in range(3):\n    %timeit -r 1 f(i)\n    !ls") == "for i in range(3):\n    f(i)\n    pass\n"
+
+	# lines inside strings are left alone:
+	source = 'text = """\n%d items\n!important\n"""\n%ls'
+	assert strip_magics(source) == 'text = """\n%d items\n!important\n"""\npass\n'
+	assert strip_magics("!echo it's\nx = '''\n%s\n'''") == "pass\nx = '''\n%s\n'''\n"
+
+
+def test_read_cells():
 
-except:
-	print "Syntax: {} notebook.ipynb".format(sys.argv[0])
-	sys.exit(1)
+	import shutil
+	import tempfile
 
+	directory = tempfile.mkdtemp()
+	try:
+		for nbformat in (3, 4):
+			notebook_file = os.path.join(directory, "cells%d.ipynb" % nbformat)
+			_write_notebook(notebook_file, ["x = 1\ny = 2\n", u"s = u'\u00e9'", ""], nbformat)
+			assert read_cells(notebook_file) == ["x = 1\ny = 2\n", u"s = u'\u00e9'", ""]
 
-command = ['ipython', 'nbconvert', '--format="python"', notebook_file]
-print "Running", command
-subprocess.call(command)
+		# cells in other languages are skipped:
+		notebook_file = os.path.join(directory, "cells3.ipynb")
+		with io.open(notebook_file, encoding="utf-8") as f:
+			notebook = json.load(f)
+		notebook["worksheets"][0]["cells"][1]["language"] = "julia"
+		with io.open(notebook_file, "w", encoding="utf-8") as f:
+			f.write(json.dumps(notebook, ensure_ascii=False))
+		assert read_cells(notebook_file) == [u"s = u'\u00e9'", ""]
 
-basename, ext = os.path.splitext(notebook_file)
+	finally:
+		shutil.rmtree(directory)
 
-script_name = basename + '.py'
 
-print script_name				
+def test_failures():
 
-# nbconvert puts the script inside the nbconvert_build directory
-# Get it out of there!:
-command = ['mv', 'nbconvert_build/%s' % script_name, '.']
-print command
-subprocess.check_call(command)
+	import shutil
+	import subprocess
+	import tempfile
 
+	directory = tempfile.mkdtemp()
+	try:
+		notebooks = {}
+		for name, sources in [("good", ["from __future__ import division", "%time x = 1 / 2", "assert x == 0.5"]),
+		                      ("error", ["x = 1", "1 / 0"]),
+		                      ("exit", ["import sys", "sys.exit(0)"])]:
+			notebooks[name] = os.path.join(directory, name + ".ipynb")
+			_write_notebook(notebooks[name], sources)
 
-# It fails to strip out the IPython magics so we must get rid of them
-# Equivalent to:  awk 'substr($0,1,1) != "%"' notebook.py > notebook.py
+		# the namespace of the notebook is returned, and exceptions (and sys.exit) are passed on:
+		assert run_notebook(notebooks["good"])["x"] == 0.5
+		for name, error in [("error", ZeroDivisionError), ("exit", SystemExit)]:
+			try:
+				run_notebook(notebooks[name])
+			except error:
+				pass
+			else:
+				assert False, name
 
-script_contents = open(script_name, "r").readlines()
-lines = [line for line in script_contents if line[0] != "%"]
-script_contents = ''.join(lines)
+		# each failure is reported, with its traceback and output, and the others still run:
+		result = run_captured(notebooks["error"])
+		assert not result.passed and "ZeroDivisionError" in result.traceback
+		assert run_captured(notebooks["exit"]).passed is False
+		assert run_captured(notebooks["good"]).passed
 
-#print script_contents
+		# in a worker, only the memory that the notebook itself adds is counted, not that of the modules imported by warm_up:
+		results = list(run_batch([notebooks["good"], notebooks["error"]], 1))
+		assert sorted(result.passed for result in results) == [False, True]
+		assert all(result.peak_rss is None or 0 <= result.peak_rss < 2**24 for result in results)
 
-# Output the script back into the same file:
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			assert main([notebooks["good"], notebooks["error"], notebooks["exit"]]) == 2
+			assert main([notebooks["good"]]) == 0
+		finally:
+			sys.stdout = stdout
 
-output = open(script_name, "w")
-output.write(script_contents)
+		# the exit status is 1 if any notebook failed, in both modes:
+		for options in ([], ["-j", "1"]):
+			for names, status in [(["good"], 0), (["good", "error"], 1), (["exit"], 1)]:
+				command = [sys.executable, os.path.abspath(__file__)] + options + [notebooks[name] for name in names]
+				with open(os.devnull, "w") as devnull:
+					assert subprocess.call(command, stdout=devnull, stderr=devnull) == status, (options, names)
 
-# Run the resulting Python script:
+	finally:
+		shutil.rmtree(directory)
 
-#command = ['python', 'script_name']
-execfile(script_name)
-				
 
 
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Runs the Python code contained in IPython notebooks.")
+	parser.add_argument("paths", nargs="+", metavar="notebook", help="notebook files, directories or glob patterns")
+	parser.add_argument("-j", "--jobs", type=int, metavar="N",
+	                    help="run the notebooks in N worker processes (0 for one per CPU)")
+	arguments = parser.parse_args()
 
+	sys.exit(1 if main(find_notebooks(arguments.paths), arguments.jobs) else 0)
@@ -29,6 +29,8 @@
 
 import numpy as np
 from Polygon_class import *
+from Torus_map import *
+from Iterate_cache import *
 
 from matplotlib import pyplot as plt
 
@@ -97,10 +99,14 @@ def map_poly(f, poly):
 
 unit_square = DirectedPolygon([(0.,0.), (1.,0.), (1.,1.), (0.,1.)])
 
-iterates = [unit_square]
+# <markdowncell>
+
+# Iterates that take a while to compute are kept in a cache, which holds at most `max_bytes` of them in memory and saves the rest
+# in the `iterate_cache` directory, so that they are still available after restarting the kernel:
 
 # <codecell>
 
+iterates = IterateCache(max_bytes=2**27, directory="iterate_cache")
 iterates
 
 # <markdowncell>
@@ -127,22 +133,20 @@ plt.axis?
 
 # <markdowncell>
 
-# Let's make a function to calculate (if they are not already available)
-# and draw higher iterates:
+# Let's make a function to calculate and draw higher iterates. Rather than applying `f` over and over again, we can jump straight to 
+# the $n$th iterate using the matrix power $\mathsf{M}^n$; `linear_iterates` does this for all the vertices and all the 
+# iterates $0, 1, \ldots, n$ at once:
 
 # <codecell>
 
 def draw_iterates(n):
     """Draw iterates up to and including the nth"""
     
-    while len(iterates) < n+1:
-        iterates.append(map_poly(f, iterates[-1]))
-        
     plt.grid(True)
     plt.axis('scaled')
     
-    for iterate in iterates[0:n+1]:
-        draw_polygon(iterate)
+    for vertices in linear_iterates(unit_square, range(n+1), M):
+        draw_polygon(DirectedPolygon(vertices))
     
     plt.grid(True)
     plt.axis('scaled')
@@ -212,6 +216,31 @@ plt.arrow(0, 0, v[0,0]*20, v[1, 0]*20, axes=ax1, head_width=0.2, head_length=0.1
 
 draw_iterates(3)
 
+# <markdowncell>
+
+# The logarithms of the eigenvalues are the Lyapunov exponents of the map, the rates at which nearby orbits separate along the unstable
+# subspace and approach each other along the stable one. For nonlinear perturbations of the cat map they can no longer be read off
+# from a single matrix, but `lyapunov_spectrum` estimates them numerically, following the tangent vectors along many orbits at once:
+
+# <codecell>
+
+from Lyapunov import lyapunov_spectrum, perturbed_cat_map, perturbed_cat_map_jacobian
+
+np.log(abs(lamb))
+
+# <codecell>
+
+epsilon = np.linspace(0, 1, 10000)
+x0 = np.random.rand(len(epsilon), 2)
+
+exponents = lyapunov_spectrum(lambda x: perturbed_cat_map(x, epsilon), lambda x: perturbed_cat_map_jacobian(x, epsilon),
+                              x0, 1000, transient=100)
+
+plt.plot(epsilon, exponents[:, 0], ',')
+plt.plot(epsilon, exponents[:, 1], ',')
+plt.xlabel(r"$\epsilon$")
+plt.ylabel("Lyapunov exponents")
+
 # <headingcell level=3>
 
 # Interpolating the Arnold cat map
@@ -349,6 +378,7 @@ sympy.solve(A(alpha)-1, alpha)
 
 # <codecell>
 
+beta = sympy.symbols('beta')
 y(beta).subs({alpha:0.5})
 
 # <codecell>
@@ -360,11 +390,38 @@ origin
 
 new_vertices = lambda alpha, beta: [origin, y(beta), x(alpha), z(beta)]
 
+# <markdowncell>
+
+# Instead of substituting numbers for $\alpha$ and $\beta$ with `subs` and `evalf` one value at a time, we turn the vertices into
+# a NumPy function once, which then gives the vertices for whole arrays of values:
+
 # <codecell>
 
-new_vertices_float = np.array([vertex.subs({alpha:0.5}).evalf() for vertex in new_vertices(alpha, beta)]) 
+from Lambdify_cache import lambdify_cached
+
+vertices_numeric = lambdify_cached(sympy.Matrix.hstack(*new_vertices(alpha, beta)).T, (alpha, beta))
+
+new_vertices_float = vertices_numeric(0.5, 0.5)
 new_vertices_float
 
+# <codecell>
+
+vertices_numeric(0.5, np.linspace(0, 1, 101)).shape
+
+# <markdowncell>
+
+# In the same way, the area $A(\alpha)$ and the matrices $\mathsf{M}_\alpha$ for a whole grid of $\alpha$:
+
+# <codecell>
+
+alphas = np.linspace(0, 1, 1001)
+
+plt.plot(alphas, lambdify_cached(A(alpha), alpha)(alphas))
+plt.xlabel(r"$\alpha$")
+plt.ylabel("area")
+
+lambdify_cached(M(alpha), alpha)(alphas).shape
+
 # <headingcell level=3>
 
 # Correct attempt
@@ -472,6 +529,29 @@ draw_polygon(unit_square)
 draw_polygon(map_poly(lambda x: np.dot(transf,x), unit_square))
 plt.axis('scaled')
 
+# <markdowncell>
+
+# `transf` is a rotation times a stretch times a shear. Interpolating each of these factors from the identity gives a family of
+# area-preserving matrices $\mathsf{M}_t$ going from the identity to the cat map, which `Cat_map_animation` computes for all the frames
+# at once and draws into a stream of PNG files (or a video, with `encoder_writer(ffmpeg_command(...))`):
+
+# <codecell>
+
+from Cat_map_animation import interpolating_matrices, interpolated_vertices, animate_interpolation, png_writer
+
+ts = np.linspace(0, 1, 6)
+for frame in interpolated_vertices(unit_square, ts):
+    draw_polygon(DirectedPolygon(frame))
+plt.axis('scaled')
+
+# <codecell>
+
+import os
+if not os.path.isdir("animation"):
+    os.makedirs("animation")
+
+animate_interpolation(unit_square, png_writer("animation/frame_%04d.png"), frames=100)
+
 # <codecell>
 
 sympy.cos(sympy.atan(
@@ -488,9 +568,78 @@ sympy.cos(_)
 
 # The real Arnold cat map
 
+# <markdowncell>
+
+# The real cat map acts on the torus: after applying $\mathsf{M}$ we reduce mod 1. The image of the unit square is cut up along the 
+# integer lattice and the pieces are translated back into the unit square; this is done by `torus_map`:
+
 # <codecell>
 
-new_square_vertices = [vertex + np.array([10., 0.]) for vertex in unit_square.vertices]
-new_square = DirectedPolygon(new_square_vertices)
-find_starting_point(unit_square, new_square)
+image = torus_map(unit_square, 1, CAT_MAP)
+image
+
+# <codecell>
+
+image.draw()
+plt.axis('scaled')
+plt.xlim(0, 1)
+plt.ylim(0, 1)
+
+# <markdowncell>
+
+# Higher iterates are found in one go using $\mathsf{M}^n$; the 10th iterate already consists of tens of thousands of pieces,
+# so we keep it in the cache:
+
+# <codecell>
+
+image = iterates.iterate(torus_map, unit_square, 10, jump=True)
+image
+
+# <headingcell level=2>
+
+# The cat map on an image
+
+# <markdowncell>
+
+# The pixels of an $N \times N$ image correspond to the lattice points $(i/N, j/N)$ of the torus, which the cat map permutes.
+# Working exactly with integers mod $N$, the image must return to itself after a certain number of steps, the period of the map mod $N$:
+
+# <codecell>
+
+from Lattice_cat_map import *
+
+# <codecell>
+
+N = 101
+cat_map_period(N)
+
+# <codecell>
+
+j, i = np.indices((N, N))
+picture = np.sin(0.1*i) * np.cos(0.05*j)  # anything will do
+
+fig, axes = plt.subplots(1, 4, figsize=(12, 3))
+
+for ax, frame in zip(axes, cat_map_frames(picture)):
+    ax.imshow(frame, origin="lower", interpolation="nearest")
+    
+print np.array_equal(cat_map_image(picture, cat_map_period(N)), picture)
+
+# <markdowncell>
+
+# The permutation of the pixels for each $(N, n)$ is calculated once and cached, so that mapping another image, or the same one again,
+# is a single gather into an array allocated beforehand. Here an RGB image of $4096 \times 4096$ pixels:
+
+# <codecell>
+
+N = 4096
+j, i = np.indices((N, N))
+rgb = np.dstack([(255 * (0.5 + 0.5*np.sin(k * 0.01 * i) * np.cos(0.003 * j))).astype(np.uint8) for k in (1, 2, 3)])
+
+scrambled = np.empty_like(rgb)
+
+%time cat_map_image(rgb, 5, out=scrambled)
+%time cat_map_image(rgb, 5, out=scrambled)
+
+plt.imshow(scrambled[::8, ::8], origin="lower", interpolation="nearest")
 
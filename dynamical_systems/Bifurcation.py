@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Bifurcation diagrams of one-parameter families of maps, such as the logistic family x -> r x (1-x)
+"""
+
+# <codecell>
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+# <markdowncell>
+
+# A bifurcation diagram shows, for each value of the parameter $r$, where the orbits spend their time once the transient has died away.
+# With $10^4$ values of $r$, $10^3$ initial conditions and $10^3$ samples per orbit there are $10^{10}$ points, far too many to keep;
+# instead each sample is counted straight away in a 2D histogram with one row for each value of $r$ and one column for each bin in $x$.
+#
+# The values of $r$ are split into shards, which are handed out to a pool of worker processes. A worker iterates all the orbits of its
+# shard at once, in place, and adds its counts to its own rows of a histogram in shared memory, which is allocated once by the parent
+# process; since no two shards share a row, no locking is needed.
+
+# <codecell>
+
+def logistic_family(r, x, out):
+    """The logistic map x -> r x (1-x), for each row of x with its own value of r (a column), written into out
+    As r (1/4 - (x - 1/2)^2), so that out may be x itself and no temporary arrays are needed."""
+
+    np.subtract(x, 0.5, out=out)
+    np.multiply(out, out, out=out)
+    np.subtract(0.25, out, out=out)
+    np.multiply(out, r, out=out)
+
+    return out
+
+# <codecell>
+
+_shared = {}
+
+
+def _attach_histogram(buffer, shape):
+    """Make the shared histogram available in a worker process"""
+
+    _shared["histogram"] = np.frombuffer(buffer, dtype=np.int64).reshape(shape)
+
+
+def _bifurcation_shard(args):
+    """Iterate the orbits for the values rs[start:stop] and add their samples to the shared histogram"""
+
+    family, rs, start, stop, initial_conditions, transient, samples, x_range, seed = args
+
+    histogram = _shared["histogram"]
+    bins = histogram.shape[1]
+    low, high = x_range
+
+    # the same initial conditions for every r, so that the result does not depend on how rs is split up:
+    r = rs[start:stop, np.newaxis]
+    x = np.empty((stop - start, initial_conditions))
+    x[...] = np.random.RandomState(seed).uniform(low, high, initial_conditions)
+
+    for i in range(transient):
+        family(r, x, out=x)
+
+    counts = np.zeros((stop - start) * bins, dtype=np.int64)
+    row = (np.arange(stop - start) * bins)[:, np.newaxis]
+    scaled = np.empty(x.shape)
+    column = np.empty(x.shape, dtype=np.int64)
+
+    for i in range(samples):
+        family(r, x, out=x)
+
+        np.subtract(x, low, out=scaled)
+        np.multiply(scaled, bins / float(high - low), out=scaled)
+        np.floor(scaled, out=scaled)
+        column[...] = scaled
+
+        inside = (column >= 0) & (column < bins)
+        counts += np.bincount((row + column)[inside], minlength=len(counts))
+
+    histogram[start:stop] += counts.reshape(stop - start, bins)
+
+    return stop - start
+
+
+def bifurcation_diagram(rs, family=logistic_family, initial_conditions=1000, transient=1000, samples=1000,
+                        bins=1000, x_range=(0., 1.), workers=None, shard_size=None, seed=0):
+    """Histogram of the samples x_n, transient <= n < transient + samples, of the orbits of family(r, .)
+    for each value of r in rs
+
+    Parameters
+    ==========
+    rs:
+        the parameter values
+    family:
+        a function family(r, x, out) applying the map with parameters r (a column) to the array x (one row per parameter),
+        writing the result into out; it must be defined at module level, so that it can be sent to the worker processes
+    initial_conditions:
+        the number of orbits for each r, with random initial conditions in x_range (the same ones for each r)
+    workers:
+        the number of processes (by default, one per CPU); with workers=1 everything is done in this process
+    shard_size:
+        the number of values of r handed to a worker at a time (by default, at most about 10^6 orbits, split evenly between the workers)
+
+    Returns an array of counts of shape (len(rs), bins); row k is the histogram for rs[k] over the bins of x_range.
+    """
+
+    rs = np.asarray(rs, dtype=float)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if shard_size is None:
+        shard_size = max(1, min(10**6 // initial_conditions, -(-len(rs) // workers)))
+
+    shape = (len(rs), bins)
+    buffer = multiprocessing.RawArray(ctypes.c_int64, len(rs) * bins)
+
+    shards = [(family, rs, start, min(start + shard_size, len(rs)), initial_conditions, transient, samples, x_range, seed)
+              for start in range(0, len(rs), shard_size)]
+
+    if workers == 1:
+        _attach_histogram(buffer, shape)
+        for shard in shards:
+            _bifurcation_shard(shard)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_attach_histogram, initargs=(buffer, shape))
+        try:
+            for done in pool.imap_unordered(_bifurcation_shard, shards):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    return np.frombuffer(buffer, dtype=np.int64).reshape(shape)
+
+
+def draw_bifurcation_diagram(rs, histogram, x_range=(0., 1.), ax=None, **kwargs):
+    """Show a histogram from bifurcation_diagram, with r horizontally and x vertically, on a logarithmic colour scale"""
+
+    from matplotlib import pyplot as plt
+
+    if ax is None:
+        ax = plt.gca()
+
+    kwargs.setdefault("cmap", "gray_r")
+
+    return ax.imshow(np.log1p(histogram.T), origin="lower", aspect="auto", interpolation="nearest",
+                     extent=(rs[0], rs[-1], x_range[0], x_range[1]), **kwargs)
+
+# <codecell>
+
+def benchmark_bifurcation_diagram(workers=(1, 2, 4, 8), n_r=10**3, initial_conditions=1000, transient=200, samples=200):
+    """Time bifurcation_diagram for the logistic family with each number of worker processes"""
+
+    import time
+
+    rs = np.linspace(2.5, 4, n_r)
+    timings = []
+
+    for n in workers:
+        start = time.time()
+        bifurcation_diagram(rs, initial_conditions=initial_conditions, transient=transient, samples=samples, workers=n)
+        elapsed = time.time() - start
+
+        print("%d workers:  %8.3f s  (%.3g iterations per second)" %
+              (n, elapsed, n_r * initial_conditions * (transient + samples) / elapsed))
+
+        timings.append((n, elapsed))
+
+    return timings
+
+# <codecell>
+
+def test_bifurcation_diagram():
+
+    rs = np.array([2.8, 3.2, 3.5, 3.9])
+
+    histogram = bifurcation_diagram(rs, initial_conditions=50, transient=500, samples=20, bins=100, workers=1)
+
+    assert histogram.shape == (4, 100)
+    assert np.all(histogram.sum(axis=1) == 50 * 20)
+
+    # a fixed point, then cycles of period 2 and 4, then chaos:
+    assert [np.count_nonzero(row) for row in histogram[:3]] == [1, 2, 4]
+    assert np.count_nonzero(histogram[3]) > 20
+    assert histogram[0, int(100 * (1 - 1/2.8))] == 50 * 20
+
+    # the same histogram with several processes and shards:
+    assert np.array_equal(bifurcation_diagram(rs, initial_conditions=50, transient=500, samples=20, bins=100,
+                                              workers=2, shard_size=1), histogram)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Animations of the interpolation between the identity and the cat map, streamed frame by frame to PNG files or a video encoder
+"""
+
+# <codecell>
+
+import threading
+import subprocess
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+from Torus_map import *
+
+# <markdowncell>
+
+# Any matrix $\mathsf{M}$ with positive determinant can be written as $\mathsf{M} = \mathsf{R}(\theta) \, \mathsf{D} \, \mathsf{S}$,
+# a rotation times a diagonal matrix $\mathsf{D} = \mathrm{diag}(a, b)$ times a shear $\mathsf{S} = \begin{pmatrix} 1 & d \\ 0 & 1 \end{pmatrix}$;
+# this is just its QR decomposition, with $\mathsf{R}(\theta) = \mathsf{Q}$. Interpolating each factor separately,
+# $$\mathsf{M}_t = \mathsf{R}(t \theta) \, \mathrm{diag}(a^t, b^t) \, \begin{pmatrix} 1 & t d \\ 0 & 1 \end{pmatrix},$$
+# goes from $\mathsf{M}_0 = \mathsf{I}$ to $\mathsf{M}_1 = \mathsf{M}$, and when $\det \mathsf{M} = 1$, as for the cat map
+# ($\theta = \arctan \frac{1}{2}$, $a = \sqrt{5}$, $d = \frac{3}{5}$), every $\mathsf{M}_t$ preserves area.
+#
+# The matrices for all the frames are calculated at once, as an array of shape `(F, 2, 2)`, and the vertices for all the frames
+# as a single array of shape `(F, N, 2)`.
+
+# <codecell>
+
+def rotation_scaling_shear(M):
+    """Decompose the 2x2 matrix M, with positive determinant, as R(theta) diag(a, b) [[1, d], [0, 1]]
+    Returns (theta, a, b, d)."""
+
+    Q, R = np.linalg.qr(np.asarray(M, dtype=float))
+
+    signs = np.sign(np.diag(R))
+    Q, R = Q * signs, R * signs[:, np.newaxis]  # make the diagonal of R positive
+
+    if np.linalg.det(Q) < 0:
+        raise ValueError("M reverses orientation, so it cannot be reached from the identity by rotating, scaling and shearing")
+
+    return np.arctan2(Q[1, 0], Q[0, 0]), R[0, 0], R[1, 1], R[0, 1] / R[0, 0]
+
+
+def interpolating_matrices(ts, M=CAT_MAP):
+    """The matrices M_t = R(t theta) diag(a^t, b^t) [[1, t d], [0, 1]] interpolating between the identity (t = 0) and M (t = 1),
+    as an array of shape (len(ts), 2, 2)"""
+
+    theta, a, b, d = rotation_scaling_shear(M)
+    ts = np.asarray(ts, dtype=float)
+
+    c, s = np.cos(ts*theta), np.sin(ts*theta)
+    x_scale, y_scale = a**ts, b**ts
+
+    # R(t theta) times the upper triangular matrix [[a^t, a^t t d], [0, b^t]]:
+    matrices = np.empty((len(ts), 2, 2))
+    matrices[:, 0, 0] = c * x_scale
+    matrices[:, 1, 0] = s * x_scale
+    matrices[:, 0, 1] = c * x_scale * ts * d - s * y_scale
+    matrices[:, 1, 1] = s * x_scale * ts * d + c * y_scale
+
+    return matrices
+
+
+def interpolated_vertices(vertices, ts, M=CAT_MAP):
+    """The images of the vertices (an (N,2) array, or a DirectedPolygon) under M_t for each t in ts,
+    as an array of shape (len(ts), N, 2)"""
+
+    if isinstance(vertices, DirectedPolygon):
+        vertices = vertices.vertices
+
+    return np.matmul(np.asarray(vertices, dtype=float), interpolating_matrices(ts, M).transpose(0, 2, 1))
+
+# <markdowncell>
+
+# Frames are drawn one after another with the Agg backend and handed to a `FrameWriter`, a thread that writes them out (to PNG files,
+# or to the standard input of an encoder such as `ffmpeg`) while the next ones are drawn. Its queue holds only a few frames, and the
+# vertices are calculated `chunk_size` frames at a time, so the memory used does not grow with the number of frames.
+
+# <codecell>
+
+class FrameWriter(threading.Thread):
+    """Thread writing the frames (arrays of RGBA pixels) put into it, in order, with write(k, frame)
+
+    At most max_queued frames wait to be written; put blocks until there is room.
+    """
+
+    def __init__(self, write, max_queued=8, close=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.write = write
+        self.close_output = close
+        self.frames = queue.Queue(max_queued)
+        self.error = None
+        self.written = 0
+
+        self.start()
+
+    def run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+
+            if self.error is None:  # after an error, just empty the queue
+                try:
+                    self.write(self.written, frame)
+                    self.written += 1
+                except Exception as error:
+                    self.error = error
+
+    def put(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.frames.put(frame)
+
+    def close(self):
+        """Wait for all the frames to be written"""
+
+        self.frames.put(None)
+        self.join()
+
+        if self.close_output is not None:
+            self.close_output()
+
+        if self.error is not None:
+            raise self.error
+
+
+def png_writer(pattern, max_queued=8):
+    """FrameWriter saving frame k to the PNG file pattern % k, e.g. pattern = "frames/frame_%04d.png" """
+
+    from matplotlib import image
+
+    return FrameWriter(lambda k, frame: image.imsave(pattern % k, frame), max_queued)
+
+
+def encoder_writer(command, max_queued=8):
+    """FrameWriter piping the raw RGBA frames to the standard input of an encoder, started with the given command
+    (a list of arguments, as made by ffmpeg_command)"""
+
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def close():
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError("the encoder %s failed" % command[0])
+
+    return FrameWriter(lambda k, frame: encoder.stdin.write(np.ascontiguousarray(frame).tobytes()), max_queued, close)
+
+
+def ffmpeg_command(filename, width, height, fps=25):
+    """Command for ffmpeg to encode raw RGBA frames of width x height pixels from its standard input into filename"""
+
+    return ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba", "-s", "%dx%d" % (width, height),
+            "-r", str(fps), "-i", "-", "-pix_fmt", "yuv420p", filename]
+
+# <codecell>
+
+def animate_interpolation(vertices, writer, frames=100, M=CAT_MAP, colors=None, chunk_size=32,
+                          size=(4, 4), dpi=100, limits=None, **kwargs):
+    """Draw the interpolation from the identity to M of a polygon (or of a cloud of points) frame by frame,
+    and hand each frame to writer (a FrameWriter), which is closed at the end
+
+    vertices are the vertices of a polygon, or, if colors are given (one for each point, e.g. the pixels of an image), the points
+    to be drawn with those colors. limits = (xmin, xmax, ymin, ymax) defaults to a box holding all the frames.
+    Further keyword arguments are passed to the polygon or to the scatter plot.
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.patches import Polygon
+
+    if isinstance(vertices, DirectedPolygon):
+        vertices = vertices.vertices
+
+    vertices = np.asarray(vertices, dtype=float)
+    ts = np.linspace(0, 1, frames)
+
+    if limits is None:
+        # the images of the corners of the bounding box of the vertices hold the images of all the vertices:
+        (x0, y0), (x1, y1) = vertices.min(axis=0), vertices.max(axis=0)
+        corners = interpolated_vertices(np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)]), ts, M)
+        low, high = corners.min(axis=(0, 1)), corners.max(axis=(0, 1))
+        limits = (low[0], high[0], low[1], high[1])
+
+    figure = Figure(figsize=size, dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_axes([0, 0, 1, 1])
+    ax.set_xlim(limits[0], limits[1])
+    ax.set_ylim(limits[2], limits[3])
+    ax.set_aspect("equal")
+    ax.set_axis_off()
+
+    if colors is None:
+        kwargs.setdefault("alpha", 0.5)
+        artist = ax.add_patch(Polygon(vertices, closed=True, **kwargs))
+        update = artist.set_xy
+    else:
+        kwargs.setdefault("s", 1)
+        artist = ax.scatter(vertices[:, 0], vertices[:, 1], c=colors, lw=0, **kwargs)
+        update = artist.set_offsets
+
+    try:
+        for start in range(0, frames, chunk_size):
+            for frame_vertices in interpolated_vertices(vertices, ts[start:start + chunk_size], M):
+                update(frame_vertices)
+                canvas.draw()
+                writer.put(np.array(canvas.buffer_rgba()))
+    finally:
+        writer.close()
+
+    return writer.written
+
+# <codecell>
+
+def test_interpolating_matrices():
+
+    ts = np.linspace(0, 1, 11)
+    matrices = interpolating_matrices(ts)
+
+    assert np.allclose(matrices[0], np.identity(2))
+    assert np.allclose(matrices[-1], CAT_MAP)
+    assert np.allclose(np.linalg.det(matrices), 1)
+
+    theta, a, b, d = rotation_scaling_shear(CAT_MAP)
+    assert np.allclose([theta, a, d], [np.arctan2(1, 2), np.sqrt(5), 0.6])
+
+    vertices = interpolated_vertices(unit_cell, ts)
+    assert vertices.shape == (11, 4, 2)
+    assert np.allclose(vertices[5], np.dot(unit_cell, matrices[5].T))
+
+
+def test_animate_interpolation():
+
+    import os
+    import tempfile
+    from matplotlib import image
+
+    directory = tempfile.mkdtemp()
+    pattern = os.path.join(directory, "frame_%03d.png")
+
+    written = animate_interpolation(unit_cell, png_writer(pattern, max_queued=2), frames=7, chunk_size=3, size=(1, 1), dpi=50)
+
+    assert written == 7
+    assert sorted(os.listdir(directory)) == ["frame_%03d.png" % k for k in range(7)]
+    assert image.imread(pattern % 6).shape[:2] == (50, 50)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+A bounded cache of the iterates of polygons under maps, which may be kept on disk between sessions
+"""
+
+# <codecell>
+
+import os
+import types
+import hashlib
+import functools
+from collections import OrderedDict
+
+import numpy as np
+from Polygon_class import *
+
+# <markdowncell>
+
+# Iterates are stored under the key (map, initial polygon, n). Maps given as matrices are identified by their entries,
+# and functions by their name, their compiled code and constants, their default arguments, the values they capture in a closure and the
+# global values they refer to (`functools.partial` objects by their function and arguments); the initial polygon is identified by a hash
+# of its vertices. A map that captures something that cannot be identified in this way, such as an arbitrary object, must be given
+# an explicit `key`.
+# When the iterates held in memory take up more than `max_bytes`, the least recently used ones are dropped, after first being
+# written to a `.npz` file if a `directory` was given. Iterates found in the directory are loaded again when needed,
+# so a restarted kernel can carry on where it left off.
+
+# <codecell>
+
+_NAMED = (type, getattr(types, "ClassType", type), types.ModuleType, types.BuiltinFunctionType, np.ufunc)
+
+
+def _qualified_name(f):
+    return "%s.%s" % (getattr(f, "__module__", None) or "", getattr(f, "__qualname__", f.__name__))
+
+
+def _identify(value, digest, seen):
+    """Add to digest everything that determines what value does"""
+
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        digest.update(("%s:%r;" % (type(value).__name__, value)).encode())
+
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError("an array of objects cannot be identified; pass an explicit key")
+        value = np.ascontiguousarray(value)
+        digest.update(("array:%s:%s;" % (value.dtype.str, value.shape)).encode())
+        digest.update(value.tobytes())
+
+    elif isinstance(value, (tuple, list)):
+        digest.update(("%s:%d;" % (type(value).__name__, len(value))).encode())
+        for item in value:
+            _identify(item, digest, seen)
+
+    elif isinstance(value, dict):
+        digest.update(("dict:%d;" % len(value)).encode())
+        for name in sorted(value):
+            _identify(name, digest, seen)
+            _identify(value[name], digest, seen)
+
+    elif isinstance(value, _NAMED):
+        digest.update(("named:%s;" % _qualified_name(value)).encode())
+
+    elif isinstance(value, (DirectedPolygon, MultiPolygon)):
+        digest.update(("polygon:%s;" % polygon_key(value)).encode())
+
+    elif isinstance(value, functools.partial):
+        digest.update(b"partial;")
+        _identify((value.func, value.args, value.keywords or {}), digest, seen)
+
+    elif isinstance(value, types.CodeType):
+        digest.update(value.co_code)
+        _identify((value.co_names, value.co_consts), digest, seen)
+
+    elif isinstance(value, types.FunctionType):
+        digest.update(("function:%s;" % _qualified_name(value)).encode())
+
+        if id(value) in seen:  # a recursive function
+            return
+        seen.add(id(value))
+
+        _identify(value.__code__, digest, seen)
+        _identify((value.__defaults__, getattr(value, "__kwdefaults__", None)), digest, seen)
+        _identify([cell.cell_contents for cell in value.__closure__ or ()], digest, seen)
+
+        # the global values that the code refers to; global functions are identified by their name, except lambdas:
+        for name in sorted(_global_names(value.__code__)):
+            if name in value.__globals__:
+                item = value.__globals__[name]
+                if isinstance(item, types.FunctionType) and item.__name__ != "<lambda>":
+                    item = _qualified_name(item)
+                _identify((name, item), digest, seen)
+
+    else:
+        raise TypeError("a map that uses a %s cannot be identified; pass an explicit key" % type(value).__name__)
+
+
+def _global_names(code):
+    """The set of names used by code and by the functions (lambdas, comprehensions, ...) defined inside it"""
+
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _global_names(constant)
+
+    return names
+
+
+def map_key(f):
+    """A string identifying the map f, which stays the same between sessions
+
+    Raises TypeError if f, or a value that it uses, cannot be identified reliably.
+    """
+
+    if isinstance(f, np.ndarray) or isinstance(f, (list, tuple)):
+        f = np.ascontiguousarray(f)
+        return "matrix:%s:%s:%s" % (f.dtype.str, f.shape, hashlib.sha1(f.tobytes()).hexdigest())
+
+    if not isinstance(f, (types.FunctionType, functools.partial) + _NAMED):
+        raise TypeError("a map that is a %s cannot be identified; pass an explicit key" % type(f).__name__)
+
+    digest = hashlib.sha1()
+    _identify(f, digest, set())
+
+    name = getattr(f, "__name__", type(f).__name__)
+
+    return "%s:%s" % (name, digest.hexdigest())
+
+
+def polygon_key(polygon):
+    """A hash of the vertices (and pieces) of a polygon"""
+
+    digest = hashlib.sha1(np.ascontiguousarray(polygon.vertices, dtype=float).tobytes())
+
+    if isinstance(polygon, MultiPolygon):
+        digest.update(np.ascontiguousarray(polygon.offsets, dtype=np.int64).tobytes())
+
+    return digest.hexdigest()
+
+# <codecell>
+
+class IterateCache:
+    """Cache of the iterates f^n(polygon) of polygons under maps
+
+    Parameters
+    ==========
+    max_bytes:
+        the most memory that the iterates held in memory may take up
+    directory:
+        if given, iterates dropped from memory are saved there as .npz files, and looked for there when needed
+    """
+
+    def __init__(self, max_bytes=2**28, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+
+        self.entries = OrderedDict()  # from least to most recently used
+        self.nbytes = 0
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "IterateCache with %d iterates (%d bytes) in memory" % (len(self), self.nbytes)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+    def _save(self, key, polygon):
+        arrays = {"vertices": polygon.vertices}
+        if isinstance(polygon, MultiPolygon):
+            arrays["offsets"] = polygon.offsets
+
+        np.savez(self._filename(key), **arrays)
+
+    def _load(self, key):
+        if self.directory is None or not os.path.exists(self._filename(key)):
+            return None
+
+        with np.load(self._filename(key)) as arrays:
+            if "offsets" in arrays:
+                return MultiPolygon(arrays["vertices"], arrays["offsets"])
+
+            return DirectedPolygon(arrays["vertices"])
+
+    def _size(self, polygon):
+        return polygon.vertices.nbytes + (polygon.offsets.nbytes if isinstance(polygon, MultiPolygon) else 0)
+
+    def _store(self, key, polygon, saved=False):
+        if key in self.entries:
+            self.nbytes -= self._size(self.entries.pop(key)[0])
+
+        self.entries[key] = (polygon, saved)
+        self.nbytes += self._size(polygon)
+
+        # drop the least recently used iterates, keeping at least the newest one:
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            old_key, (old_polygon, old_saved) = self.entries.popitem(last=False)
+            self.nbytes -= self._size(old_polygon)
+
+            if self.directory is not None and not old_saved:
+                self._save(old_key, old_polygon)
+
+    def key(self, f, polygon, n, key=None):
+        return (map_key(f) if key is None else key, polygon_key(polygon), n)
+
+    def get(self, f, polygon, n, key=None):
+        """The cached nth iterate of polygon under f, or None if it is not available
+        key is a string identifying f, for maps that map_key cannot identify."""
+
+        key = self.key(f, polygon, n, key)
+
+        if key in self.entries:
+            self.entries[key] = self.entries.pop(key)  # now the most recently used
+            return self.entries[key][0]
+
+        iterate = self._load(key)
+        if iterate is not None:
+            self._store(key, iterate, saved=True)
+
+        return iterate
+
+    def put(self, f, polygon, n, iterate, key=None):
+        self._store(self.key(f, polygon, n, key), iterate)
+
+    def save(self):
+        """Write all the iterates held in memory to the directory"""
+
+        for key, (polygon, saved) in list(self.entries.items()):
+            if not saved:
+                self._save(key, polygon)
+                self.entries[key] = (polygon, True)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def iterate(self, f, polygon, n, jump=False, key=None):
+        """The nth iterate of polygon under f, taken from the cache if possible
+
+        f maps a polygon to its image. The iterate is found by applying f to the highest iterate m <= n that is available,
+        and all the iterates from m+1 to n are cached on the way.
+        With jump=True, f(polygon, n) must instead calculate the nth iterate directly (as torus_map does).
+        key identifies f, if map_key cannot.
+        """
+
+        if n == 0:
+            return polygon
+
+        key = map_key(f) if key is None else key  # worked out once
+
+        iterate = self.get(f, polygon, n, key)
+        if iterate is not None:
+            return iterate
+
+        if jump:
+            iterate = f(polygon, n)
+            self.put(f, polygon, n, iterate, key)
+            return iterate
+
+        m = n - 1
+        while m > 0 and self.get(f, polygon, m, key) is None:
+            m -= 1
+
+        iterate = self.get(f, polygon, m, key) if m > 0 else polygon
+
+        for k in range(m + 1, n + 1):
+            iterate = f(iterate)
+            self.put(f, polygon, k, iterate, key)
+
+        return iterate
+
+# <codecell>
+
+def test_iterate_cache():
+
+    import tempfile
+
+    M = np.array([[2, 1], [1, 1]])
+    step = lambda polygon: DirectedPolygon(np.dot(polygon.vertices, M.T))
+
+    unit_square = DirectedPolygon([(0.,0.), (1.,0.), (1.,1.), (0.,1.)])
+    directory = tempfile.mkdtemp()
+
+    cache = IterateCache(max_bytes=3 * unit_square.vertices.nbytes, directory=directory)
+
+    fifth = cache.iterate(step, unit_square, 5)
+    assert np.array_equal(fifth.vertices, np.dot(unit_square.vertices, np.linalg.matrix_power(M, 5).T))
+
+    # only the 3 most recent iterates are kept in memory; the others have been saved to disk:
+    assert len(cache) == 3
+    assert cache.nbytes <= cache.max_bytes
+    assert len(os.listdir(directory)) == 2
+
+    # the 0th iterate is the polygon itself, and is not cached:
+    assert cache.iterate(step, unit_square, 0) is unit_square
+    assert cache.get(step, unit_square, 0) is None
+
+    # a new cache (e.g. after restarting the kernel) finds them again:
+    cache.save()
+    new_cache = IterateCache(directory=directory)
+
+    assert np.array_equal(new_cache.get(step, unit_square, 1).vertices, step(unit_square).vertices)
+    assert np.array_equal(new_cache.iterate(step, unit_square, 5).vertices, fifth.vertices)
+
+    # a different map or starting polygon has its own iterates:
+    assert new_cache.get(M, unit_square, 1) is None
+    assert new_cache.get(step, DirectedPolygon(2 * unit_square.vertices), 1) is None
+
+
+def test_map_key():
+
+    unit_square = DirectedPolygon([(0.,0.), (1.,0.), (1.,1.), (0.,1.)])
+
+    # maps that differ only in a constant, a captured value, a default or the arguments of a partial are told apart:
+    f2 = lambda p: DirectedPolygon(2*p.vertices)
+    f3 = lambda p: DirectedPolygon(3*p.vertices)
+
+    cache = IterateCache()
+    assert cache.iterate(f2, unit_square, 1).vertices.max() == 2
+    assert cache.iterate(f3, unit_square, 1).vertices.max() == 3
+    assert len(cache) == 2
+
+    scale = lambda c: (lambda p: DirectedPolygon(c*p.vertices))
+    assert map_key(scale(2)) != map_key(scale(3))
+    assert map_key(scale(np.array([2., 1.]))) != map_key(scale(np.array([2., 2.])))
+
+    def g(p, c=2):
+        return c*p
+
+    def h(p, c=3):
+        return c*p
+
+    assert map_key(g) != map_key(h)
+    assert map_key(functools.partial(g, c=4)) != map_key(functools.partial(g, c=5))
+
+    # maps containing lambdas or comprehensions, and torus_map itself:
+    offsets = lambda p: DirectedPolygon(np.array([v + 1 for v in p.vertices]))
+    nested = lambda p: (lambda q: DirectedPolygon(2*q.vertices))(p)
+    assert len(set([map_key(offsets), map_key(nested), map_key(f2)])) == 3
+    assert np.allclose(cache.iterate(offsets, unit_square, 2).vertices, unit_square.vertices + 2)
+
+    from Torus_map import torus_map
+    assert map_key(torus_map) == map_key(torus_map)
+    assert cache.iterate(torus_map, unit_square, 2, jump=True).areas().sum() > 0.99
+
+    # and the same map built again has the same key:
+    assert map_key(scale(2)) == map_key(scale(2))
+    assert map_key(functools.partial(g, c=4)) == map_key(functools.partial(g, c=4))
+
+    # a map using something that cannot be identified needs an explicit key:
+    hidden = object()
+    try:
+        map_key(lambda p: (hidden, p)[1])
+    except TypeError:
+        pass
+    else:
+        assert False
+
+    assert cache.iterate(lambda p: (hidden, p)[1], unit_square, 1, key="identity") is unit_square
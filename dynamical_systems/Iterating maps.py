@@ -24,9 +24,16 @@ import numpy as np
 
 x = np.linspace(0, 1, 1000)
 
+# <markdowncell>
+
+# `np.vectorize(f)` would just call `f` once for each point. The `Maps` module has the same map written with array operations,
+# `(2*x) % 1`, which acts on the whole array at once:
+
 # <codecell>
 
-ff = np.vectorize(f)
+from Maps import doubling
+
+ff = doubling
 
 # <codecell>
 
@@ -54,23 +61,13 @@ plt.axis('scaled')
 
 # <markdowncell>
 
-# Let's generalise this to nth iterates:
+# Let's generalise this to nth iterates. Composing `f` with itself $n$ times would need $n$ nested function calls for each point,
+# and breaks down beyond Python's recursion limit; instead, `iterate` from the `Maps` module applies `f` $n$ times in a loop 
+# to the whole array of points, and `orbit` gives the whole trajectory $x, f(x), \ldots, f^{(n-1)}(x)$ as a single array:
 
 # <codecell>
 
-def iterate(f, n):
-    """nth iterate of f"""
-
-    if n == 0:
-        return lambda(x): x  # identity
-    
-    if n == 1:
-        return f
-    
-    # n > 1:
-    return composition(f, iterate(f, n-1))
-    
-    
+from Maps import iterate, orbit, logistic
 
 # <codecell>
 
@@ -88,19 +85,33 @@ plt.axis('scaled')
 
 # <codecell>
 
-@np.vectorize
-def logistic(x):
-    return 3.5*x*(1-x)
+logistic_map = logistic(3.5)
 
 # <codecell>
 
-plt.plot(x, iterate(logistic, 1)(x))
-plt.plot(x, iterate(logistic, 2)(x))
+plt.plot(x, iterate(logistic_map, 1)(x))
+plt.plot(x, iterate(logistic_map, 2)(x))
 
-plt.plot(x, iterate(logistic, 3)(x))
+plt.plot(x, iterate(logistic_map, 3)(x))
 plt.plot(x, x)
 plt.axis('scaled')
 
+# <markdowncell>
+
+# Doing the same for many values of $r$ at once, and keeping only where the orbits end up after a long transient, gives the bifurcation
+# diagram. `bifurcation_diagram` spreads the values of $r$ over several processes and counts the samples in a histogram:
+
+# <codecell>
+
+from Bifurcation import bifurcation_diagram, draw_bifurcation_diagram
+
+rs = np.linspace(2.5, 4, 1000)
+histogram = bifurcation_diagram(rs, initial_conditions=200, transient=1000, samples=200, bins=500)
+
+draw_bifurcation_diagram(rs, histogram)
+plt.xlabel("r")
+plt.ylabel("x")
+
 # <codecell>
 
 import sympy
@@ -134,6 +145,22 @@ _.subs({x:root})
 
 sympy.simplify(_)
 
+# <markdowncell>
+
+# The fixed point is stable while $|f'| < 1$ there. Rather than substituting values of $r$ one at a time, we can turn the expression
+# into a NumPy function and evaluate it on a whole grid of $r$ at once:
+
+# <codecell>
+
+from Lambdify_cache import lambdify_cached
+
+stability = lambdify_cached(sympy.diff(logistic(x), x).subs({x: root}), r)
+
+rs = np.linspace(1, 4, 1001)
+plt.plot(rs, abs(stability(rs)))
+plt.axhline(1, ls="--", color="k")
+plt.xlabel("r")
+
 # <codecell>
 
 
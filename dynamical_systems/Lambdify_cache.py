@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Turning sympy Lambdas into NumPy functions that act on whole arrays, compiling each expression only once
+"""
+
+# <codecell>
+
+from collections import OrderedDict
+
+import numpy as np
+import sympy
+
+# <markdowncell>
+
+# Evaluating a sympy expression with `.subs(...).evalf()` walks the whole expression tree for every value, which is about 1000 times
+# slower than evaluating the same formula with NumPy on a whole array of values at once. `sympy.lambdify` translates an expression into
+# such a NumPy function, but it is itself slow, so the compiled functions are kept in a cache, keyed by the `Lambda` itself:
+# sympy expressions are compared (and hashed) by their structure, so an expression that is built again in the same way finds
+# the function compiled before. When the cache is full, the least recently used function is dropped.
+#
+# The compiled functions broadcast their arguments against each other, and return an array of shape `grid.shape` for a scalar
+# expression, or `grid.shape + (rows, columns)` for a matrix, such as $\mathsf{M}_\alpha$ evaluated for a whole grid of $\alpha$.
+
+# <codecell>
+
+def _compile(f):
+    """NumPy version of the sympy Lambda f"""
+
+    expression = f.expr
+
+    if isinstance(expression, sympy.MatrixBase):
+        shape, entries = expression.shape, list(expression)
+    else:
+        shape, entries = (), [expression]
+
+    function = sympy.lambdify(f.variables, entries, modules="numpy")
+
+    def compiled(*args):
+        args = [np.asarray(arg, dtype=float) for arg in args]
+
+        # constant entries come back as numbers, so everything is broadcast to the shape of the arguments:
+        values = np.broadcast_arrays(*(args + [np.asarray(value) for value in function(*args)]))[len(args):]
+        result = np.stack(values, axis=-1)
+
+        return result.reshape(result.shape[:-1] + shape)
+
+    compiled.expression = f
+    compiled.__doc__ = "NumPy version of %s" % (f,)
+
+    return compiled
+
+# <codecell>
+
+class LambdifyCache:
+    """Cache of the NumPy versions of sympy Lambdas
+
+    Parameters
+    ==========
+    max_size:
+        the largest number of compiled functions that are kept
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+
+        self.entries = OrderedDict()  # from least to most recently used
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "LambdifyCache with %d functions (%d hits, %d misses)" % (len(self), self.hits, self.misses)
+
+    def compile(self, f, variables=None):
+        """NumPy version of the sympy Lambda f, or of the expression f as a function of the given variables"""
+
+        if variables is not None:
+            f = sympy.Lambda(variables, f)
+        elif not isinstance(f, sympy.Lambda):
+            raise TypeError("a sympy Lambda is needed, or an expression and its variables")
+
+        if f in self.entries:
+            self.hits += 1
+            self.entries[f] = self.entries.pop(f)  # now the most recently used
+            return self.entries[f]
+
+        self.misses += 1
+        compiled = self.entries[f] = _compile(f)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        return compiled
+
+    def clear(self):
+        self.entries.clear()
+
+
+lambdify_cache = LambdifyCache()
+
+
+def lambdify_cached(f, variables=None):
+    """NumPy version of a sympy Lambda (or of an expression in the given variables), from the shared cache"""
+
+    return lambdify_cache.compile(f, variables)
+
+# <codecell>
+
+def test_lambdify_cache():
+
+    alpha, r, x = sympy.symbols("alpha r x")
+    M = lambda alpha: (1 - alpha)*sympy.eye(2) + alpha*sympy.Matrix([[2, 1], [1, 1]])
+
+    cache = LambdifyCache(max_size=2)
+    M_numeric = cache.compile(sympy.Lambda(alpha, M(alpha)))
+
+    alphas = np.linspace(0, 1, 11)
+    matrices = M_numeric(alphas)
+
+    assert matrices.shape == (11, 2, 2)
+    for a, matrix in zip(alphas, matrices):
+        assert np.allclose(matrix, np.array(M(alpha).subs({alpha: a}).evalf(), dtype=float))
+
+    # the same expression built again is found in the cache:
+    assert cache.compile(M(alpha), alpha) is M_numeric
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # constants are broadcast, and grids of several variables may be given:
+    derivative = cache.compile(sympy.diff(r*x*(1 - x), x).subs({x: (r - 1)/r}), r)
+    assert np.allclose(derivative(np.array([2., 3., 4.])), [0., -1., -2.])
+
+    assert cache.compile(sympy.Integer(3), (r, x))(np.ones(4), np.ones((2, 1))).shape == (2, 4)
+
+    # the least recently used function is dropped:
+    cache.compile(r**2, r)
+    assert len(cache) == 2
+    assert sympy.Lambda(alpha, M(alpha)) not in cache.entries
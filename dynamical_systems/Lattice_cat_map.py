@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+The cat map on the N x N lattice of points (i/N, j/N) of the torus, i.e. on the pixels of an image
+"""
+
+# <codecell>
+
+from collections import OrderedDict
+
+import numpy as np
+from Torus_map import CAT_MAP
+
+# <markdowncell>
+
+# For points $(i/N, j/N)$ with integer $i$ and $j$, the cat map sends the lattice to itself: $(i, j) \mapsto \mathsf{M} \cdot (i, j) \pmod N$.
+# Working with the integers $(i, j)$ directly is exact, whereas iterating the floating-point map loses all accuracy after about 30 steps.
+#
+# Powers of $\mathsf{M}$ mod $N$ are calculated by repeated squaring, so that the $n$th iterate costs $O(\log n)$ matrix products
+# plus a single pass over the pixels.
+
+# <codecell>
+
+def matrix_power_mod(M, n, N):
+    """M^n (mod N) for a 2x2 integer matrix M, by repeated squaring
+    For N of 2^31 or more the products could overflow 64-bit integers, so Python integers are used instead."""
+
+    dtype = np.int64 if N < 2**31 else object
+
+    result = np.identity(2, dtype=np.int64).astype(dtype) % N
+    power = np.array([[int(m) % N for m in row] for row in np.asarray(M)], dtype=dtype)
+
+    while n > 0:
+        if n & 1:
+            result = np.dot(result, power) % N
+        power = np.dot(power, power) % N
+        n >>= 1
+
+    return result
+
+
+def _inverse_mod(a, N):
+    """The inverse of a (mod N), by the extended Euclidean algorithm"""
+
+    old_r, r = a % N, N
+    old_s, s = 1, 0
+
+    while r:
+        q = old_r // r
+        old_r, r = r, old_r - q*r
+        old_s, s = s, old_s - q*s
+
+    if old_r != 1:
+        raise ValueError("%d is not invertible mod %d" % (a, N))
+
+    return old_s % N
+
+
+def inverse_matrix_mod(M, N):
+    """The inverse of the 2x2 integer matrix M (mod N)"""
+
+    M = np.asarray(M, dtype=np.int64)
+    det = int(M[0, 0]*M[1, 1] - M[0, 1]*M[1, 0])
+
+    adjugate = np.array([[M[1, 1], -M[0, 1]], [-M[1, 0], M[0, 0]]], dtype=np.int64)
+
+    return (adjugate * _inverse_mod(det, N)) % N
+
+# <codecell>
+
+def lattice_map(N, n=1, M=CAT_MAP):
+    """Where the nth iterate of the map sends each point (i, j) of the N x N lattice
+    Returns arrays (i', j') of shape (N, N), indexed by [j, i] like the pixels of an image."""
+
+    A = matrix_power_mod(M, n, N)
+    j, i = np.indices((N, N), dtype=np.int64)
+
+    return (A[0, 0]*i + A[0, 1]*j) % N, (A[1, 0]*i + A[1, 1]*j) % N
+
+
+_permutations = OrderedDict()  # from least to most recently used
+max_permutation_bytes = 2**29
+
+
+def cat_map_permutation(N, n=1, M=CAT_MAP):
+    """The permutation of the pixels of an N x N image made by the nth iterate of the cat map, as a flat index:
+    pixel k of the new image (in row-major order) is pixel index[k] of the old one
+
+    Since the map is periodic, n is first reduced mod the period. The indices (int32 when they fit) are cached, keeping the
+    most recently used ones up to a total of max_permutation_bytes, and returned read-only.
+    """
+
+    n = n % cat_map_period(N, M)
+    key = (N, n, tuple(int(m) for m in np.asarray(M).flat))
+
+    if key in _permutations:
+        _permutations[key] = _permutations.pop(key)  # now the most recently used
+        return _permutations[key]
+
+    source_i, source_j = lattice_map(N, 1, inverse_matrix_mod(matrix_power_mod(M, n, N), N))
+
+    index = (source_j * N + source_i).ravel().astype(np.int32 if N*N < 2**31 else np.int64)
+    index.flags.writeable = False
+
+    _permutations[key] = index
+    while sum(index.nbytes for index in _permutations.values()) > max_permutation_bytes and len(_permutations) > 1:
+        _permutations.popitem(last=False)
+
+    return index
+
+
+def _pixels(image):
+    """The N x N (x channels) image as an array of N^2 pixels, without copying it"""
+
+    N = image.shape[0]
+
+    if image.ndim < 2 or image.shape[1] != N:
+        raise ValueError("the cat map acts on square images")
+
+    pixels = image.view()
+    pixels.shape = (N*N,) + image.shape[2:]  # raises an error rather than copying
+
+    return pixels
+
+
+def cat_map_image(image, n=1, M=CAT_MAP, out=None, block_size=2**22):
+    """Apply the nth iterate of the cat map to an N x N image (or N x N x channels)
+
+    The pixel at column i, row j of the image moves to column i', row j', where (i', j') = M^n (i, j) (mod N).
+    Each output pixel is gathered from its preimage under M^n, using the cached index from cat_map_permutation,
+    with np.take into out (a new array if not given; it may be a numpy.memmap). The pixels are gathered block_size at a time,
+    so the image may also be a numpy.memmap larger than the memory. out must not overlap the image, since pixels would then
+    be overwritten before they are read: a ValueError is raised if it does.
+    """
+
+    image = np.asarray(image)
+    index = cat_map_permutation(image.shape[0], n, M)
+
+    if out is None:
+        out = np.empty_like(image)
+    elif np.shares_memory(out, image):
+        raise ValueError("out must not share memory with the image; map the image into another array and copy it back")
+
+    source, target = _pixels(image), _pixels(out)
+
+    for start in range(0, len(index), block_size):
+        # (with mode="clip" the output is not buffered; the indices are all valid anyway)
+        np.take(source, index[start:start + block_size], axis=0, out=target[start:start + block_size], mode="clip")
+
+    return out
+
+
+def cat_map_image_file(source, target, n=1, M=CAT_MAP, block_size=2**22):
+    """Apply the nth iterate of the cat map to the image stored in the .npy file source, writing the result to the .npy file target
+    Both files are memory-mapped, so the image need not fit in memory."""
+
+    image = np.load(source, mmap_mode="r")
+    out = np.lib.format.open_memmap(target, mode="w+", dtype=image.dtype, shape=image.shape)
+
+    cat_map_image(image, n, M, out, block_size)
+    out.flush()
+
+    return out
+
+
+def cat_map_frames(image, M=CAT_MAP, copy=True):
+    """Generate the successive iterates of an image under the cat map, starting with the image itself, 
+    until it returns to the original after one period
+    
+    Each frame is a single gather from the previous one, with the index for one step. With copy=False, the frames are written
+    alternately into two arrays allocated once, so that each frame is only valid until the next one is generated."""
+    
+    image = np.asarray(image)
+    index = cat_map_permutation(image.shape[0], 1, M)
+
+    buffers = None if copy else (np.empty_like(image), np.empty_like(image))
+    frame = image
+
+    for step in range(cat_map_period(image.shape[0], M)):
+        yield frame
+        frame = cat_map_image(frame, 1, M, out=None if copy else buffers[step % 2])
+
+# <markdowncell>
+
+# Since the map is a permutation of the finite set of $N^2$ lattice points, it is periodic: $\mathsf{M}^k \equiv \mathsf{I} \pmod N$
+# for some smallest $k$, after which every image returns to itself. This period is the order of $\mathsf{M}$ in the group of
+# invertible matrices mod $N$.
+#
+# We find it one prime power $p^e$ dividing $N$ at a time, and then take the least common multiple.
+# The order mod $p^e$ divides $B = b_p \, p^{e-1}$, where $b_p$ is the order of the group of invertible $2 \times 2$ matrices mod $p$,
+# $(p^2-1)(p^2-p)$. For the cat map, $\mathsf{M}^k$ is made of the Fibonacci numbers $F_{2k-1}$, $F_{2k}$ and $F_{2k+1}$, so as for the Pisano periods
+# we may instead use $b_p = p - 1$ if $p \equiv \pm 1 \pmod 5$, $b_p = 2(p+1)$ if $p \equiv \pm 2 \pmod 5$, $b_5 = 20$ and $b_2 = 3$.
+# Each prime factor $q$ is then removed from $B$ for as long as $\mathsf{M}^{B/q} \equiv \mathsf{I}$ still holds.
+
+# <codecell>
+
+def factorize(n):
+    """Prime factorization of n as a dictionary {p: e}, by trial division"""
+
+    factors = {}
+    p = 2
+
+    while p*p <= n:
+        while n % p == 0:
+            factors[p] = factors.get(p, 0) + 1
+            n //= p
+        p += 1 if p == 2 else 2
+
+    if n > 1:
+        factors[n] = factors.get(n, 0) + 1
+
+    return factors
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _group_order_bound(p, M):
+    """A multiple of the order of M (mod p), for a prime p"""
+
+    if np.array_equal(np.asarray(M) % p, np.asarray(CAT_MAP) % p):  # Pisano-style bounds
+        if p == 2:
+            return 3
+        if p == 5:
+            return 20
+        if p % 5 in (1, 4):
+            return p - 1
+        return 2 * (p + 1)
+
+    return (p*p - 1) * (p*p - p)
+
+
+def cat_map_period(N, M=CAT_MAP):
+    """The period of the map (i, j) -> M (i, j) (mod N) on the N x N lattice,
+    i.e. the smallest k > 0 with M^k = I (mod N)"""
+
+    identity = np.identity(2, dtype=np.int64)
+    period = 1
+
+    for p, e in factorize(N).items():
+        modulus = p**e
+
+        order = _group_order_bound(p, M) * p**(e-1)
+
+        if not np.array_equal(matrix_power_mod(M, order, modulus), identity):
+            raise ValueError("M is not invertible mod %d" % modulus)
+
+        for q in factorize(order):
+            while order % q == 0 and np.array_equal(matrix_power_mod(M, order // q, modulus), identity):
+                order //= q
+
+        period = period * order // _gcd(period, order)
+
+    return period
+
+# <codecell>
+
+def test_cat_map_period():
+
+    for N in range(1, 60):
+        A = np.identity(2, dtype=np.int64) % N
+        k = 0
+
+        while True:
+            A = np.dot(CAT_MAP, A) % N
+            k += 1
+            if np.array_equal(A, np.identity(2, dtype=np.int64) % N):
+                break
+
+        assert cat_map_period(N) == k
+        assert cat_map_period(N, M=[[1, 1], [1, 2]]) == k  # same eigenvalues, not the Pisano fast path
+
+
+def test_cat_map_image():
+
+    N = 12
+    image = np.arange(N*N).reshape(N, N)
+
+    once = cat_map_image(image)
+
+    for j in range(N):
+        for i in range(N):
+            new_i, new_j = np.dot(CAT_MAP, (i, j)) % N
+            assert once[new_j, new_i] == image[j, i]
+
+    assert np.array_equal(cat_map_image(once, 4), cat_map_image(image, 5))
+    assert np.array_equal(cat_map_image(image, cat_map_period(N)), image)
+    
+    frames = list(cat_map_frames(image))
+    assert len(frames) == cat_map_period(N)
+    assert np.array_equal(frames[3], cat_map_image(image, 3))
+
+    for k, frame in enumerate(cat_map_frames(image, copy=False)):
+        assert np.array_equal(frame, frames[k])
+
+    # RGB images, written into a given array, and memory-mapped files:
+    import os
+    import tempfile
+
+    rgb = np.random.randint(0, 256, (N, N, 3)).astype(np.uint8)
+    out = np.empty_like(rgb)
+
+    assert cat_map_image(rgb, 2, out=out, block_size=10) is out
+    for channel in range(3):
+        assert np.array_equal(out[:, :, channel], cat_map_image(rgb[:, :, channel], 2))
+
+    # the image cannot be mapped in place, since the gather would read pixels it has already overwritten:
+    for overlapping in (rgb, rgb[::-1]):
+        try:
+            cat_map_image(rgb, 2, out=overlapping)
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    directory = tempfile.mkdtemp()
+    np.save(os.path.join(directory, "image.npy"), rgb)
+    mapped = cat_map_image_file(os.path.join(directory, "image.npy"), os.path.join(directory, "mapped.npy"), 2)
+
+    assert np.array_equal(np.load(os.path.join(directory, "mapped.npy")), out)
+    del mapped
+
+    assert cat_map_permutation(N, 2 + cat_map_period(N)) is cat_map_permutation(N, 2)
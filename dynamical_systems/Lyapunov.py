@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Lyapunov exponents of 1D and 2D maps, for many trajectories (and parameter values) at once
+"""
+
+# <codecell>
+
+import numpy as np
+from Maps import supports_out
+
+# <markdowncell>
+
+# For a 1D map, the Lyapunov exponent of the orbit of $x_0$ is the average of $\log |f'(x_n)|$ along the orbit.
+# All the orbits are followed at once, as a single array; parameters that vary from one orbit to another, such as $r$ in a sweep of the
+# logistic family, are just arrays of the same shape captured by `f` and its derivative.
+
+# <codecell>
+
+def lyapunov_exponent(f, derivative, x, n, transient=0):
+    """Estimate the Lyapunov exponent of the orbit of each initial condition in the array x under the 1D map f
+
+    The average of log|f'(x_k)| is taken over the n points following the first `transient` iterates.
+    f and derivative act elementwise on arrays. Returns an array of the same shape as x.
+    """
+
+    x = np.array(x, dtype=float)
+    in_place = supports_out(f)
+
+    for i in range(transient):
+        x = f(x, out=x) if in_place else f(x)
+
+    total = np.zeros(x.shape)
+    stretch = np.empty(x.shape)
+
+    for i in range(n):
+        np.absolute(derivative(x), out=stretch)
+        total += np.log(stretch, out=stretch)
+        x = f(x, out=x) if in_place else f(x)
+
+    return total / n
+
+# <markdowncell>
+
+# For a 2D map we follow, together with each orbit, a pair of tangent vectors, multiplying them at each step by the Jacobian matrix
+# of the map and then re-orthonormalising them by a QR decomposition. The logarithms of the diagonal entries of $\mathsf{R}$ add up
+# to give the two Lyapunov exponents. All the $2 \times 2$ QR decompositions are done at once, by Gram--Schmidt on the arrays of
+# components of the `(K, 2, 2)` Jacobians.
+
+# <codecell>
+
+def _qr_2x2(J, q1, q2):
+    """QR decompositions of the stack of 2x2 matrices J Q, where J has shape (K,2,2) and the columns q1 and q2 of Q
+    have shape (K,2). The diagonal of R is made positive.
+
+    Returns the new columns q1 and q2, and the diagonal entries r11 and r22 of R.
+    """
+
+    J00, J01, J10, J11 = J[:, 0, 0], J[:, 0, 1], J[:, 1, 0], J[:, 1, 1]
+
+    a0, a1 = J00*q1[:, 0] + J01*q1[:, 1], J10*q1[:, 0] + J11*q1[:, 1]
+    b0, b1 = J00*q2[:, 0] + J01*q2[:, 1], J10*q2[:, 0] + J11*q2[:, 1]
+
+    r11 = np.hypot(a0, a1)
+    a0 /= r11
+    a1 /= r11
+
+    r12 = a0*b0 + a1*b1
+    b0 -= r12*a0
+    b1 -= r12*a1
+
+    r22 = np.hypot(b0, b1)
+    b0 /= r22
+    b1 /= r22
+
+    return np.column_stack((a0, a1)), np.column_stack((b0, b1)), r11, r22
+
+
+def lyapunov_spectrum(f, jacobian, x, n, transient=0):
+    """Estimate both Lyapunov exponents of the orbit of each of the initial conditions x (shape (K,2)) under the 2D map f
+
+    jacobian(x) gives the Jacobian matrices of f at the points x, as an array of shape (K,2,2).
+    The averages are taken over the n steps following the first `transient` iterates.
+    Returns an array of shape (K,2), with the largest exponent first.
+    """
+
+    x = np.array(x, dtype=float)
+    in_place = supports_out(f)
+
+    for i in range(transient):
+        x = f(x, out=x) if in_place else f(x)
+
+    q1 = np.zeros((len(x), 2))
+    q2 = np.zeros((len(x), 2))
+    q1[:, 0] = q2[:, 1] = 1
+
+    total = np.zeros((len(x), 2))
+
+    for i in range(n):
+        q1, q2, r11, r22 = _qr_2x2(jacobian(x), q1, q2)
+        total[:, 0] += np.log(r11)
+        total[:, 1] += np.log(r22)
+
+        x = f(x, out=x) if in_place else f(x)
+
+    return total / n
+
+# <markdowncell>
+
+# A family of area-preserving perturbations of the cat map:
+# $(x, y) \mapsto (2x + y + \frac{\epsilon}{2\pi} \sin 2 \pi x, \; x + y + \frac{\epsilon}{2\pi} \sin 2 \pi x) \pmod 1$.
+# `epsilon` may be a number, or an array with a value for each point.
+
+# <codecell>
+
+def perturbed_cat_map(x, epsilon=0.):
+    """Apply the perturbed cat map to the points x, of shape (K,2)"""
+
+    x = np.asarray(x, dtype=float)
+    kick = epsilon / (2*np.pi) * np.sin(2*np.pi * x[:, 0])
+
+    return np.column_stack((2*x[:, 0] + x[:, 1] + kick, x[:, 0] + x[:, 1] + kick)) % 1
+
+
+def perturbed_cat_map_jacobian(x, epsilon=0.):
+    """Jacobian matrices of the perturbed cat map at the points x, as an array of shape (K,2,2)"""
+
+    x = np.asarray(x, dtype=float)
+    c = epsilon * np.cos(2*np.pi * x[:, 0])
+
+    J = np.empty((len(x), 2, 2))
+    J[:, 0, 0] = 2 + c
+    J[:, 1, 0] = 1 + c
+    J[:, :, 1] = 1
+
+    return J
+
+# <codecell>
+
+def test_lyapunov_exponent():
+
+    r = np.array([4., 3.2, 2.8])
+    f = lambda x: r*x*(1 - x)
+    derivative = lambda x: r*(1 - 2*x)
+
+    exponents = lyapunov_exponent(f, derivative, np.full(3, 0.3), 10**4, transient=1000)
+
+    # log 2 for r = 4; the log of the stretching around the stable 2-cycle for r = 3.2,
+    # and at the stable fixed point 1 - 1/r for r = 2.8:
+    cycle = (r[1] + 1 + np.array([-1, 1]) * np.sqrt((r[1] - 3)*(r[1] + 1))) / (2*r[1])
+
+    assert abs(exponents[0] - np.log(2)) < 0.02
+    assert np.isclose(exponents[1], np.sum(np.log(np.abs(r[1]*(1 - 2*cycle)))) / 2, atol=1e-3)
+    assert np.isclose(exponents[2], np.log(abs(2 - r[2])), atol=1e-3)
+
+
+def test_lyapunov_spectrum():
+
+    np.random.seed(1)
+    x = np.random.rand(100, 2)
+
+    # for the cat map the exponents are the logs of the eigenvalues, (3 +- sqrt 5)/2:
+    # (the error comes from the initial tangent vectors not being along the eigenvectors, and decreases like 1/n)
+    exponents = lyapunov_spectrum(perturbed_cat_map, perturbed_cat_map_jacobian, x, 100)
+    assert np.allclose(exponents, np.log([(3 + np.sqrt(5))/2, (3 - np.sqrt(5))/2]), atol=0.01)
+
+    # the perturbed maps preserve area, so the exponents add up to 0, with a different epsilon for each orbit:
+    epsilon = np.linspace(0, 0.5, 100)
+    exponents = lyapunov_spectrum(lambda x: perturbed_cat_map(x, epsilon), lambda x: perturbed_cat_map_jacobian(x, epsilon),
+                                  x, 1000)
+
+    assert np.allclose(exponents.sum(axis=1), 0, atol=1e-10)
+    assert np.all(exponents[:, 0] > 0.5)
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Iterating maps on whole arrays of initial conditions
+"""
+
+# <codecell>
+
+import numpy as np
+
+# <markdowncell>
+
+# The $n$th iterate $f^{(n)}$ could be built by composing $f$ with itself $n$ times, but then evaluating it needs $n$ nested Python calls
+# for each point, and fails altogether beyond Python's recursion limit (about $n = 1000$). Instead we apply $f$ $n$ times in a loop,
+# each time to the whole array of points at once.
+#
+# Maps that accept an `out` argument (such as NumPy ufuncs, or the maps with `supports_out` set) write each iterate back into the
+# same array, so that no new arrays are allocated at all.
+
+# <codecell>
+
+def supports_out(f):
+    """Whether the map f can write its result into an existing array, as f(x, out=x)"""
+
+    return isinstance(f, np.ufunc) or getattr(f, "supports_out", False)
+
+
+def iterate(f, n, x=None):
+    """nth iterate of f
+
+    With x given, returns f^n(x), applying f to the whole array x n times in a loop (x itself is not changed);
+    otherwise returns the function x -> f^n(x).
+    """
+
+    if x is None:
+        return lambda x: iterate(f, n, x)
+
+    if n == 0:
+        return x  # identity
+
+    if supports_out(f):
+        result = np.array(x, dtype=float)
+        for i in range(n):
+            f(result, out=result)
+        return result
+
+    for i in range(n):
+        x = f(x)
+
+    return x
+
+
+def orbit(f, x, n, out=None):
+    """The first n points x, f(x), ..., f^(n-1)(x) of the orbits of each of the initial conditions x
+
+    Returns an array of shape (n,) + x.shape, allocated once (or given as out, which may for example be a numpy.memmap
+    when the orbits do not fit in memory). Each row is calculated from the previous one.
+    """
+
+    x = np.asarray(x, dtype=float)
+
+    if out is None:
+        out = np.empty((n,) + x.shape)
+
+    if n == 0:
+        return out
+
+    out[0] = x
+
+    in_place = supports_out(f)
+
+    for i in range(1, n):
+        if in_place:
+            f(out[i-1], out=out[i])
+        else:
+            out[i] = f(out[i-1])
+
+    return out
+
+# <codecell>
+
+def test_iterate():
+
+    doubling = lambda x: (2*x) % 1
+    x = np.linspace(0, 1, 11)
+
+    assert np.allclose(iterate(doubling, 3)(x), (8*x) % 1)
+    assert np.array_equal(iterate(doubling, 0, x), x)
+
+    # no recursion, so large n is fine:
+    assert np.allclose(iterate(lambda x: x + 1, 10**4, x), x + 10**4)
+
+    # ufuncs are applied in place, without changing x:
+    assert np.allclose(iterate(np.cos, 100, x), np.cos(iterate(np.cos, 99, x)))
+    assert x[1] == 0.1
+
+
+def test_orbit():
+
+    x = np.linspace(0, 1, 5)
+
+    trajectory = orbit(lambda x: 3.5*x*(1-x), x, 20)
+    assert trajectory.shape == (20, 5)
+
+    for i in range(20):
+        assert np.allclose(trajectory[i], iterate(lambda x: 3.5*x*(1-x), i, x))
+
+    assert np.allclose(orbit(np.sin, x, 10)[-1], iterate(np.sin, 9, x))
+
+# <markdowncell>
+
+# ## A library of maps
+#
+# `np.vectorize` only hides a Python loop, calling the scalar function once for each element. Instead, `array_map` *traces* a scalar map
+# once: it calls it with placeholder values that record each arithmetic operation or NumPy ufunc applied to them. The recorded operations
+# are then replayed on whole arrays, each one writing into a buffer that is allocated the first time an array of a given shape is seen
+# and reused afterwards, so that repeated calls on arrays of the same shape (as when iterating) allocate no temporary arrays. Only the
+# buffers for the most recent shape are kept, and only if they take up at most `max_buffer_bytes`. The original scalar function is kept 
+# as `.scalar`, for reference and for testing.
+#
+# Since the buffers are shared by all calls, a map must not be called from several threads at once.
+#
+# Only straight-line code can be traced: a map with a branch such as `2*x if x < 0.5 else 2*x - 1` must be rewritten with arithmetic,
+# e.g. `(2*x) % 1`.
+#
+# A map of $d$ variables takes an array of shape `(..., d)` (or any shape if $d = 1$).
+
+# <codecell>
+
+class _Traced(object):
+    """A placeholder value that records the operations applied to it while a map is traced"""
+    
+    __array_priority__ = 1000
+    
+    def __init__(self, trace, node):
+        self.trace, self.node = trace, node
+        
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != "__call__" or kwargs or ufunc.nout != 1:
+            return NotImplemented
+        return self.trace.apply(ufunc, inputs)
+    
+    def __bool__(self):
+        raise TypeError("a map with branches cannot be traced; write it with arithmetic operations instead")
+    
+    __nonzero__ = __bool__
+
+
+def _binary(ufunc):
+    return (lambda self, other: self.trace.apply(ufunc, (self, other)), 
+            lambda self, other: self.trace.apply(ufunc, (other, self)))
+
+_Traced.__add__, _Traced.__radd__ = _binary(np.add)
+_Traced.__sub__, _Traced.__rsub__ = _binary(np.subtract)
+_Traced.__mul__, _Traced.__rmul__ = _binary(np.multiply)
+_Traced.__truediv__, _Traced.__rtruediv__ = _binary(np.true_divide)
+_Traced.__div__, _Traced.__rdiv__ = _Traced.__truediv__, _Traced.__rtruediv__
+_Traced.__pow__, _Traced.__rpow__ = _binary(np.power)
+_Traced.__mod__, _Traced.__rmod__ = _binary(np.mod)
+_Traced.__neg__ = lambda self: self.trace.apply(np.negative, (self,))
+_Traced.__abs__ = lambda self: self.trace.apply(np.absolute, (self,))
+
+
+class _Trace(object):
+    """The list of operations recorded while tracing a map
+    Each operation is (ufunc, arguments), where an argument is ("node", k) for the result of operation k, 
+    ("input", k) for the kth variable, or ("constant", value)."""
+    
+    def __init__(self):
+        self.operations = []
+        
+    def apply(self, ufunc, inputs):
+        arguments = []
+        for value in inputs:
+            if isinstance(value, _Traced):
+                arguments.append(value.node)
+            elif np.ndim(value) == 0:
+                arguments.append(("constant", float(value)))
+            else:
+                return NotImplemented
+            
+        self.operations.append((ufunc, arguments))
+        return _Traced(self, ("node", len(self.operations) - 1))
+
+
+class ArrayMap(object):
+    """A map compiled from a scalar function by tracing it; see array_map
+    
+    Not safe to call from several threads at once, since the calls share the scratch buffers."""
+    
+    supports_out = True
+    max_buffer_bytes = 2**24  # larger scratch buffers are freed after each call
+    
+    def __init__(self, scalar):
+        self.scalar = scalar
+        self.dimension = scalar.__code__.co_argcount
+        self.__name__ = getattr(scalar, "__name__", "map")
+        self.__doc__ = scalar.__doc__
+        
+        trace = _Trace()
+        outputs = scalar(*[_Traced(trace, ("input", k)) for k in range(self.dimension)])
+        
+        if not isinstance(outputs, tuple):
+            outputs = (outputs,)
+            
+        if len(outputs) != self.dimension:
+            raise ValueError("a map of %d variables must return %d values" % (self.dimension, self.dimension))
+        
+        # outputs that are constants or inputs are copied with an operation of their own:
+        self.outputs = []
+        for output in outputs:
+            if not (isinstance(output, _Traced) and output.node[0] == "node"):
+                output = trace.apply(np.add, (output, 0.))
+            self.outputs.append(output.node[1])
+            
+        self.operations = trace.operations
+        self._allocate_slots()
+        self._shape, self._buffers = None, None  # the scratch buffers for the most recent shape
+        
+    def _allocate_slots(self):
+        """Assign each operation a buffer ("slot"), reusing the buffers of results that are no longer needed"""
+        
+        last_use = {}
+        for k, (ufunc, arguments) in enumerate(self.operations):
+            for argument in arguments:
+                if argument[0] == "node":
+                    last_use[argument[1]] = k
+        for k in self.outputs:
+            last_use[k] = len(self.operations)
+            
+        free, self.slots, self.n_slots = [], [], 0
+        
+        for k, (ufunc, arguments) in enumerate(self.operations):
+            for argument in arguments:
+                if argument[0] == "node" and last_use[argument[1]] == k and self.slots[argument[1]] not in free:
+                    free.append(self.slots[argument[1]])
+                    
+            if free:
+                self.slots.append(free.pop())
+            else:
+                self.slots.append(self.n_slots)
+                self.n_slots += 1
+                
+            if k not in last_use:  # never used
+                free.append(self.slots[k])
+        
+    def __repr__(self):
+        return "<array map %s of %d variable(s), %d operations>" % (self.__name__, self.dimension, len(self.operations))
+        
+    def __call__(self, x, out=None):
+        x = np.asarray(x, dtype=float)
+        
+        if self.dimension == 1:
+            inputs = [x]
+        else:
+            if x.shape[-1] != self.dimension:
+                raise ValueError("expected an array of shape (..., %d)" % self.dimension)
+            inputs = [x[..., k] for k in range(self.dimension)]
+            
+        shape = inputs[0].shape
+        if shape == self._shape:
+            buffers = self._buffers
+        else:
+            self._shape, self._buffers = None, None  # free the old buffers first
+            buffers = [np.empty(shape) for slot in range(self.n_slots)]
+            if self.n_slots * int(np.prod(shape)) * 8 <= self.max_buffer_bytes:
+                self._shape, self._buffers = shape, buffers
+        
+        if out is None:
+            out = np.empty(x.shape)
+            
+        def value(argument):
+            kind, content = argument
+            if kind == "node":
+                return buffers[self.slots[content]]
+            if kind == "input":
+                return inputs[content]
+            return content
+        
+        for k, (ufunc, arguments) in enumerate(self.operations):
+            ufunc(*[value(argument) for argument in arguments], out=buffers[self.slots[k]])
+            
+        # the inputs may be the same array as out, so the outputs are only copied once they have all been calculated:
+        if self.dimension == 1:
+            np.copyto(out, buffers[self.slots[self.outputs[0]]])
+        else:
+            for k, node in enumerate(self.outputs):
+                np.copyto(out[..., k], buffers[self.slots[node]])
+                
+        return out if out.ndim > 0 else float(out)
+    
+    
+def array_map(scalar):
+    """Decorator turning a scalar map (a function of d numbers returning d numbers) into an ArrayMap that acts on whole arrays"""
+    
+    return ArrayMap(scalar)
+
+# <codecell>
+
+@array_map
+def doubling(x):
+    """The doubling map x -> 2x (mod 1)"""
+    return (2*x) % 1
+
+
+@array_map
+def tent(x):
+    """The tent map x -> 2x for x < 1/2, 2 - 2x for x >= 1/2"""
+    return 1 - abs(2*x - 1)
+
+
+def logistic(r):
+    """The logistic map x -> r x (1-x)"""
+    
+    @array_map
+    def logistic_map(x):
+        return r*x*(1 - x)
+    
+    return logistic_map
+
+
+def standard_map(K):
+    """The Chirikov standard map of (theta, p): p' = p + K sin(theta), theta' = theta + p' (mod 2 pi)"""
+    
+    @array_map
+    def standard(theta, p):
+        new_p = p + K*np.sin(theta)
+        return (theta + new_p) % (2*np.pi), new_p
+    
+    return standard
+
+
+def henon(a=1.4, b=0.3):
+    """The Henon map (x, y) -> (1 - a x^2 + y, b x)"""
+    
+    @array_map
+    def henon_map(x, y):
+        return 1 - a*x**2 + y, b*x
+    
+    return henon_map
+
+
+@array_map
+def cat_map(x, y):
+    """The Arnold cat map (x, y) -> (2x + y, x + y) (mod 1)"""
+    return (2*x + y) % 1, (x + y) % 1
+
+# <codecell>
+
+def test_array_maps():
+    
+    np.random.seed(3)
+    x = np.random.rand(100)
+    points = np.random.rand(100, 2)
+    
+    # the array versions agree with the scalar functions they were traced from:
+    for f in [doubling, tent, logistic(3.7)]:
+        assert np.allclose(f(x), [f.scalar(xi) for xi in x])
+        
+    for f in [standard_map(0.97), henon(), cat_map]:
+        assert np.allclose(f(points), [f.scalar(*point) for point in points])
+        
+    assert np.allclose(tent(x), np.where(x < 0.5, 2*x, 2 - 2*x))
+    
+    # in place:
+    y = points.copy()
+    cat_map(y, out=y)
+    assert np.allclose(y, cat_map(points))
+    
+    assert np.allclose(iterate(henon(), 10, points), [iterate(lambda p: henon().scalar(*p), 10, p) for p in points])
+    
+    # only the scratch buffers for the last shape are kept, and none for large arrays:
+    for n in range(1, 101):
+        doubling(np.zeros(n))
+    assert doubling._shape == (100,) and len(doubling._buffers) == doubling.n_slots
+    
+    cat_map(np.zeros((cat_map.max_buffer_bytes // 8, 2)))
+    assert cat_map._buffers is None
+    
+    # branches cannot be traced:
+    try:
+        array_map(lambda x: 2*x if x < 0.5 else 2*x - 1)
+    except TypeError:
+        pass
+    else:
+        assert False
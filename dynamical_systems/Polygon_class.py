@@ -18,16 +18,24 @@ def norm(x):
 
 class DirectedLineSegment:
     """A directed line segment from `start` to `end`
-    v is the *non-normalized* vector start - end
+    v is the *non-normalized* vector end - start
     It is non-normalized so that the segment is parametrized by start + t*v, 
     where t=0 gives start and t=1 gives end
     
     The normal vector n is normalized.
+    
+    If v and n have already been calculated (e.g. for all the edges of a polygon at once) they may be passed in, 
+    in which case they are used as they are.
     """
 
-    def __init__(self, start, end):
+    def __init__(self, start, end, v=None, n=None):
         self.start, self.end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
-        self.v = self.start - self.end
+        
+        if v is not None and n is not None:
+            self.v, self.n = v, n
+            return
+        
+        self.v = self.end - self.start
         
         self.n = np.array([-self.v[1], self.v[0]])
         self.n /= norm(self.n)
@@ -99,6 +107,155 @@ def test_find_intersection_segments():
     assert all(intersection_point == np.array([1.0, 1.0]))
     
 
+# <markdowncell>
+
+# Intersecting segments one pair at a time is far too slow when we need to clip polygons with many edges. 
+# The following does the same calculation for whole arrays of segments at once, with the segments given as an array of shape (N,2,2)
+# containing the pairs `[start, end]`.
+
+# <codecell>
+
+def segment_endpoints(segments):
+    """Convert a list of DirectedLineSegments (or anything array-like) 
+    into an (N,2,2) array of the pairs [start, end]"""
+    
+    if hasattr(segments, "endpoints"):  # a DirectedPolygon or its segments
+        return segments.endpoints
+    
+    if len(segments) > 0 and isinstance(segments[0], DirectedLineSegment):
+        return np.array([(segment.start, segment.end) for segment in segments])
+    
+    return np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+
+
+def _normals(v):
+    """Unit normals [-v_y, v_x] / |v| of an array of vectors v"""
+    
+    length = np.sqrt(v[..., 0]**2 + v[..., 1]**2)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack((-v[..., 1] / length, v[..., 0] / length), axis=-1)
+    
+
+def _intersection_times(start1, v1, start2, v2, n2, bounded, threshold=1.e-15):
+    """Intersection times along the lines start1 + t*v1 with the lines through start2 in the direction v2,
+    with unit normals n2.
+    The arrays must be broadcastable against each other; the last axis holds the x and y components.
+    
+    Returns (t, hit), where hit is True where there is an intersection"""
+    
+    denominator = v1[..., 0]*n2[..., 0] + v1[..., 1]*n2[..., 1]
+    
+    dx, dy = start2[..., 0] - start1[..., 0], start2[..., 1] - start1[..., 1]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_star = (dx*n2[..., 0] + dy*n2[..., 1]) / denominator
+        
+        hit = (np.abs(denominator) >= threshold) & (0.0 <= t_star) & (t_star <= 1.0)
+        
+        if bounded:  # the intersection must also lie between the ends of segment 2
+            s_star = ((t_star*v1[..., 0] - dx)*v2[..., 0] + (t_star*v1[..., 1] - dy)*v2[..., 1]) / \
+                     (v2[..., 0]**2 + v2[..., 1]**2)
+            hit &= (0.0 <= s_star) & (s_star <= 1.0)
+        
+    return t_star, hit
+
+
+def find_intersection_segments_batch(segments1, segments2, paired=False, bounded=False, block_size=2**20):
+    """Vectorized version of find_intersection_segments for many segments at once
+    
+    segments1 and segments2 are arrays of shape (N,2,2) and (M,2,2) of segment ends [start, end], 
+    or lists of DirectedLineSegments.
+    
+    As in find_intersection_segments, segments2 are treated as the whole line through them,
+    unless bounded is True, in which case the intersection must also lie within the ends of segments2.
+    
+    If paired is True, segments1[k] is intersected only with segments2[k], and
+    (t, points) are returned, arrays of shape (N,) and (N,2), containing nan where there is no intersection.
+    
+    Otherwise all N*M pairs are intersected, working through segments1 in blocks of about 
+    block_size pairs at a time so that the memory used stays bounded. 
+    Returns (i, j, t, points) for the pairs that intersect, ordered by i and then j, 
+    where t is the parametrization of segments1[i] at the intersection point.
+    """
+    
+    segments1 = segment_endpoints(segments1)
+    segments2 = segment_endpoints(segments2)
+    
+    start1, v1 = segments1[:, 0], segments1[:, 1] - segments1[:, 0]
+    start2, v2 = segments2[:, 0], segments2[:, 1] - segments2[:, 0]
+    n2 = _normals(v2)
+    
+    if paired:
+        if len(segments1) != len(segments2):
+            raise ValueError("paired intersection needs the same number of segments in each array")
+        
+        t_star, hit = _intersection_times(start1, v1, start2, v2, n2, bounded)
+        t_star[~hit] = np.nan
+        
+        return t_star, start1 + t_star[:, np.newaxis] * v1
+    
+    
+    rows = max(1, block_size // max(1, len(segments2)))
+    
+    found_i, found_j, found_t = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+    
+    for first in range(0, len(segments1), rows):
+        block = slice(first, first + rows)
+        
+        t_star, hit = _intersection_times(start1[block, np.newaxis], v1[block, np.newaxis], start2, v2, n2, bounded)
+        i, j = np.nonzero(hit)
+        
+        found_i.append(i + first)
+        found_j.append(j)
+        found_t.append(t_star[i, j])
+        
+    i, j, t_star = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_t)
+    
+    return i, j, t_star, start1[i] + t_star[:, np.newaxis] * v1[i]
+
+# <codecell>
+
+def test_find_intersection_segments_batch():
+    
+    pairs = [(DirectedLineSegment([0, 0], [1, 1]), DirectedLineSegment([0, 1], [1, 0])), 
+             (DirectedLineSegment([0, 0], [1, 1]), DirectedLineSegment([3, 3], [4, 4])),
+             (DirectedLineSegment([0, 0], [1, 1]), DirectedLineSegment([1, 1], [1, 2]))]
+    
+    segments1 = [pair[0] for pair in pairs]
+    segments2 = [pair[1] for pair in pairs]
+    
+    t_star, points = find_intersection_segments_batch(segments1, segments2, paired=True)
+    
+    for k, (segment1, segment2) in enumerate(pairs):
+        intersection = find_intersection_segments(segment1, segment2)
+        
+        if intersection is None:
+            assert np.isnan(t_star[k])
+        else:
+            assert t_star[k] == intersection[0]
+            assert all(points[k] == intersection[1])
+            
+    
+    # all pairs of random segments agree with the one-at-a-time version:
+    np.random.seed(1)
+    segments1 = np.random.rand(20, 2, 2)
+    segments2 = np.random.rand(30, 2, 2)
+    
+    i, j, t_star, points = find_intersection_segments_batch(segments1, segments2, block_size=100)
+    
+    expected = [(a, b) for a in range(20) for b in range(30) 
+                if find_intersection_segments(DirectedLineSegment(*segments1[a]), 
+                                              DirectedLineSegment(*segments2[b])) is not None]
+    
+    assert list(zip(i, j)) == expected
+    
+    for a, b, t, point in zip(i, j, t_star, points):
+        intersection = find_intersection_segments(DirectedLineSegment(*segments1[a]), DirectedLineSegment(*segments2[b]))
+        assert np.allclose([t], [intersection[0]])
+        assert np.allclose(point, intersection[1])
+
+
 # <headingcell level=3>
 
 # Polygons
@@ -109,6 +266,42 @@ def test_find_intersection_segments():
 
 # <codecell>
 
+class PolygonSegments:
+    """The edges of a DirectedPolygon, as a sequence of DirectedLineSegments
+    
+    The segments are not stored: each one is created when it is asked for, 
+    as a view onto the arrays of the polygon."""
+    
+    def __init__(self, polygon):
+        self.polygon = polygon
+        
+    def __len__(self):
+        return len(self.polygon.vertices)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        
+        N = len(self)
+        if not -N <= i < N:
+            raise IndexError("segment index out of range")
+        i %= N
+        
+        polygon = self.polygon
+        return DirectedLineSegment(polygon.vertices[i], polygon.vertices[(i+1) % N], polygon.v[i], polygon.n[i])
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+            
+    @property
+    def endpoints(self):
+        return self.polygon.endpoints
+    
+    def __repr__(self):
+        return repr(list(self))
+    
+
 class DirectedPolygon:
     """A directed polygon
     
@@ -116,65 +309,245 @@ class DirectedPolygon:
     ==========
     vertices:
         a list of vertices
+        
+    The vertices, the (non-normalized) edge vectors v from each vertex to the next one, and the unit normals n of the edges
+    are stored as contiguous (N,2) float arrays, calculated once for all the edges together.
+    `segments` gives the edges as DirectedLineSegments, which are only created when they are used.
     """
         
     
     def __init__(self, vertices):
-        self.vertices = np.asarray(vertices)
+        self.vertices = np.ascontiguousarray(vertices, dtype=float).reshape(-1, 2)
         
-        self.segments = []
+        self.v = np.roll(self.vertices, -1, axis=0) - self.vertices
+        self.n = _normals(self.v)
         
-        for i in range(len(self.vertices)-1):
-            self.segments.append(DirectedLineSegment(self.vertices[i], vertices[i+1]))
-            
-        self.segments.append(DirectedLineSegment(vertices[-1], vertices[0]))
+        self.segments = PolygonSegments(self)
+        
+    @property
+    def endpoints(self):
+        """The edges as an (N,2,2) array of pairs [start, end]"""
+        return np.stack((self.vertices, np.roll(self.vertices, -1, axis=0)), axis=1)
 
+    def __len__(self):
+        return len(self.vertices)
+        
     def __repr__(self):
         return self.vertices.__repr__()
     
     def draw(self):
+        from matplotlib import pyplot as plt
+        
         plt.fill(self.vertices[:,0], self.vertices[:,1], alpha=0.5)
         
 
 # <codecell>
 
-def find_starting_point(polygon1, polygon2):
-    """Find the starting point of the intersection of two polygons
-    Returns None if they do not intersect"""
+def test_directed_polygon():
+    
+    vertices = [(0.,0.), (1.,0.), (1.,1.), (0.,1.)]
+    unit_square = DirectedPolygon(vertices)
+    
+    assert len(unit_square.segments) == 4
+    
+    for i, segment in enumerate(unit_square.segments):
+        expected = DirectedLineSegment(vertices[i], vertices[(i+1) % 4])
+        
+        assert all(segment.start == expected.start)
+        assert all(segment.end == expected.end)
+        assert all(segment.v == expected.v)
+        assert np.allclose(segment.n, expected.n)
+        
+    assert all(unit_square.segments[-1].end == np.array([0., 0.]))
+    assert unit_square.endpoints.shape == (4, 2, 2)
+    
+
+# <markdowncell>
+
+# A collection of many (small) polygons, such as the pieces of a polygon cut up by a grid, is stored as a single array of vertices, 
+# with the polygons one after the other:
+
+# <codecell>
+
+class MultiPolygon:
+    """A collection of polygons
+    
+    Parameters
+    ==========
+    vertices:
+        (P,2) array of the vertices of all the polygons, one polygon after another
+    offsets:
+        the k-th polygon has vertices[offsets[k]:offsets[k+1]]
+    """
+    
+    def __init__(self, vertices, offsets):
+        self.vertices = np.ascontiguousarray(vertices, dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=int)
+        
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, k):
+        return DirectedPolygon(self.vertices[self.offsets[k]:self.offsets[k+1]])
+    
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+            
+    def __repr__(self):
+        return "MultiPolygon with %d polygons and %d vertices" % (len(self), len(self.vertices))
+    
+    @property
+    def owner(self):
+        """The number of the polygon that each vertex belongs to"""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+    
+    def areas(self):
+        """Signed area of each polygon; positive if anticlockwise"""
+        
+        following = np.roll(np.arange(len(self.vertices)), -1)
+        counts = np.diff(self.offsets)
+        nonempty = counts > 0
+        following[self.offsets[1:][nonempty] - 1] = self.offsets[:-1][nonempty]
+        
+        x, y = self.vertices[:, 0], self.vertices[:, 1]
+        cross = x*y[following] - x[following]*y
+        
+        return 0.5 * np.bincount(self.owner, weights=cross, minlength=len(self))
+    
+    def draw(self, ax=None, **kwargs):
+        from matplotlib import pyplot as plt
+        from matplotlib.collections import PolyCollection
+        
+        if ax is None:
+            ax = plt.gca()
+            
+        kwargs.setdefault("alpha", 0.5)
+        
+        collection = PolyCollection(np.split(self.vertices, self.offsets[1:-1]), **kwargs)
+        ax.add_collection(collection)
+        ax.autoscale_view()
+        
+        return collection
+    
+
+# <codecell>
+
+def find_starting_point_brute_force(polygon1, polygon2):
+    """Find the starting point of the intersection of two polygons by checking every pair of edges
+    Returns (point, i, j), where i and j are the numbers of the segments of each polygon that intersect there, 
+    or None if they do not intersect"""
     
     for i in range(len(polygon1.segments)):
         for j in range(len(polygon2.segments)):
             
             segment1 = polygon1.segments[i]
-            segment2 = polygon2.segments[i]
+            segment2 = polygon2.segments[j]
             
             intersection = find_intersection_segments(segment1, segment2)
             
-            if intersection:
+            # the intersection must lie within *both* segments:
+            if intersection and find_intersection_segments(segment2, segment1):
                 return (intersection[1], i, j)  # don't need the intersection time
             
     return None
-            
+
+
+def _grid_cells(endpoints, origin, cell_size, grid_size):
+    """For each segment, the cells of a uniform grid covered by its bounding box
+    
+    Returns (segment_number, cell_number) arrays with one entry for each (segment, cell) pair"""
+    
+    low = (np.minimum(endpoints[:, 0], endpoints[:, 1]) - origin) / cell_size
+    high = (np.maximum(endpoints[:, 0], endpoints[:, 1]) - origin) / cell_size
     
+    # drop segments that lie outside the grid altogether:
+    inside = np.all((high >= 0) & (low <= grid_size), axis=1)
+    segment_number = np.nonzero(inside)[0]
+    
+    low = np.clip(np.floor(low[inside]).astype(int), 0, grid_size-1)
+    high = np.clip(np.floor(high[inside]).astype(int), 0, grid_size-1)
+    
+    width = high[:, 0] - low[:, 0] + 1
+    counts = width * (high[:, 1] - low[:, 1] + 1)
+    
+    # the k-th cell of the box of each segment:
+    owner = np.repeat(np.arange(len(counts)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    
+    cell_x = low[owner, 0] + k % width[owner]
+    cell_y = low[owner, 1] + k // width[owner]
+    
+    return segment_number[owner], cell_y * grid_size + cell_x
 
-def intersection_polygons(polygon1, polygon2):
-    """Calculate intersection of two (convex) polygons
-    First find an intersection point.
-    Then follow this around by taking consecutive pieces of each polygon?
+
+def find_polygon_intersections(polygon1, polygon2, first_only=False):
+    """Find the points where the edges of two polygons intersect
+    
+    Rather than checking all pairs of edges, the edges are placed in a uniform grid over the region 
+    where the bounding boxes of the polygons overlap, with about one edge per cell, 
+    and only pairs of edges that share a cell are checked, all at once with find_intersection_segments_batch.
+    For polygons with n and m reasonably evenly sized edges this takes time close to O((n+m) log(n+m)).
+    
+    Returns (points, i, j), arrays giving the intersection points and the numbers i and j of the segments of each polygon
+    that intersect there, ordered by i and then j (i.e. in the same order as find_starting_point_brute_force finds them).
+    With first_only, only the first of these is calculated, and None is returned if there is none.
     """
     
-    starting_point, i, j = find_starting_point(polygon1, polygon2)
-    # i is the number of the segment of the first polygon, j of the second
+    endpoints1, endpoints2 = segment_endpoints(polygon1), segment_endpoints(polygon2)
     
-    if starting_point is None:
-        return None
+    no_intersections = (np.zeros((0, 2)), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    
+    if len(endpoints1) == 0 or len(endpoints2) == 0:
+        return None if first_only else no_intersections
+    
+    # region where both polygons lie:
+    low = np.maximum(endpoints1.min(axis=(0, 1)), endpoints2.min(axis=(0, 1)))
+    high = np.minimum(endpoints1.max(axis=(0, 1)), endpoints2.max(axis=(0, 1)))
     
-    intersection_path = [starting_point]
+    if np.any(low > high):
+        return None if first_only else no_intersections
     
-    current_segment = polygon2.segments[j]
-    remainder = DirectedLineSegment(starting_point, current_segment.end)
+    grid_size = int(np.ceil(np.sqrt(len(endpoints1) + len(endpoints2))))
+    cell_size = np.where(high > low, high - low, 1.0) / grid_size
     
-#    find_intersection_segments(remainder 
+    segments1, cells1 = _grid_cells(endpoints1, low, cell_size, grid_size)
+    segments2, cells2 = _grid_cells(endpoints2, low, cell_size, grid_size)
+    
+    # join the two on the cell number:
+    order = np.argsort(cells2, kind='mergesort')
+    segments2, cells2 = segments2[order], cells2[order]
+    
+    first = np.searchsorted(cells2, cells1, side='left')
+    counts = np.searchsorted(cells2, cells1, side='right') - first
+    
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = np.repeat(segments1, counts)
+    j = segments2[np.repeat(first, counts) + k]
+    
+    # edges sharing several cells are only checked once:
+    pairs = np.unique(i * len(endpoints2) + j)
+    i, j = pairs // len(endpoints2), pairs % len(endpoints2)
+    
+    t_star, points = find_intersection_segments_batch(endpoints1[i], endpoints2[j], paired=True, bounded=True)
+    hit = ~np.isnan(t_star)
+    
+    if first_only:
+        if not np.any(hit):
+            return None
+        
+        first_hit = np.argmax(hit)
+        return (points[first_hit], i[first_hit], j[first_hit])
+    
+    return points[hit], i[hit], j[hit]
+
+
+def find_starting_point(polygon1, polygon2):
+    """Find the starting point of the intersection of two polygons
+    Returns (point, i, j), where i and j are the numbers of the segments of each polygon that intersect there, 
+    or None if they do not intersect"""
+    
+    return find_polygon_intersections(polygon1, polygon2, first_only=True)
 
 # <codecell>
 
@@ -189,17 +562,247 @@ def test_find_starting_point():
     rotated_square = DirectedPolygon(rotated_square_vertices)
     
     
-    starting_point = find_starting_point(unit_square, rotated_square)
+    starting_point, i, j = find_starting_point(unit_square, rotated_square)
     
-    assert starting_point[0] == 0.0
-    assert all(starting_point[1] == np.array([0.0, 0.0]))
+    assert (i, j) == (0, 0)
+    assert all(starting_point == np.array([0.0, 0.0]))
     
     
-    new_square = [vertex + np.array([10., 0.]) for vertex in unit_square.vertices]
+    new_square = DirectedPolygon([vertex + np.array([10., 0.]) for vertex in unit_square.vertices])
     
     starting_point = find_starting_point(unit_square, new_square)
     
     assert starting_point == None
+    
+    
+def test_find_polygon_intersections():
+    
+    np.random.seed(2)
+    
+    # two random star-shaped polygons:
+    theta1 = np.sort(np.random.rand(50)) * 2*np.pi
+    theta2 = np.sort(np.random.rand(70)) * 2*np.pi
+    r1 = 1 + 0.3*np.random.rand(50)
+    r2 = 1 + 0.3*np.random.rand(70)
+    
+    polygon1 = DirectedPolygon(np.c_[r1*np.cos(theta1), r1*np.sin(theta1)])
+    polygon2 = DirectedPolygon(np.c_[0.5 + r2*np.cos(theta2), r2*np.sin(theta2)])
+    
+    points, i, j = find_polygon_intersections(polygon1, polygon2)
+    
+    expected = [(a, b) for a in range(50) for b in range(70) 
+                if find_intersection_segments(polygon1.segments[a], polygon2.segments[b]) is not None and 
+                   find_intersection_segments(polygon2.segments[b], polygon1.segments[a]) is not None]
+    
+    assert len(expected) > 0
+    assert list(zip(i, j)) == expected
+    
+    starting_point, i, j = find_starting_point(polygon1, polygon2)
+    brute_force_point, brute_force_i, brute_force_j = find_starting_point_brute_force(polygon1, polygon2)
+    
+    assert (i, j) == (brute_force_i, brute_force_j)
+    assert np.allclose(starting_point, brute_force_point)
+
+# <codecell>
+
+def benchmark_find_starting_point(sizes=(10**3, 10**4, 10**5), brute_force_limit=10**3):
+    """Compare the times taken by find_starting_point and find_starting_point_brute_force
+    for two overlapping circles with n edges each. 
+    The brute force version is only run for n <= brute_force_limit."""
+    
+    import time
+    
+    timings = []
+    
+    for n in sizes:
+        theta = np.linspace(0, 2*np.pi, n, endpoint=False)
+        circle1 = DirectedPolygon(np.c_[np.cos(theta), np.sin(theta)])
+        circle2 = DirectedPolygon(np.c_[-1.5 + np.cos(theta), np.sin(theta)])  # the circles meet far along circle1
+        
+        start = time.time()
+        find_starting_point(circle1, circle2)
+        grid_time = time.time() - start
+        
+        brute_force_time = None
+        if n <= brute_force_limit:
+            start = time.time()
+            find_starting_point_brute_force(circle1, circle2)
+            brute_force_time = time.time() - start
+            
+        print("n = %7d:  grid %8.4f s,  brute force %s" % 
+              (n, grid_time, "%8.4f s" % brute_force_time if brute_force_time is not None else "(skipped)"))
+            
+        timings.append((n, grid_time, brute_force_time))
+        
+    return timings
+
+# <markdowncell>
+
+# To intersect polygons we clip the first polygon by each edge of the second (convex) polygon in turn (Sutherland--Hodgman). 
+# Each clipping step is done for all the vertices at once, and for many windows at once: the clipped polygons are kept 
+# one after another in a single array of vertices, with `offsets` giving where each one starts. 
+
+# <codecell>
+
+def _signed_area(vertices):
+    """Signed area of the polygon(s) with vertices along the second last axis; positive if anticlockwise"""
+    
+    x, y = vertices[..., 0], vertices[..., 1]
+    return 0.5 * np.sum(x*np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1)*y, axis=-1)
+
+
+def _as_windows(windows):
+    """Convert a list of convex polygons (DirectedPolygons or arrays of vertices) into a (K,m,2) array
+    Windows with fewer than m vertices are padded by repeating their last vertex, which gives edges of length 0 that clip nothing."""
+    
+    windows = [window.vertices if isinstance(window, DirectedPolygon) else np.asarray(window, dtype=float) 
+               for window in windows]
+    m = max(len(window) for window in windows)
+    
+    return np.array([np.concatenate([window, np.repeat(window[-1:], m - len(window), axis=0)]) for window in windows])
+
+
+def clip_polygon_windows(subject, windows, which=None):
+    """Clip the polygon `subject` by each of the convex polygons in `windows`
+    
+    subject is a DirectedPolygon or an (N,2) array of vertices;
+    windows is a (K,m,2) array of the vertices of K convex windows, or a list of convex polygons.
+    
+    subject may also be a MultiPolygon, in which case windows[k] clips the polygon number which[k] of subject.
+    
+    Returns (vertices, offsets), where the k-th clipped polygon is vertices[offsets[k]:offsets[k+1]]; 
+    it has no vertices if subject and windows[k] do not overlap.
+    """
+    
+    windows = _as_windows(windows) if isinstance(windows, list) else np.array(windows, dtype=float)
+    
+    if windows.ndim == 2:
+        windows = windows[np.newaxis]
+        
+    # the windows are traversed anticlockwise, so that their inside is on the left of each edge:
+    clockwise = _signed_area(windows) < 0
+    windows[clockwise] = windows[clockwise, ::-1]
+    
+    K, m = windows.shape[:2]
+    
+    if isinstance(subject, MultiPolygon):
+        counts = np.diff(subject.offsets)[which]
+        owner = np.repeat(np.arange(K), counts)
+        
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        vertices = subject.vertices[subject.offsets[which][owner] + local]
+        
+    else:
+        subject = subject.vertices if isinstance(subject, DirectedPolygon) else np.asarray(subject, dtype=float)
+        
+        vertices = np.tile(subject, (K, 1))
+        owner = np.repeat(np.arange(K), len(subject))
+    
+    for e in range(m):
+        if len(vertices) == 0:
+            break
+        
+        counts = np.bincount(owner, minlength=K)
+        starts = np.cumsum(counts) - counts
+        
+        # the vertex following each one around its own polygon:
+        following = np.arange(1, len(vertices) + 1)
+        nonempty = counts > 0
+        following[(starts + counts - 1)[nonempty]] = starts[nonempty]
+        
+        a = windows[owner, e]
+        edge = windows[owner, (e+1) % m] - a
+        
+        d = edge[:, 0]*(vertices[:, 1] - a[:, 1]) - edge[:, 1]*(vertices[:, 0] - a[:, 0])  # >= 0 inside
+        inside = d >= 0
+        crosses = inside != inside[following]
+        
+        # each vertex gives itself if it is inside, followed by the crossing point of the edge to the next vertex:
+        keep = inside.astype(int) + crosses
+        position = np.cumsum(keep) - keep
+        
+        new_vertices = np.empty((keep.sum(), 2))
+        new_vertices[position[inside]] = vertices[inside]
+        
+        c = np.nonzero(crosses)[0]
+        fraction = d[c] / (d[c] - d[following[c]])
+        new_vertices[position[c] + inside[c]] = vertices[c] + fraction[:, np.newaxis] * (vertices[following[c]] - vertices[c])
+        
+        vertices, owner = new_vertices, np.repeat(owner, keep)
+        
+    counts = np.bincount(owner, minlength=K)
+    starts = np.cumsum(counts) - counts
+    
+    # remove repeated consecutive vertices, produced where a vertex lies exactly on a window edge:
+    following = np.arange(1, len(vertices) + 1)
+    nonempty = counts > 0
+    following[(starts + counts - 1)[nonempty]] = starts[nonempty]
+    
+    distinct = np.any(vertices != vertices[following % max(1, len(vertices))], axis=1)
+    vertices, owner = vertices[distinct], owner[distinct]
+    
+    # polygons with fewer than 3 vertices have no area:
+    counts = np.bincount(owner, minlength=K)
+    enough = counts[owner] >= 3
+    vertices, owner = vertices[enough], owner[enough]
+    
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(owner, minlength=K))])
+    
+    return vertices, offsets
+
+
+def intersection_polygons_batch(polygon, windows):
+    """Intersect the polygon with each of the convex windows in a single pass
+    Returns a list of DirectedPolygons, with None for windows that polygon does not overlap"""
+    
+    vertices, offsets = clip_polygon_windows(polygon, windows)
+    
+    return [DirectedPolygon(vertices[offsets[k]:offsets[k+1]]) if offsets[k+1] > offsets[k] else None
+            for k in range(len(offsets) - 1)]
+
+
+def intersection_polygons(polygon1, polygon2):
+    """Calculate intersection of two polygons, where polygon2 must be convex (polygon1 need not be)
+    Returns a DirectedPolygon, or None if they do not overlap
+    """
+    
+    return intersection_polygons_batch(polygon1, [polygon2])[0]
+
+# <codecell>
+
+def test_intersection_polygons():
+    
+    unit_square = DirectedPolygon([(0.,0.), (1.,0.), (1.,1.), (0.,1.)])
+    
+    shifted_square = DirectedPolygon(unit_square.vertices + 0.5)
+    intersection = intersection_polygons(unit_square, shifted_square)
+    
+    assert len(intersection) == 4
+    assert np.isclose(_signed_area(intersection.vertices), 0.25)
+    assert np.all((intersection.vertices >= 0.5) & (intersection.vertices <= 1.0))
+    
+    # the same square, but clockwise:
+    assert np.isclose(abs(_signed_area(intersection_polygons(unit_square, DirectedPolygon(shifted_square.vertices[::-1])).vertices)), 0.25)
+    
+    # a square rotated by 45 degrees about its centre gives an octagon:
+    theta = np.pi / 4.
+    R = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    rotated_square = DirectedPolygon(np.dot(unit_square.vertices - 0.5, R.T) + 0.5)
+    
+    intersection = intersection_polygons(rotated_square, unit_square)
+    assert len(intersection) == 8
+    assert np.isclose(_signed_area(intersection.vertices), 2*(np.sqrt(2) - 1))
+    
+    assert intersection_polygons(unit_square, DirectedPolygon(unit_square.vertices + 10.)) is None
+    
+    # clip a 3x3 square against the 9 unit squares it covers, and one it does not:
+    big_square = DirectedPolygon(3 * unit_square.vertices)
+    tiles = [unit_square.vertices + (i, j) for i in range(3) for j in range(3)] + [unit_square.vertices + (5, 5)]
+    
+    pieces = intersection_polygons_batch(big_square, tiles)
+    
+    assert all(np.isclose(_signed_area(piece.vertices), 1.0) for piece in pieces[:9])
+    assert pieces[9] is None
 
 # <codecell>
 
@@ -216,7 +819,148 @@ class ParametrizedFunctionSegment:
 
 # <codecell>
 
-def intersection_function_segments(f1, f2):
+def newton_solve(F, x0, jacobian=None, tolerance=1.e-12, max_iterations=50, step=1.e-7):
+    """Solve the systems F(x) = 0 of two equations in two unknowns from many starting points at once, by damped Newton iteration
+    
+    K independent systems are solved together, one from each starting point in the (K,2) array x0.
+    F(x, k) gives the (len(k),2) array of the values of the systems numbered k (an array of integers) at the points x;
+    as the iteration proceeds, only the systems that have not yet converged are evaluated.
+    jacobian(x, k) gives the (len(k),2,2) array of derivatives dF_i/dx_j; if it is not given, central finite differences with the given step are used.
+    Each Newton step is halved (up to 10 times) until it reduces |F|.
+    
+    Returns (x, converged): the final points, and whether |F(x)| < tolerance there.
+    """
+    
+    x = np.array(x0, dtype=float).reshape(-1, 2)
+    value = np.asarray(F(x, np.arange(len(x))), dtype=float)
+    size = np.sqrt(np.sum(value**2, axis=1))
+    
+    active = size >= tolerance
+    
+    for iteration in range(max_iterations):
+        if not np.any(active):
+            break
+            
+        i = np.nonzero(active)[0]
+        xi, value_i = x[i], value[i]
+        
+        if jacobian is not None:
+            J = np.asarray(jacobian(xi, i), dtype=float)
+        else:
+            J = np.empty((len(i), 2, 2))
+            for k in range(2):
+                h = np.zeros(2)
+                h[k] = step
+                J[:, :, k] = (np.asarray(F(xi + h, i)) - np.asarray(F(xi - h, i))) / (2*step)
+                
+        # Newton step, solving the 2x2 systems J.dx = -F explicitly:
+        det = J[:, 0, 0]*J[:, 1, 1] - J[:, 0, 1]*J[:, 1, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dx = -np.column_stack((J[:, 1, 1]*value_i[:, 0] - J[:, 0, 1]*value_i[:, 1], 
+                                   -J[:, 1, 0]*value_i[:, 0] + J[:, 0, 0]*value_i[:, 1])) / det[:, np.newaxis]
+            
+        singular = ~np.all(np.isfinite(dx), axis=1)
+        dx[singular] = 0.
+        
+        # damping: halve the steps that do not reduce |F|
+        damping = np.ones(len(i))
+        pending = ~singular
+        
+        for halving in range(10):
+            if not np.any(pending):
+                break
+            
+            k = np.nonzero(pending)[0]
+            trial = xi[k] + damping[k, np.newaxis] * dx[k]
+            trial_value = np.asarray(F(trial, i[k]), dtype=float)
+            trial_size = np.sqrt(np.sum(trial_value**2, axis=1))
+            
+            better = trial_size < size[i[k]]
+            
+            x[i[k[better]]] = trial[better]
+            value[i[k[better]]] = trial_value[better]
+            size[i[k[better]]] = trial_size[better]
+            
+            pending[k[better]] = False
+            damping[k[~better]] /= 2.
+        
+        # stop iterating where converged, or where no step helps any more:
+        active[i] = (size[i] >= tolerance) & ~singular & ~pending
+        
+    return x, size < tolerance
+
+
+def _segment_function(curve):
+    """The function f(t) of a ParametrizedFunctionSegment reparametrized to [0,1], evaluated at arrays of t"""
+    
+    if isinstance(curve, ParametrizedFunctionSegment):
+        f, start, end = curve.f, curve.start, curve.end
+        return lambda t: _evaluate(f, start + (end - start)*np.asarray(t, dtype=float))
+    
+    return lambda t: _evaluate(curve, np.asarray(t, dtype=float))
+
+
+def intersection_curve_line(f, segment, subdivisions=64, tolerance=1.e-12, max_iterations=60):
+    """Intersections of a parametrized curve f:[0,1] -> R^2 with the straight DirectedLineSegment segment
+    
+    This is a 1D problem: the signed distance g(s) = (f(s) - c).n from the line through the segment has a root at each crossing.
+    Roots are bracketed by the sign changes of g over `subdivisions` equal intervals,
+    and then found by Newton iteration, safeguarded by bisection so that it stays inside the bracket.
+    
+    Returns (s, t, points), where t is the parameter along segment, sorted by s.
+    """
+    
+    f = _segment_function(f)
+    c, n, v = segment.start, segment.n, segment.v
+    
+    g = lambda s: np.dot(f(s) - c, n)
+    
+    grid = np.linspace(0, 1, subdivisions + 1)
+    values = g(grid)
+    
+    exact = grid[values == 0]
+    bracket = np.nonzero(values[:-1] * values[1:] < 0)[0]
+    
+    low, high = grid[bracket], grid[bracket + 1]
+    g_low = values[bracket]
+    s = 0.5 * (low + high)
+    
+    for iteration in range(max_iterations):
+        if len(s) == 0:
+            break
+        
+        h = 1.e-7 * (high - low + 1.e-300)
+        g_s = g(s)
+        derivative = (g(s + h) - g(s - h)) / (2*h)
+        
+        # shrink the brackets around the roots:
+        same_sign = g_s * g_low > 0
+        low, g_low = np.where(same_sign, s, low), np.where(same_sign, g_s, g_low)
+        high = np.where(same_sign, high, s)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = s - g_s / derivative
+            
+        inside = np.isfinite(newton) & (newton > low) & (newton < high)
+        new_s = np.where(inside, newton, 0.5*(low + high))
+        
+        if np.all(np.abs(new_s - s) < tolerance):
+            s = new_s
+            break
+        
+        s = new_s
+        
+    s = np.sort(np.concatenate([exact, s]))
+    points = f(s)
+    t = np.dot(points - c, v) / np.dot(v, v)
+    
+    within = (t >= -tolerance) & (t <= 1 + tolerance)
+    
+    return s[within], t[within], points[within]
+
+
+def intersection_function_segments(f1, f2, subdivisions=32, jacobian1=None, jacobian2=None, 
+                                   tolerance=1.e-12, max_iterations=50):
     """ 
     Solve f1(s) = f2(t)
     Two nonlinear equations in two unknowns
@@ -224,16 +968,269 @@ def intersection_function_segments(f1, f2):
     i.e.
     F(s, t) = 0
     
-    where F(s,t) := f1(s) - f2(t)
+    where F(s,t) := f1(s) - f2(t), for (s, t) in [0,1]^2.
+    
+    f1 and f2 are ParametrizedFunctionSegments (or functions of t in [0,1]), which should accept arrays of t.
+    If either is a straight DirectedLineSegment this reduces to a *1D* root-finding problem, solved by intersection_curve_line.
+    
+    Otherwise this is intersection_function_segments_batch for a single pair of curves;
+    jacobian1 and jacobian2, if given, are the derivatives f1'(s) and f2'(t), returning (K,2) arrays.
+    
+    Returns (s, t, points) for the distinct intersections, sorted by s.
     """
     
-    F = lambda(s, t): f1(s) - f2(t)
+    if isinstance(f2, DirectedLineSegment):
+        return intersection_curve_line(f1, f2, subdivisions=subdivisions, tolerance=tolerance)
+    
+    if isinstance(f1, DirectedLineSegment):
+        t, s, points = intersection_curve_line(f2, f1, subdivisions=subdivisions, tolerance=tolerance)
+        order = np.argsort(s)
+        return s[order], t[order], points[order]
+    
+    f1, f2 = _segment_function(f1), _segment_function(f2)
+    
+    derivative1 = derivative2 = None
+    if jacobian1 is not None and jacobian2 is not None:
+        derivative1, derivative2 = (lambda s, k: jacobian1(s)), (lambda t, k: jacobian2(t))
+    
+    pair, s, t, points = intersection_function_segments_batch(lambda s, k: f1(s), lambda t, k: f2(t), 1, subdivisions, 
+                                                              derivative1, derivative2, tolerance, max_iterations)
+    
+    return s, t, points
+
+
+def _distance_segments(a, b):
+    """The distances between the segments a[k] and b[k] (arrays of shape (K,2,2) of their ends) that do not cross"""
+    
+    def to_segment(points, segments):
+        v = segments[:, 1] - segments[:, 0]
+        u = np.clip(np.sum((points - segments[:, 0]) * v, axis=1) / np.maximum(np.sum(v**2, axis=1), 1.e-300), 0., 1.)
+        return np.sqrt(np.sum((segments[:, 0] + u[:, np.newaxis]*v - points)**2, axis=1))
+    
+    return np.minimum(np.minimum(to_segment(a[:, 0], b), to_segment(a[:, 1], b)), 
+                      np.minimum(to_segment(b[:, 0], a), to_segment(b[:, 1], a)))
+
+
+def _bracket_intersections(points1, points2, middle1, middle2, subdivisions):
+    """Starting points (pair, s, t) for Newton's method, for curves sampled at the grid (arrays of shape (B,subdivisions+1,2))
+    and at the middles of its intervals (shape (B,subdivisions,2))
+    
+    Only the pieces of the two curves whose bounding boxes (widened by the bend of the curve between the samples) overlap
+    can meet. Where their chords cross, the crossing point gives the seed; the centres of the other overlapping pieces are also
+    tried (for tangencies, which chords may miss), unless they are next to pieces whose chords cross, or their chords are
+    further apart than twice the bends of the two pieces.
+    """
+    
+    B, n = middle1.shape[:2]
+    
+    chords1 = np.stack((points1[:, :-1], points1[:, 1:]), axis=2)  # (B,n,2,2)
+    chords2 = np.stack((points2[:, :-1], points2[:, 1:]), axis=2)
+    
+    def boxes(chords, middle):
+        bend = np.sqrt(np.sum((middle - 0.5*(chords[..., 0, :] + chords[..., 1, :]))**2, axis=-1))[..., np.newaxis]
+        low = np.minimum(np.minimum(chords[..., 0, :], chords[..., 1, :]), middle) - bend
+        high = np.maximum(np.maximum(chords[..., 0, :], chords[..., 1, :]), middle) + bend
+        return low, high
+    
+    low1, high1 = boxes(chords1, middle1)
+    low2, high2 = boxes(chords2, middle2)
+    
+    overlap = np.ones((B, n, n), dtype=bool)
+    for axis in range(2):
+        overlap &= low1[:, :, np.newaxis, axis] <= high2[:, np.newaxis, :, axis]
+        overlap &= low2[:, np.newaxis, :, axis] <= high1[:, :, np.newaxis, axis]
+        
+    pair, i, j = np.nonzero(overlap)
+    
+    t_star, crossing = find_intersection_segments_batch(chords1[pair, i], chords2[pair, j], paired=True, bounded=True)
+    crosses = np.isfinite(t_star)
+    
+    # the overlapping pieces next to (or at) a crossing are left to the seed from the crossing:
+    near = np.zeros((B, n + 2, n + 2), dtype=bool)
+    for di in range(3):
+        for dj in range(3):
+            near[pair[crosses] + 0, i[crosses] + di, j[crosses] + dj] = True
+    others = ~near[pair, i + 1, j + 1]
+    
+    # and the other pieces are tried only if they come closer than they bend away from their chords:
+    o = np.nonzero(others)[0]
+    a, b = chords1[pair[o], i[o]], chords2[pair[o], j[o]]
+    bend = (np.sqrt(np.sum((middle1[pair[o], i[o]] - 0.5*(a[:, 0] + a[:, 1]))**2, axis=1)) + 
+            np.sqrt(np.sum((middle2[pair[o], j[o]] - 0.5*(b[:, 0] + b[:, 1]))**2, axis=1)))
+    others[o] = _distance_segments(a, b) <= 2*bend
+    
+    # where the chords cross, s and t are found from the crossing point:
+    c = np.nonzero(crosses)[0]
+    start2 = chords2[pair[c], j[c], 0]
+    chord2 = chords2[pair[c], j[c], 1] - start2
+    s0 = (i[c] + t_star[c]) / subdivisions
+    t0 = (j[c] + np.sum((crossing[c] - start2) * chord2, axis=1) / np.maximum(np.sum(chord2**2, axis=1), 1.e-300)) / subdivisions
+    
+    o = np.nonzero(others)[0]
+    
+    return (np.concatenate([pair[c], pair[o]]), 
+            np.concatenate([s0, (i[o] + 0.5) / subdivisions]), 
+            np.concatenate([t0, (j[o] + 0.5) / subdivisions]))
+
+
+def intersection_function_segments_batch(f1, f2, K, subdivisions=16, jacobian1=None, jacobian2=None, 
+                                         tolerance=1.e-12, max_iterations=50, block_size=2**20):
+    """Intersections f1_k(s) = f2_k(t), (s, t) in [0,1]^2, of K pairs of parametrized curves at once
+    
+    f1(s, k) and f2(t, k) give the (len(k),2) array of the points at the parameters s (or t) of the curves numbered k
+    (s, t and k are arrays of the same length), e.g. f1 = lambda s, k: centres[k] + radii[k, np.newaxis] * circle(s).
+    jacobian1(s, k) and jacobian2(t, k), if given, are their derivatives, as (len(k),2) arrays.
+    
+    The roots of all the pairs are bracketed by subdividing both parameter ranges into `subdivisions` pieces (working through 
+    the pairs in blocks of about block_size pairs of pieces), and newton_solve is started from all the brackets at once, 
+    each system k evaluating only its own pair of curves. Roots closer than 1e-8 in both s and t are counted once.
+    Two roots on the same pair of pieces are usually found as one, so subdivisions must be large enough to separate them.
+    
+    Returns (pair, s, t, points) for the distinct intersections, sorted by pair and then by s.
+    """
+    
+    grid = np.linspace(0, 1, subdivisions + 1)
+    middles = grid[:-1] + 0.5/subdivisions
+    
+    def sample(f, t, pairs):
+        k = np.repeat(pairs, len(t))
+        return np.asarray(f(np.tile(t, len(pairs)), k), dtype=float).reshape(len(pairs), len(t), 2)
+    
+    seeds = []
+    rows = max(1, block_size // subdivisions**2)
+    
+    for first in range(0, K, rows):
+        pairs = np.arange(first, min(first + rows, K))
+        
+        pair, s0, t0 = _bracket_intersections(sample(f1, grid, pairs), sample(f2, grid, pairs), 
+                                              sample(f1, middles, pairs), sample(f2, middles, pairs), subdivisions)
+        seeds.append((pairs[pair], s0, t0))
+        
+    pair = np.concatenate([seed[0] for seed in seeds] + [np.zeros(0, dtype=int)])
+    x0 = np.column_stack((np.concatenate([seed[1] for seed in seeds] + [np.zeros(0)]), 
+                          np.concatenate([seed[2] for seed in seeds] + [np.zeros(0)])))
+    
+    F = lambda x, k: f1(x[:, 0], pair[k]) - f2(x[:, 1], pair[k])
+    
+    jacobian = None
+    if jacobian1 is not None and jacobian2 is not None:
+        jacobian = lambda x, k: np.stack((np.asarray(jacobian1(x[:, 0], pair[k])), -np.asarray(jacobian2(x[:, 1], pair[k]))), axis=2)
     
-    # Call Newton or something to find zeros of F!
+    roots, converged = newton_solve(F, x0, jacobian, tolerance, max_iterations)
     
-    # Or just do it lazily: build up a complicated function e.g. in sympy, then solve at last possible moment
+    inside = converged & np.all((roots >= -1.e-10) & (roots <= 1 + 1.e-10), axis=1)
+    pair, roots = pair[inside], np.clip(roots[inside], 0., 1.)
     
-    # NB: IF want e.g. intersection of a parametrized curve with a known *straight* line, then this reduces to a *1D* root-finding problem.
+    # sorted by pair and s, the seeds that found the same root are next to each other:
+    order = np.lexsort((roots[:, 1], roots[:, 0], pair))
+    pair, roots = pair[order], roots[order]
+    
+    duplicate = np.zeros(len(pair), dtype=bool)
+    duplicate[1:] = (pair[1:] == pair[:-1]) & np.all(np.abs(np.diff(roots, axis=0)) <= 1.e-8, axis=1)
+    
+    pair, roots = pair[~duplicate], roots[~duplicate]
+    
+    return pair, roots[:, 0], roots[:, 1], f1(roots[:, 0], pair)
+
+
+def benchmark_intersection_function_segments(K=10**4, subdivisions=16):
+    """Time intersection_function_segments_batch for K pairs of circles of random centres and radii, 
+    and print the number of curve pairs solved per second"""
+    
+    import time
+    
+    np.random.seed(0)
+    centres1, centres2 = np.random.rand(K, 2), np.random.rand(K, 2)
+    radii1, radii2 = 0.2 + np.random.rand(K), 0.2 + np.random.rand(K)
+    
+    circle = lambda t: np.column_stack((np.cos(2*np.pi*t), np.sin(2*np.pi*t)))
+    f1 = lambda s, k: centres1[k] + radii1[k, np.newaxis] * circle(s)
+    f2 = lambda t, k: centres2[k] + radii2[k, np.newaxis] * circle(t)
+    
+    start = time.time()
+    pair, s, t, points = intersection_function_segments_batch(f1, f2, K, subdivisions)
+    elapsed = time.time() - start
+    
+    print("%d curve pairs, %d intersections:  %.3f s  (%.3g curve pairs per second)" % (K, len(pair), elapsed, K / elapsed))
+    
+    return elapsed
+
+# <codecell>
+
+def test_intersection_function_segments():
+    
+    circle = ParametrizedFunctionSegment(lambda t: np.column_stack((np.cos(2*np.pi*t), np.sin(2*np.pi*t))))
+    ellipse = ParametrizedFunctionSegment(lambda t: np.column_stack((2*np.cos(2*np.pi*t), 0.5*np.sin(2*np.pi*t))))
+    
+    s, t, points = intersection_function_segments(circle, ellipse)
+    
+    # the circle and the ellipse cross at 4 points, where x^2 = 4/5 and y^2 = 1/5:
+    assert len(s) == 4
+    assert np.allclose(points**2, [4./5, 1./5])
+    assert np.allclose(circle.f(s), ellipse.f(t))
+    
+    # the same with the exact derivatives:
+    derivative = lambda a, b: (lambda t: 2*np.pi*np.column_stack((-a*np.sin(2*np.pi*t), b*np.cos(2*np.pi*t))))
+    s_exact, t_exact, points_exact = intersection_function_segments(circle, ellipse, jacobian1=derivative(1, 1), jacobian2=derivative(2, 0.5))
+    assert np.allclose(s_exact, s)
+    
+    # a curve against a straight line is a 1D problem:
+    line = DirectedLineSegment([-2, 0.5], [2, 0.5])
+    
+    s, t, points = intersection_function_segments(circle, line)
+    assert np.allclose(s, [1./12, 5./12])
+    assert np.allclose(points, [[np.sqrt(3)/2, 0.5], [-np.sqrt(3)/2, 0.5]])
+    assert np.allclose(t, (points[:, 0] + 2) / 4)
+    
+    s, t, points = intersection_function_segments(line, circle)
+    assert np.allclose(t, [1./12, 5./12][::-1])
+    
+    # the subdivisions are used for lines too: a wave crossing the x axis 50 times needs more than the default 32 brackets
+    wave = ParametrizedFunctionSegment(lambda t: np.column_stack((t, np.sin(50*np.pi*t + 0.1))))
+    axis = DirectedLineSegment([0, 0], [1, 0])
+    assert len(intersection_function_segments(wave, axis)[0]) < 50
+    for f1, f2 in [(wave, axis), (axis, wave)]:
+        s, t, points = intersection_function_segments(f1, f2, subdivisions=200)
+        assert len(s) == 50
+    
+    # no intersections:
+    assert len(intersection_function_segments(circle, ParametrizedFunctionSegment(lambda t: circle.f(t) + 3))[0]) == 0
+    
+    
+def test_intersection_function_segments_batch():
+    
+    # circles of random centres and radii, which cross in 2 points when |r1 - r2| < d < r1 + r2, and otherwise not at all:
+    np.random.seed(2)
+    K = 200
+    centres1, centres2 = np.random.rand(K, 2), np.random.rand(K, 2)
+    radii1, radii2 = 0.2 + np.random.rand(K), 0.2 + np.random.rand(K)
+    
+    circle = lambda t: np.column_stack((np.cos(2*np.pi*t), np.sin(2*np.pi*t)))
+    f1 = lambda s, k: centres1[k] + radii1[k, np.newaxis] * circle(s)
+    f2 = lambda t, k: centres2[k] + radii2[k, np.newaxis] * circle(t)
+    
+    # (two intersections on the same pair of pieces are found as one, so the pieces must be small enough to separate the
+    # intersections of the circles that nearly touch)
+    pair, s, t, points = intersection_function_segments_batch(f1, f2, K, subdivisions=32)
+    
+    d = np.sqrt(np.sum((centres1 - centres2)**2, axis=1))
+    expected = np.where((np.abs(radii1 - radii2) < d) & (d < radii1 + radii2), 2, 0)
+    
+    assert np.array_equal(np.bincount(pair, minlength=K), expected)
+    assert np.allclose(f1(s, pair), f2(t, pair))
+    assert np.allclose(points, f2(t, pair))
+    
+    
+def test_newton_solve():
+    
+    # many independent systems at once: x^2 + y^2 = r^2, y = x, for different r
+    r = np.linspace(1, 2, 1000)
+    F = lambda x, k: np.column_stack((x[:, 0]**2 + x[:, 1]**2 - r[k]**2, x[:, 1] - x[:, 0]))
+    
+    x, converged = newton_solve(F, np.ones((1000, 2)))
+    
+    assert np.all(converged)
+    assert np.allclose(x, (r / np.sqrt(2))[:, np.newaxis])
 
 # <codecell>
 
@@ -245,3 +1242,197 @@ def map_parametrized_curve(Phi, f):
     
     return ParametrizedFunctionSegment(lambda t: Phi(f(t)) )
 
+
+# <markdowncell>
+
+# Under a *nonlinear* map, the image of a straight edge is a curve, so mapping only the vertices gives the wrong shape.
+# Instead we sample the image curve adaptively: an interval $[t_i, t_{i+1}]$ of the parameter is split at its midpoint $t_m$ only if
+# the image point $f(t_m)$ is further than `tolerance` from the chord joining $f(t_i)$ and $f(t_{i+1})$, or if the curve turns by more
+# than `max_angle` there. All the intervals that are still being split are evaluated together, so the function is called with arrays
+# of parameter values: it should take an array of $K$ values of $t$ and return a $(K, 2)$ array of points.
+# (Functions that only accept a single $t$ also work, but are evaluated one point at a time.)
+
+# <codecell>
+
+def _evaluate(f, t):
+    """Evaluate the parametrized curve f at the array of parameters t, giving a (len(t), 2) array of points"""
+    
+    K = len(t)
+    padded = np.concatenate([t, np.repeat(t[-1:], 3 - K)]) if 0 < K < 3 else t  # so that (K,2) and (2,K) can be told apart
+    
+    try:
+        points = np.asarray(f(padded), dtype=float)
+    except Exception:
+        points = None
+        
+    if points is None or points.shape != (len(padded), 2):
+        points = np.array([f(s) for s in padded], dtype=float).reshape(-1, 2)
+        
+    return points[:K]
+
+
+def _refine(f, t, points, tolerance, max_angle, max_points):
+    """Insert midpoints into the sorted samples t (with images points) of the curve f until it is resolved to within tolerance"""
+    
+    active = np.ones(len(t) - 1, dtype=bool)  # intervals that may still need splitting
+    
+    while np.any(active) and len(t) < max_points:
+        i = np.nonzero(active)[0]
+        
+        middle = 0.5 * (t[i] + t[i+1])
+        middle_points = _evaluate(f, middle)
+        
+        a, b = points[i], points[i+1]
+        chord = b - a
+        chord_length = np.sqrt(np.sum(chord**2, axis=1))
+        
+        # distance of the midpoint from the chord, and angle turned by the curve at the midpoint:
+        to_middle = middle_points - a
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = np.where(chord_length > 0, np.abs(chord[:, 0]*to_middle[:, 1] - chord[:, 1]*to_middle[:, 0]) / chord_length, 
+                             np.sqrt(np.sum(to_middle**2, axis=1)))
+        
+        split = error > tolerance
+        
+        if max_angle is not None:
+            first, second = middle_points - a, b - middle_points
+            cross = first[:, 0]*second[:, 1] - first[:, 1]*second[:, 0]
+            dot = np.sum(first * second, axis=1)
+            split |= np.abs(np.arctan2(cross, dot)) > max_angle
+            
+        split &= middle > np.nextafter(t[i], np.inf)  # intervals cannot be split beyond floating-point resolution
+        
+        if len(t) + np.count_nonzero(split) > max_points:  # split the worst intervals only
+            worst = np.argsort(-error * split)[:max_points - len(t)]
+            split[:] = False
+            split[worst] = True
+        
+        # insert the midpoints of the intervals that are split:
+        new = i[split]
+        t = np.insert(t, new + 1, middle[split])
+        points = np.insert(points, new + 1, middle_points[split], axis=0)
+        
+        # both halves of a split interval are checked again:
+        active = np.zeros(len(t) - 1, dtype=bool)
+        shifted = new + np.arange(len(new))
+        active[shifted] = True
+        active[shifted + 1] = True
+        
+    return t, points
+
+
+def refine_curve(curve, tolerance=1.e-3, max_angle=None, initial_points=17, max_points=10**6):
+    """Sample a parametrized curve adaptively, with more points where it bends more
+    
+    curve is a ParametrizedFunctionSegment or a function of t in [0,1].
+    Returns (t, points): the parameter values and the (len(t), 2) array of points on the curve.
+    """
+    
+    if isinstance(curve, ParametrizedFunctionSegment):
+        f, start, end = curve.f, curve.start, curve.end
+    else:
+        f, start, end = curve, 0., 1.
+        
+    t = np.linspace(start, end, initial_points)
+    
+    return _refine(f, t, _evaluate(f, t), tolerance, max_angle, max_points)
+
+
+def map_polygon_adaptive(Phi, polygon, tolerance=1.e-3, max_angle=None, points_per_edge=8, max_points=10**6, simplify=True):
+    """Image of a polygon under a (nonlinear) map Phi: R^2 -> R^2, with its boundary resolved to within tolerance
+    
+    Phi must map an (K,2) array of points to a (K,2) array of their images.
+    The boundary of polygon is parametrized by s in [0, N], where s = k + t is the point a fraction t along edge k;
+    its image is refined as in refine_curve, starting from points_per_edge equally spaced points along each edge 
+    (so that wiggles that happen to vanish at the midpoints of the edges are not missed).
+    
+    With simplify, image vertices that lie within tolerance/4 of the chord joining their neighbours are then removed,
+    so that the number of vertices stays bounded when the map is applied over and over again.
+    """
+    
+    vertices, v = polygon.vertices, polygon.v
+    N = len(vertices)
+    
+    def boundary_image(s):
+        k = np.minimum(np.floor(s).astype(int), N - 1)
+        return np.asarray(Phi(vertices[k] + (s - k)[:, np.newaxis] * v[k]), dtype=float)
+    
+    s = np.linspace(0, N, N*points_per_edge + 1)
+    points = boundary_image(s)
+    
+    s, points = _refine(boundary_image, s, points, tolerance, max_angle, max_points)
+    
+    image = DirectedPolygon(points[:-1])
+    
+    return simplify_polygon(image, tolerance / 4.) if simplify else image
+
+
+def simplify_polygon(polygon, tolerance):
+    """Remove vertices of a polygon that lie within tolerance of the line joining their neighbours
+    
+    At each pass every other vertex may be removed, so that neighbouring vertices are never removed together;
+    passes are repeated until nothing changes."""
+    
+    vertices = polygon.vertices
+    
+    while len(vertices) > 3:
+        previous, following = np.roll(vertices, 1, axis=0), np.roll(vertices, -1, axis=0)
+        
+        chord = following - previous
+        chord_length = np.sqrt(np.sum(chord**2, axis=1))
+        to_vertex = vertices - previous
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.abs(chord[:, 0]*to_vertex[:, 1] - chord[:, 1]*to_vertex[:, 0]) / chord_length
+            
+        removable = (distance < tolerance) | (chord_length == 0)
+        removable[1::2] = False
+        
+        if len(vertices) % 2 == 1:  # the last and first vertices are neighbours
+            removable[-1] = False
+            
+        removable[np.argsort(removable)[:3]] = False  # always keep at least 3 vertices
+            
+        if not np.any(removable):
+            break
+            
+        vertices = vertices[~removable]
+        
+    return DirectedPolygon(vertices)
+
+# <codecell>
+
+def test_refine_curve():
+    
+    circle = ParametrizedFunctionSegment(lambda t: np.column_stack((np.cos(2*np.pi*t), np.sin(2*np.pi*t))))
+    
+    for tolerance in [1.e-2, 1.e-4]:
+        t, points = refine_curve(circle, tolerance)
+        
+        # the largest gap between the curve and the chords is the sagitta 1 - cos(pi dt) of the longest interval:
+        assert 1 - np.cos(np.pi * np.max(np.diff(t))) <= tolerance
+        assert np.allclose(np.sum(points**2, axis=1), 1.0)
+        
+    # no more points are used than needed, up to a factor of 2 from the bisection:
+    assert len(t) <= 2 * np.pi / np.arccos(1 - 1.e-4) + 17
+    
+    # a scalar-only function gives the same result:
+    t_scalar, points_scalar = refine_curve(lambda s: (np.cos(2*np.pi*s), np.sin(2*np.pi*s)), 1.e-4)
+    assert np.array_equal(t, t_scalar)
+    
+    
+def test_map_polygon_adaptive():
+    
+    # a nonlinear area-preserving map (a shear followed by a nonlinear shear):
+    def Phi(x):
+        y = x[:, 1] + 0.3*np.sin(2*np.pi*x[:, 0])
+        return np.column_stack((x[:, 0] + y, y))
+    
+    polygon = DirectedPolygon([(0.,0.), (1.,0.), (1.,1.), (0.,1.)])
+    
+    for n in range(4):
+        polygon = map_polygon_adaptive(Phi, polygon, tolerance=1.e-4)
+        
+        assert np.isclose(_signed_area(polygon.vertices), 1.0, atol=1.e-3)
+        
+    assert len(polygon) < 5000
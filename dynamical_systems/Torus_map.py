@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+Maps of polygons on the torus [0,1)^2, such as the Arnold cat map
+"""
+
+# <codecell>
+
+import numpy as np
+from Polygon_class import *
+
+# <markdowncell>
+
+# The Arnold cat map acts on the torus, i.e. the unit square with opposite sides identified: a point is mapped with the matrix $\mathsf{M}$
+# and then reduced mod 1. The image of a polygon under $\mathsf{M}$ covers many cells $[i, i+1] \times [j, j+1]$ of the integer lattice;
+# we cut it into pieces along the lattice and translate each piece back into the unit square. The result is a `MultiPolygon`.
+
+# <codecell>
+
+CAT_MAP = np.array([[2, 1], [1, 1]])
+
+unit_cell = np.array([(0., 0.), (1., 0.), (1., 1.), (0., 1.)])
+
+# <markdowncell>
+
+# Iterates of a linear map are found directly from powers of its matrix, calculated by repeated squaring. 
+# The entries of $\mathsf{M}^n$ grow like $\lambda^n$, with $\lambda = (3 + \sqrt{5})/2$ for the cat map, and overflow 64-bit integers 
+# beyond $n = 45$, so they are kept as Python integers (in an array of `object` dtype) when necessary.
+
+# <codecell>
+
+def matrix_power(M, n):
+    """M^n for a square integer matrix M, by repeated squaring
+    
+    The result is exact: an int64 array if its entries fit, and otherwise an object array of Python integers."""
+    
+    M = np.asarray(M)
+    
+    if not np.issubdtype(M.dtype, np.integer) and M.dtype != object:
+        return np.linalg.matrix_power(M, n)
+    
+    result = np.identity(len(M), dtype=np.int64).astype(object)
+    power = M.astype(object)
+    
+    while n > 0:
+        if n & 1:
+            result = np.dot(result, power)
+        power = np.dot(power, power)
+        n >>= 1
+        
+    if max(abs(entry) for entry in result.flat) < 2**63:
+        return result.astype(np.int64)
+    
+    return result
+
+
+def linear_iterates(vertices, ns, M=CAT_MAP):
+    """The images of the vertices under the iterates M^n of a linear map, for each n in ns
+    
+    vertices is an (N,2) array, or a DirectedPolygon; ns is a number or a sequence of k numbers.
+    Returns an array of shape (N,2) for a single n, or (k,N,2) for a sequence, each found with a single matrix product.
+    """
+    
+    if isinstance(vertices, DirectedPolygon):
+        vertices = vertices.vertices
+        
+    if np.isscalar(ns):
+        return linear_iterates(vertices, [ns], M)[0]
+        
+    powers = [matrix_power(M, n) for n in ns]
+    
+    if any(power.dtype == object for power in powers):
+        powers = np.array(powers, dtype=object)
+        vertices = np.asarray(vertices).astype(object)
+    else:
+        powers = np.array(powers)
+    
+    return np.matmul(vertices, powers.transpose(0, 2, 1))
+
+# <codecell>
+
+def test_linear_iterates():
+    
+    square = np.array([(0, 0), (1, 0), (1, 1), (0, 1)])
+    
+    iterates = linear_iterates(square, range(6))
+    assert iterates.shape == (6, 4, 2)
+    
+    vertices = square
+    for n in range(6):
+        assert np.array_equal(iterates[n], vertices)
+        vertices = np.dot(vertices, CAT_MAP.T)
+        
+    # the entries of M^n are Fibonacci numbers, which are exact even beyond 64 bits:
+    fibonacci = [0, 1]
+    while len(fibonacci) < 202:
+        fibonacci.append(fibonacci[-1] + fibonacci[-2])
+        
+    assert list(matrix_power(CAT_MAP, 100).flat) == [fibonacci[201], fibonacci[200], fibonacci[200], fibonacci[199]]
+    assert linear_iterates(square, 100)[2, 0] == fibonacci[201] + fibonacci[200]
+
+# <codecell>
+
+def _following(offsets, size):
+    """Index of the vertex following each vertex around its own polygon"""
+    
+    following = np.arange(1, size + 1)
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    following[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    
+    return following
+
+
+def _ranges(low, counts):
+    """Concatenation of the ranges low[k], low[k]+1, ..., low[k]+counts[k]-1"""
+    
+    return np.repeat(low, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def covered_cells(polygons):
+    """Find the lattice cells [i,i+1]x[j,j+1] that each polygon of a MultiPolygon may overlap
+    
+    For each polygon and each row j that it crosses, the x extent of the polygon within the strip j <= y <= j+1 is found
+    from its vertices inside the strip and the points where its edges cross the lines y=j and y=j+1;
+    all the cells between those x values are returned. For convex polygons these are exactly the cells that the polygon meets.
+    
+    Returns (which, cells), where cells[k] = (i, j) is a cell that polygon number which[k] may overlap.
+    """
+    
+    vertices, offsets = polygons.vertices, polygons.offsets
+    owner = polygons.owner
+    x, y = vertices[:, 0], vertices[:, 1]
+    
+    # rows first_row <= j < first_row + rows crossed by each polygon:
+    y_min = np.zeros(len(polygons))
+    y_max = np.zeros(len(polygons))
+    nonempty = np.diff(offsets) > 0
+    y_min[nonempty] = np.minimum.reduceat(y, offsets[:-1][nonempty])
+    y_max[nonempty] = np.maximum.reduceat(y, offsets[:-1][nonempty])
+    
+    first_row = np.floor(y_min).astype(int)
+    rows = np.where(nonempty, np.maximum(np.ceil(y_max).astype(int) - first_row, 1), 0)
+    row_start = np.cumsum(rows) - rows
+    
+    # points that fix the x extent in each row:
+    # the vertices (in both neighbouring rows if they lie on a row boundary) ...
+    following = _following(offsets, len(vertices))
+    
+    point_x = [x, x]
+    point_owner = [owner, owner]
+    point_row = [np.floor(y).astype(int), np.ceil(y).astype(int) - 1]
+    
+    # ... and the crossings of the edges with the lines y = k, which lie in rows k-1 and k:
+    x0, y0, x1, y1 = x, y, x[following], y[following]
+    
+    k_low = np.ceil(np.minimum(y0, y1)).astype(int)
+    crossings = np.where(y0 != y1, np.maximum(np.floor(np.maximum(y0, y1)).astype(int) - k_low + 1, 0), 0)
+    
+    edge = np.repeat(np.arange(len(vertices)), crossings)
+    k = _ranges(k_low[crossings > 0], crossings[crossings > 0])
+    crossing_x = x0[edge] + (k - y0[edge]) / (y1[edge] - y0[edge]) * (x1[edge] - x0[edge])
+    
+    point_x += [crossing_x, crossing_x]
+    point_owner += [owner[edge], owner[edge]]
+    point_row += [k - 1, k]
+    
+    point_x, point_owner, point_row = np.concatenate(point_x), np.concatenate(point_owner), np.concatenate(point_row)
+    
+    row = point_row - first_row[point_owner]
+    valid = (row >= 0) & (row < rows[point_owner])
+    row_key = row_start[point_owner[valid]] + row[valid]
+    
+    x_min = np.full(rows.sum(), np.inf)
+    x_max = np.full(rows.sum(), -np.inf)
+    np.minimum.at(x_min, row_key, point_x[valid])
+    np.maximum.at(x_max, row_key, point_x[valid])
+    
+    # all the cells between x_min and x_max in each row:
+    row_owner = np.repeat(np.arange(len(polygons)), rows)
+    row_j = _ranges(first_row[nonempty], rows[nonempty])
+    
+    i_low = np.floor(x_min).astype(int)
+    cells_in_row = np.maximum(np.ceil(x_max).astype(int) - i_low, 1)
+    
+    row = np.repeat(np.arange(len(row_j)), cells_in_row)
+    
+    return row_owner[row], np.column_stack((_ranges(i_low, cells_in_row), row_j[row]))
+
+
+def split_on_lattice(polygons):
+    """Cut a polygon (or each polygon of a MultiPolygon) along the integer lattice, 
+    and translate each piece back into the unit square
+    
+    Returns (pieces, cells): a MultiPolygon of the pieces in the unit square, and the lattice cell (i, j) that each came from.
+    """
+    
+    if isinstance(polygons, DirectedPolygon):
+        polygons = MultiPolygon(polygons.vertices, [0, len(polygons)])
+    
+    which, cells = covered_cells(polygons)
+    
+    vertices, offsets = clip_polygon_windows(polygons, unit_cell + cells[:, np.newaxis, :], which)
+    
+    counts = np.diff(offsets)
+    vertices -= np.repeat(cells, counts, axis=0)
+    
+    nonempty = counts > 0
+    
+    return MultiPolygon(vertices, np.concatenate([[0], np.cumsum(counts[nonempty])])), cells[nonempty]
+
+# <markdowncell>
+
+# Since $\mathsf{M}$ has integer entries, $\mathsf{M} (\mathbf{x} + \mathbf{k}) = \mathsf{M} \mathbf{x} + \mathsf{M} \mathbf{k}$ 
+# with $\mathsf{M} \mathbf{k}$ an integer vector, so reducing mod 1 after each step or only at the end gives the same result. 
+# Thus the $n$th iterate on the torus can be found by mapping with $\mathsf{M}^n$ and cutting up only once.
+
+# <codecell>
+
+def torus_map(polygon, n=1, M=CAT_MAP, max_error=1e-6):
+    """Apply the map x -> M.x (mod 1) n times to a polygon (or MultiPolygon) in the unit square
+    
+    If M has integer entries the n steps are done at once with the matrix M^n; otherwise the pieces are 
+    mapped and cut up again at each step.
+    
+    The vertices are floats, so the image is only good to about max|M^n_ij| * 2.2e-16 (for the cat map, about 6e-2 by n = 35);
+    a ValueError is raised when this is more than max_error (for the cat map, from n = 24 with the default 1e-6).
+    
+    In practice memory runs out first: the number of pieces grows like lambda^n, for the largest eigenvalue lambda of M 
+    (2.618 for the cat map: the unit square is cut into 3.5 million pieces by n = 15, and n = 20 does not fit in memory).
+    
+    Returns the image as a MultiPolygon in the unit square.
+    """
+    
+    M = np.asarray(M)
+    
+    if isinstance(polygon, DirectedPolygon):
+        polygon = MultiPolygon(polygon.vertices, [0, len(polygon)])
+        
+    if np.issubdtype(M.dtype, np.integer):
+        M, n = matrix_power(M, n), min(n, 1)
+        
+        largest = max(abs(int(entry)) for entry in M.flat)
+        if largest * np.finfo(float).eps > max_error:
+            raise ValueError("the entries of M^n (up to %d) are too large for an error below %g with floats" % (largest, max_error))
+        
+        M = M.astype(float)
+        
+    for step in range(n):
+        polygon, cells = split_on_lattice(MultiPolygon(np.dot(polygon.vertices, M.T), polygon.offsets))
+        
+    return polygon
+
+# <codecell>
+
+def test_torus_map():
+    
+    unit_square = DirectedPolygon(unit_cell)
+    
+    for n in range(1, 6):
+        image = torus_map(unit_square, n)
+        
+        # the cat map is area preserving and the image covers the torus exactly once:
+        assert np.isclose(image.areas().sum(), 1.0)
+        assert np.all(image.areas() > 0)
+        assert np.all((image.vertices >= -1e-12) & (image.vertices <= 1 + 1e-12))
+        
+    # a small square near the origin is only stretched by the first iterate:
+    small_square = DirectedPolygon(0.1 * unit_cell + 0.01)
+    image = torus_map(small_square, 1)
+    
+    assert len(image) == 1
+    assert np.allclose(image.vertices, np.dot(small_square.vertices, CAT_MAP.T))
+    
+    # from n = 24 the rounding errors of floats are larger than max_error (and beyond n = 38 the entries of M^n are not even exact):
+    for n in (24, 50):
+        try:
+            torus_map(unit_square, n)
+        except ValueError:
+            pass
+        else:
+            assert False
+    
+    # stepping with a non-integer matrix covers the same area as jumping with the integer one:
+    assert np.isclose(torus_map(small_square, 3, M=CAT_MAP.astype(float)).areas().sum(), 0.01)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+colorline: multi-colored lines drawn with a LineCollection, optionally decimated to the resolution of the axes
+"""
+
+# <codecell>
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from numpy.lib.stride_tricks import as_strided
+
+
+# Data manipulation:
+
+def make_points(x, y=None):
+    '''
+    Stack the x and y coordinates into a single (N, 2) array of points, with one copy.
+    If y is None, x is taken to be such an array of points already, and is used as it is if possible.
+    '''
+    
+    if y is None:
+        return np.ascontiguousarray(x, dtype=float)
+    
+    points = np.empty((len(x), 2))
+    points[:, 0] = x
+    points[:, 1] = y
+    
+    return points
+
+
+def make_segments(x, y=None):
+    '''
+    Create list of line segments from x and y coordinates (or from an (N, 2) array of points x), 
+    in the correct format for LineCollection:
+    an array of the form   numlines x (points per line) x 2 (x and y) array
+    
+    Segment k is made of points k and k+1, so the segments overlap in memory: the result is a read-only view 
+    of shape (N-1, 2, 2) of the points, without copying them again.
+    '''
+
+    points = make_points(x, y)
+    row, column = points.strides
+    
+    segments = as_strided(points, shape=(max(len(points) - 1, 0), 2, 2), strides=(row, row, column))
+    segments.flags.writeable = False
+    
+    return segments
+
+
+# Level of detail:
+
+def _ranges(low, counts):
+    '''Concatenation of the ranges low[k], low[k]+1, ..., low[k]+counts[k]-1'''
+    
+    return np.repeat(low, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def minmax_indices(pixels, width):
+    '''
+    Indices of the points to keep to draw the curve through the given points (in pixels) at screen resolution:
+    for each run of consecutive points in the same pixel column, the first and last points and those with the lowest 
+    and highest y. Points beyond the left or right edges (0 and width) are treated as lying in a single column on each side.
+    '''
+    
+    column = np.clip(np.floor(pixels[:, 0]), -1, width)
+    y = pixels[:, 1]
+    
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    counts = np.diff(np.r_[starts, len(pixels)])
+    run = np.repeat(np.arange(len(starts)), counts)
+    
+    kept = [starts, starts + counts - 1]
+    
+    for extreme in (np.minimum, np.maximum):
+        where = np.flatnonzero(y == extreme.reduceat(y, starts)[run])
+        kept.append(where[np.r_[True, run[where][1:] != run[where][:-1]]])  # the first in each run
+        
+    return np.unique(np.concatenate(kept))
+
+
+def rdp_indices(pixels, tolerance=0.5):
+    '''
+    Indices of the points kept by Ramer-Douglas-Peucker simplification of the curve through the given points (in pixels):
+    the points within tolerance of the chord of their interval are dropped, and the others split the interval in two. 
+    All the intervals at the same depth are dealt with at once.
+    '''
+    
+    keep = np.zeros(len(pixels), dtype=bool)
+    keep[[0, -1]] = True
+    
+    starts, ends = np.array([0]), np.array([len(pixels) - 1])
+    
+    while len(starts):
+        counts = ends - starts - 1
+        starts, ends, counts = starts[counts > 0], ends[counts > 0], counts[counts > 0]
+        if not len(starts):
+            break
+        
+        owner = np.repeat(np.arange(len(starts)), counts)
+        interior = _ranges(starts + 1, counts)
+        
+        a, chord = pixels[starts][owner], (pixels[ends] - pixels[starts])[owner]
+        offset = pixels[interior] - a
+        length = np.hypot(chord[:, 0], chord[:, 1])
+        
+        distance = np.where(length > 0, np.abs(chord[:, 0]*offset[:, 1] - chord[:, 1]*offset[:, 0]) / np.where(length > 0, length, 1),
+                            np.hypot(offset[:, 0], offset[:, 1]))
+        
+        largest = np.maximum.reduceat(distance, np.cumsum(counts) - counts)
+        farthest = np.flatnonzero(distance == largest[owner])
+        farthest = farthest[np.r_[True, owner[farthest][1:] != owner[farthest][:-1]]]  # the first in each interval
+        
+        split = largest[owner[farthest]] > tolerance
+        farthest, intervals = interior[farthest[split]], owner[farthest[split]]
+        keep[farthest] = True
+        
+        starts, ends = np.r_[starts[intervals], farthest], np.r_[farthest, ends[intervals]]
+        
+    return np.flatnonzero(keep)
+
+
+def _run_means(values, kept):
+    '''Mean of the values (one for each segment) over the segments merged into each segment between consecutive kept points'''
+    
+    return np.add.reduceat(values, kept[:-1]) / np.diff(kept)
+
+
+def decimate(points, ax, lod='minmax', tolerance=0.5):
+    '''
+    Indices of the points of a curve to keep to draw it in ax at screen resolution, with lod='minmax' or 'rdp' 
+    
+    The points are first reduced to the minimum and maximum in each pixel column (which is exact at screen resolution, 
+    and collapses the parts of the curve to the left and right of the axes); with lod='rdp', the remaining points 
+    are then simplified by Ramer-Douglas-Peucker, to within tolerance pixels.
+    '''
+    
+    if lod not in ('minmax', 'rdp'):
+        raise ValueError("lod must be 'minmax' or 'rdp'")
+    
+    pixels = ax.transData.transform(points)
+    kept = minmax_indices(pixels - ax.bbox.min, ax.bbox.width)
+    
+    if lod == 'rdp':
+        kept = kept[rdp_indices(pixels[kept], tolerance)]
+        
+    return kept
+
+
+# Interface to LineCollection:
+
+def colorline(x, y, z=None, ax=None, cmap=plt.get_cmap('copper'), norm=plt.Normalize(0.0, 1.0), 
+              linewidth=3, alpha=1.0, copy=True, lod=None, tolerance=0.5):
+    '''
+    Draws a (multi-)colored 1D line in 2D, with coordinates x and y (or with y None and an (N, 2) array of points x).
+    The variable color of the line is taken from optional data in z.
+    Returns the LineCollection created.
+    
+    With copy=False, the LineCollection is given the segments as a view of a single array of points (x itself, if it is 
+    already a float array of points), so that the coordinates are not copied again; the points must then not be changed afterwards.
+    
+    With lod='minmax' or 'rdp', only enough of the points to draw the curve at the resolution of the axes are used 
+    (see decimate), with z (and linewidth, if it is an array) averaged over the merged segments; the curve is decimated again
+    whenever the axes are zoomed or panned.
+    
+    z can be:
+    - empty, in which case a default coloring will be used based on the position along the input arrays
+    - a single number, for a uniform color [this can also be accomplished with the usual plt.plot]
+    - an array of the length of at least the same length as x, to color according to this data
+    - an array of a smaller length, in which case the colors are repeated along the curve
+    
+    See also: plt.streamplot
+    '''
+    
+    # Default colors equally spaced on [0,1]:
+    if z is None:
+        z = np.linspace(0.0, 1.0, len(x))
+           
+    # Special case if a single number:
+    if not hasattr(z, "__iter__"):  # to check for numerical input -- this is a hack
+        z = np.array([z])
+        
+    z = np.asarray(z)
+    
+    if ax is None:
+        ax = plt.gca()
+    
+    if lod is not None:
+        return _colorline_lod(make_points(x, y), z, ax, lod, tolerance, cmap=cmap, norm=norm, linewidth=linewidth, alpha=alpha)
+    
+    segments = make_segments(x, y)
+    if copy:
+        segments = segments.copy()
+        
+    lc = LineCollection(segments, array=z, cmap=cmap, norm=norm, linewidth=linewidth, alpha=alpha)
+    
+    ax.add_collection(lc)
+    
+    return lc
+
+
+class _LODLineCollection(LineCollection):
+    '''
+    LineCollection for colorline with lod='minmax' or 'rdp', decimated again when it is drawn after the limits of its axes 
+    have changed (which the axes callbacks record)
+    '''
+    
+    def __init__(self, points, z, lod, tolerance, linewidth, **kwargs):
+        LineCollection.__init__(self, [], linewidth=linewidth, **kwargs)
+        
+        self.points, self.lod, self.tolerance = points, lod, tolerance
+        self.z = np.resize(z, len(points) - 1)  # repeated along the curve if shorter
+        self.widths = np.resize(linewidth, len(points) - 1) if np.ndim(linewidth) else None
+        self.decimated = None  # the (limits, size) of the axes that the segments were decimated for
+        
+    def decimate(self):
+        ax = self.axes
+        kept = decimate(self.points, ax, self.lod, self.tolerance)
+        
+        self.set_segments(make_segments(self.points[kept]))
+        self.set_array(_run_means(self.z, kept))
+        if self.widths is not None:
+            self.set_linewidth(_run_means(self.widths, kept))
+            
+        self.decimated = (tuple(ax.viewLim.bounds), tuple(ax.bbox.bounds))
+        
+    def limits_changed(self, ax):
+        self.decimated = None
+        self.stale = True
+        
+    def draw(self, renderer):
+        # (a change of size of the figure also needs new segments)
+        if self.decimated != (tuple(self.axes.viewLim.bounds), tuple(self.axes.bbox.bounds)):
+            self.decimate()
+        LineCollection.draw(self, renderer)
+
+
+def _colorline_lod(points, z, ax, lod, tolerance, **kwargs):
+    '''colorline for lod='minmax' or 'rdp' '''
+    
+    lc = _LODLineCollection(points, z, lod, tolerance, **kwargs)
+    
+    # (the segments are only made when the collection is first drawn, once the limits of the axes are known)
+    ax.add_collection(lc, autolim=False)
+    ax.update_datalim([points.min(axis=0), points.max(axis=0)])
+    ax.autoscale_view()
+    
+    lc.lod_callbacks = [ax.callbacks.connect(limits, lc.limits_changed) for limits in ('xlim_changed', 'ylim_changed')]
+    
+    return lc
+
+
+def test_minmax_indices():
+    
+    np.random.seed(0)
+    pixels = np.column_stack((np.sort(np.random.uniform(-5, 25, 2000)), np.random.randn(2000)))
+    
+    kept = minmax_indices(pixels, 20)
+    column = np.clip(np.floor(pixels[:, 0]), -1, 20)
+    
+    # at most 4 points for each column (the columns beyond the edges counting as one each), including its first, last, 
+    # lowest and highest points:
+    assert len(kept) <= 4 * 22
+    for c in np.unique(column):
+        run = np.flatnonzero(column == c)
+        y = pixels[run, 1]
+        assert set([run[0], run[-1], run[np.argmin(y)], run[np.argmax(y)]]) == set(kept[column[kept] == c])
+        
+    # a curve that comes back to a column starts a new run there:
+    assert list(minmax_indices(np.array([[0.5, 0.], [1.5, 0.], [0.5, 1.], [0.6, 2.]]), 2)) == [0, 1, 2, 3]
+    
+    
+def test_rdp_indices():
+    
+    t = np.linspace(0, 2*np.pi, 10**4)
+    pixels = np.column_stack((100*t, 100*np.sin(t)))
+    
+    for tolerance in (0.1, 0.5, 2.):
+        kept = rdp_indices(pixels, tolerance)
+        
+        assert kept[0] == 0 and kept[-1] == len(pixels) - 1
+        assert len(kept) < len(pixels) / 10
+        
+        # every point dropped is within tolerance of the chord between the kept points on either side:
+        segment = np.searchsorted(kept, np.arange(len(pixels)), side='right') - 1
+        segment = np.minimum(segment, len(kept) - 2)
+        a, b = pixels[kept[segment]], pixels[kept[segment + 1]]
+        chord, offset = b - a, pixels - a
+        distance = np.abs(chord[:, 0]*offset[:, 1] - chord[:, 1]*offset[:, 0]) / np.hypot(chord[:, 0], chord[:, 1])
+        assert distance.max() <= tolerance
+        
+    # a straight line keeps only its ends:
+    assert list(rdp_indices(np.column_stack((np.arange(10.), np.arange(10.))))) == [0, 9]
+    
+    
+def test_run_means():
+    
+    assert list(_ranges(np.array([3, 10]), np.array([2, 3]))) == [3, 4, 10, 11, 12]
+    
+    # the values of the segments 0-1, 1-2, 2-3 and 3-4 merged into 0-1 and 1-4:
+    assert np.allclose(_run_means(np.array([1., 2., 3., 4.]), np.array([0, 1, 4])), [1., 3.])
+
+
+def test_colorline_lod():
+    
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    n = 10**5
+    x = np.arange(n, dtype=float)
+    y = np.sin(x / 50.) + np.random.RandomState(0).randn(n)
+    
+    fig = Figure(figsize=(4, 3), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    
+    # without lod, every segment is drawn:
+    lc = colorline(x, y, ax=ax)
+    assert len(lc.get_segments()) == n - 1
+    lc.remove()
+    
+    lc = colorline(x, y, ax=ax, lod='minmax')
+    assert isinstance(lc, _LODLineCollection)
+    assert ax.get_xlim()[0] <= 0 and ax.get_xlim()[1] >= n - 1  # the axes are scaled to all the points
+    
+    canvas.draw()
+    width = ax.bbox.width
+    whole = len(lc.get_segments())
+    assert whole <= 4 * (width + 2)
+    
+    # zooming in decimates again, for the points now in view, which all fit into the pixel columns without merging:
+    ax.set_xlim(1000, 1100)
+    canvas.draw()
+    zoomed = lc.get_segments()
+    assert len(zoomed) != whole
+    vertices = np.concatenate([zoomed[0][:1]] + [segment[1:] for segment in zoomed])
+    assert np.array_equal(vertices[:, 0][(vertices[:, 0] >= 1000) & (vertices[:, 0] <= 1100)], np.arange(1000., 1101.))
+    
+    # and so does zooming out again:
+    ax.set_xlim(0, n)
+    canvas.draw()
+    assert len(lc.get_segments()) <= 4 * (width + 2)
+    
+    # the colors are the means over the merged segments, and 'rdp' drops more points:
+    assert np.all(lc.get_array() >= 0) and np.all(lc.get_array() <= 1)
+    rdp = colorline(x, y, ax=ax, lod='rdp', tolerance=2.)
+    canvas.draw()
+    assert len(rdp.get_segments()) < len(lc.get_segments())
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# <nbformat>3.0</nbformat>
+
+# <codecell>
+
+"""
+colordensity: curves and clouds of points drawn as a density image at the resolution of the axes
+"""
+
+# <codecell>
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+# Rasterized density, for curves and clouds of points too dense for LineCollection:
+
+class LineDensity(object):
+    '''
+    2D histogram of shape (rows, columns) covering extent = (xmin, xmax, ymin, ymax), into which points or line segments
+    are drawn chunk by chunk. Each pixel records how many times it was hit (count) and the sum of the z values of the hits (total).
+    
+    Segments are drawn with a vectorized DDA, which hits the same pixels as Bresenham's algorithm: a segment spanning 
+    n pixels along its longer direction hits n of them, so the cost grows with the number of pixels drawn, 
+    and the memory used only with the number of pixels in the image.
+    '''
+    
+    def __init__(self, extent, shape, max_samples=2**22):
+        self.extent = tuple(float(e) for e in extent)
+        self.shape = tuple(shape)
+        self.max_samples = max_samples
+        
+        self.count = np.zeros(self.shape)
+        self.total = np.zeros(self.shape)
+        self.last = None  # the last point drawn by add_line, so that the next chunk carries on from it
+        
+    def to_pixels(self, x, y):
+        '''Continuous pixel coordinates (column, row) of the points (x, y)'''
+        
+        xmin, xmax, ymin, ymax = self.extent
+        rows, columns = self.shape
+        
+        return (np.asarray(x, dtype=float) - xmin) * (columns / (xmax - xmin)), (np.asarray(y, dtype=float) - ymin) * (rows / (ymax - ymin))
+        
+    def _accumulate(self, column, row, z):
+        rows, columns = self.shape
+        
+        # (inside the image, truncating to integers is the same as rounding down; points on the upper edges of the extent,
+        # such as the extreme points of the data, go in the last row or column)
+        inside = (column >= 0) & (column <= columns) & (row >= 0) & (row <= rows)
+        index = np.minimum(row[inside].astype(int), rows - 1) * columns + np.minimum(column[inside].astype(int), columns - 1)
+        
+        self.count += np.bincount(index, minlength=rows*columns).reshape(self.shape)
+        if z is not None:
+            self.total += np.bincount(index, weights=np.broadcast_to(z, inside.shape)[inside], minlength=rows*columns).reshape(self.shape)
+            
+    def add_points(self, x, y, z=None):
+        '''Count each of the points (x, y), with values z'''
+        
+        column, row = self.to_pixels(x, y)
+        self._accumulate(column, row, z)
+        
+    def add_line(self, x, y, z=None):
+        '''
+        Draw the segments joining consecutive points (x, y), carrying on from the last point drawn (in the previous chunk).
+        The value z of each point is given to the pixels of the segment that ends there. 
+        '''
+        
+        column, row = self.to_pixels(x, y)
+        z = None if z is None else np.broadcast_to(np.asarray(z, dtype=float), column.shape)
+        
+        if len(column) == 0:
+            return
+        
+        if self.last is None:  # the very first point
+            self._accumulate(column[:1], row[:1], None if z is None else z[:1])
+        else:
+            column, row = np.r_[self.last[0], column], np.r_[self.last[1], row]
+            if z is not None:
+                z = np.r_[self.last[2], z]
+                
+        self.last = (column[-1], row[-1], None if z is None else z[-1])
+        
+        # each segment hits one pixel per step along its longer direction, not counting its starting point
+        # (which was drawn as the end of the previous one):
+        column_step, row_step = np.diff(column), np.diff(row)
+        steps = np.maximum(np.ceil(np.maximum(np.abs(column_step), np.abs(row_step))), 1).astype(int)
+        column_step /= steps
+        row_step /= steps
+        
+        ends = np.cumsum(steps)
+        
+        # the segments are drawn in blocks of at most max_samples pixels:
+        first = 0
+        while first < len(steps):
+            last = max(np.searchsorted(ends, ends[first] - steps[first] + self.max_samples, side='right'), first + 1)
+            
+            counts = steps[first:last]
+            k = np.arange(1, counts.sum() + 1) - np.repeat(np.cumsum(counts) - counts, counts)  # 1, 2, ..., steps for each segment
+            
+            self._accumulate(np.repeat(column[first:last], counts) + k * np.repeat(column_step[first:last], counts),
+                             np.repeat(row[first:last], counts) + k * np.repeat(row_step[first:last], counts),
+                             None if z is None else np.repeat(z[first + 1:last + 1], counts))
+            first = last
+        
+    def image(self, mode='count'):
+        '''The counts, or (with mode='mean') the mean value of z in each pixel, masked where nothing was drawn'''
+        
+        if mode == 'count':
+            return np.ma.masked_equal(self.count, 0)
+        if mode == 'mean':
+            return np.ma.masked_where(self.count == 0, self.total / np.maximum(self.count, 1))
+        
+        raise ValueError("mode must be 'count' or 'mean'")
+        
+    def show(self, ax=None, mode='count', **kwargs):
+        '''Draw the image with imshow; further keyword arguments are passed to imshow'''
+        
+        if ax is None:
+            ax = plt.gca()
+            
+        kwargs.setdefault('interpolation', 'nearest')
+        kwargs.setdefault('aspect', 'auto')
+        
+        return ax.imshow(self.image(mode), origin='lower', extent=self.extent, **kwargs)
+    
+
+def colordensity(x, y=None, z=None, ax=None, lines=True, mode=None, extent=None, shape=None, chunk_size=10**6, **kwargs):
+    '''
+    Draws the curve through (or, with lines=False, the points) x and y as a density image: a 2D histogram at the resolution 
+    of the axes, colored by the number of hits in each pixel (mode='count'), or by the mean of z (mode='mean', 
+    the default when z is given). Returns the AxesImage created.
+    
+    x and y may also be replaced by an iterable x of chunks (x, y) or (x, y, z), e.g. from a generator producing 
+    an orbit bit by bit; extent = (xmin, xmax, ymin, ymax) must then be given. Otherwise the extent defaults to that of the data, 
+    and x and y are drawn chunk_size points at a time.
+    Further keyword arguments (cmap, norm, ...) are passed to imshow.
+    
+    See also: colorline
+    '''
+    
+    if ax is None:
+        ax = plt.gca()
+        
+    if mode is None:
+        mode = 'count' if z is None else 'mean'
+        
+    if y is None:
+        chunks = x
+        if extent is None:
+            raise ValueError("the extent must be given for chunked input")
+    else:
+        x, y = np.asarray(x), np.asarray(y)
+        if extent is None:
+            extent = (x.min(), x.max(), y.min(), y.max())
+        chunks = ((x[k:k+chunk_size], y[k:k+chunk_size]) + (() if z is None else (np.broadcast_to(z, x.shape)[k:k+chunk_size],))
+                  for k in range(0, len(x), chunk_size))
+        
+    if shape is None:
+        shape = (max(int(ax.bbox.height), 1), max(int(ax.bbox.width), 1))
+        
+    density = LineDensity(extent, shape)
+    
+    for chunk in chunks:
+        if lines:
+            density.add_line(*chunk)
+        else:
+            density.add_points(*chunk)
+            
+    return density.show(ax, mode, **kwargs)
+
+
+def test_line_density():
+    
+    density = LineDensity((0, 1, 0, 1), (4, 4))
+    
+    # points on the upper edges of the extent are counted, in the last row or column:
+    density.add_points([1, 0, 0.5], [1, 0, 0.5])
+    assert density.count.sum() == 3
+    assert density.count[3, 3] == density.count[0, 0] == density.count[2, 2] == 1
+    
+    # a segment hits one pixel per step along its longer direction, and the segments of a line do not count their shared ends twice:
+    density = LineDensity((0, 8, 0, 8), (8, 8))
+    density.add_line([0.5, 7.5, 7.5], [0.5, 0.5, 4.5])
+    assert density.count.sum() == 8 + 4
+    assert np.all(density.count[0] == 1) and np.all(density.count[1:5, 7] == 1)
+    
+    # drawing a curve chunk by chunk, or in small blocks, gives the same image as drawing it all at once:
+    t = np.linspace(0, 20, 5000)
+    x, y, z = np.cos(t) * t, np.sin(3*t), t
+    extent = (x.min(), x.max(), y.min(), y.max())
+    
+    whole = LineDensity(extent, (50, 60))
+    whole.add_line(x, y, z)
+    
+    chunked = LineDensity(extent, (50, 60), max_samples=100)
+    for k in range(0, len(t), 777):
+        chunked.add_line(x[k:k+777], y[k:k+777], z[k:k+777])
+        
+    assert np.array_equal(chunked.count, whole.count)
+    assert np.allclose(chunked.total, whole.total)
+    drawn = whole.count > 0
+    assert np.allclose(whole.image('mean').compressed(), whole.total[drawn] / whole.count[drawn])
@@ -35,60 +35,10 @@ import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
 from matplotlib.colors import ListedColormap, BoundaryNorm
 
+from Colored_lines import *  # colorline, and the level-of-detail helpers it uses
+from Line_density import *  # colordensity
 
-# Data manipulation:
 
-def make_segments(x, y):
-    '''
-    Create list of line segments from x and y coordinates, in the correct format for LineCollection:
-    an array of the form   numlines x (points per line) x 2 (x and y) array
-    '''
-
-    points = np.array([x, y]).T.reshape(-1, 1, 2)
-    segments = np.concatenate([points[:-1], points[1:]], axis=1)
-    
-    return segments
-
-
-# Interface to LineCollection:
-
-def colorline(x, y, z=None, ax=None, cmap=plt.get_cmap('copper'), norm=plt.Normalize(0.0, 1.0), 
-              linewidth=3, alpha=1.0):
-    '''
-    Draws a (multi-)colored 1D line in 2D, with coordinates x and y.
-    The variable color of the line is taken from optional data in z.
-    Returns the LineCollection created.
-    
-    z can be:
-    - empty, in which case a default coloring will be used based on the position along the input arrays
-    - a single number, for a uniform color [this can also be accomplished with the usual plt.plot]
-    - an array of the length of at least the same length as x, to color according to this data
-    - an array of a smaller length, in which case the colors are repeated along the curve
-    
-    See also: plt.streamplot
-    '''
-    
-    # Default colors equally spaced on [0,1]:
-    if z is None:
-        z = np.linspace(0.0, 1.0, len(x))
-           
-    # Special case if a single number:
-    if not hasattr(z, "__iter__"):  # to check for numerical input -- this is a hack
-        z = np.array([z])
-        
-    z = np.asarray(z)
-    
-    segments = make_segments(x, y)
-    lc = LineCollection(segments, array=z, cmap=cmap, norm=norm, linewidth=linewidth, alpha=alpha)
-    
-    if ax is None:
-        ax = plt.gca()
-    
-    ax.add_collection(lc)
-    
-    return lc
-        
-    
 def clear_frame(ax=None): 
     # Taken from a post by Tony S Yu
     if ax is None: 
@@ -237,6 +187,64 @@ plt.xlim(x.min(), x.max())
 plt.ylim(-1.0, 1.0)
 plt.show()
 
+# <headingcell level=2>
+
+# Example 6: A long random walk, decimated to the resolution of the axes
+
+# <codecell>
+
+# A random walk with a million steps, colored by its distance from the origin; with lod='minmax' only a few points 
+# per pixel column are drawn, and zooming in with plt.xlim draws the detail again
+
+n = 10**6
+walk = np.cumsum(np.random.randn(n))
+distance = np.abs(walk) / np.abs(walk).max()
+
+fig, axes = plt.subplots()
+
+lc = colorline(np.arange(n), walk, distance, cmap='viridis', linewidth=0.5, lod='minmax')
+
+plt.xlim(0, n)
+plt.ylim(walk.min(), walk.max())
+plt.show()
+
+# <headingcell level=2>
+
+# Example 7: Millions of points of an attractor, as a density image
+
+# <codecell>
+
+# The Henon attractor: a million points are counted into a histogram at the resolution of the axes, and shown with imshow.
+# Ten thousand orbits are iterated together with NumPy, and a generator passes on one step of all of them at a time,
+# so that the points are never held in memory all at once.
+
+from matplotlib.colors import LogNorm
+
+def henon_steps(steps, orbits=10**4, a=1.4, b=0.3, transient=100):
+    x, y = np.random.uniform(-0.1, 0.1, orbits), np.random.uniform(-0.1, 0.1, orbits)
+    for i in range(transient + steps):
+        x, y = 1 - a*x*x + y, b*x
+        if i >= transient:
+            yield x, y
+
+fig, axes = plt.subplots(figsize=(8, 4))
+
+colordensity(henon_steps(100), lines=False, extent=(-1.5, 1.5, -0.45, 0.45), cmap='magma', norm=LogNorm())
+plt.show()
+
+# <codecell>
+
+# Orbits drawn as a line, colored by the mean time at which each pixel is visited: 
+# ten orbits of 10^4 steps, one after the other
+
+steps = np.array(list(henon_steps(10**4, orbits=10)))  # (step, x or y, orbit)
+x, y = steps[:, 0].T.ravel(), steps[:, 1].T.ravel()
+
+fig, axes = plt.subplots(figsize=(8, 4))
+
+colordensity(x, y, np.tile(np.arange(10**4), 10), cmap='coolwarm')
+plt.show()
+
 # <codecell>
 
 d = {"H": 1, "He": 2}